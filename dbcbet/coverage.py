@@ -0,0 +1,203 @@
+"""
+Contract coverage, to right-size finitizations
+
+A contract_coverage monitor counts, for every precondition, postcondition,
+invariant and yields predicate, how often it was evaluated and how often it
+held or failed. A predicate which never failed (or never held) in a bet run
+points at a finitization too small to exercise it.
+
+    from dbcbet.coverage import coverage_bet
+    runner = coverage_bet(SomeClass)
+    runner.run()
+    print runner.coverage.report()
+
+coverage_bet also records the predicate outcomes seen while processing each
+candidate and each method call. Two values of a field (or of a method
+argument) which lead to the same outcomes whatever the other values are
+cannot tell anything apart, so all but one of them may be dropped from the
+finitization; the report lists them.
+
+The monitor also works outside bet: set_monitor(contract_coverage()).
+"""
+from __future__ import absolute_import
+
+import threading
+
+from dbcbet.dbcbet import bet, predicate_monitor, set_monitor, finitization_field_set
+
+class predicate_coverage(object):
+    """How often one predicate was evaluated, held and failed"""
+    __slots__ = ("evaluations", "true", "false")
+    def __init__(self):
+        self.evaluations = 0
+        self.true = 0
+        self.false = 0
+
+    def __repr__(self):
+        return "predicate_coverage(evaluations=%d, true=%d, false=%d)" % (self.evaluations, self.true, self.false)
+
+class contract_coverage(predicate_monitor):
+    """A predicate monitor counting the outcomes of every predicate.
+
+    counters maps (component, method name, predicate) to a predicate_coverage;
+    invariants are counted under the method name "". While a trace is open
+    (see begin and end) the outcomes are also appended to it."""
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.traces = []
+        self.redundant = []
+
+    def evaluate(self, pred, component, wrapped_method, args, kwargs):
+        result = bool(pred(*args, **kwargs))
+        name = "" if component == "inv" or wrapped_method is None else wrapped_method.__name__
+        key = (component, name, pred)
+        with self.lock:
+            entry = self.counters.get(key)
+            if entry is None:
+                entry = self.counters[key] = predicate_coverage()
+            entry.evaluations += 1
+            if result:
+                entry.true += 1
+            else:
+                entry.false += 1
+        for trace in self.traces:
+            trace.append((component, id(pred), result))
+        return result
+
+    def begin(self):
+        """Opens a trace; traces nest, an outcome goes to every open one"""
+        self.traces.append([])
+
+    def end(self):
+        """Closes the innermost trace and returns its outcomes"""
+        return tuple(self.traces.pop())
+
+    def report(self):
+        lines = []
+        for (component, name, pred), entry in sorted(self.counters.items(), key=lambda item: describe(*item[0])):
+            line = "%s: %d evaluations, %d true, %d false" % (describe(component, name, pred), entry.evaluations, entry.true, entry.false)
+            if not entry.false:
+                line += " (never failed)"
+            elif not entry.true:
+                line += " (never held)"
+            lines.append(line)
+        for what, keep, drop in self.redundant:
+            lines.append("%s: %s behave like %s and could be dropped" % (what, ", ".join(map(repr, drop)), repr(keep)))
+        return "\n".join(lines)
+
+def describe(component, name, pred):
+    label = "%s %s" % (component, getattr(pred, "__name__", repr(pred)))
+    return label + (" of " + name if name else "")
+
+def interchangeable(observations, position, size):
+    """Classes of value indices at position which give the same outcomes
+    in every observation where the other positions agree.
+
+    observations is a list of (tuple of value indices, outcomes)."""
+    groups = {}
+    for indices, outcomes in observations:
+        rest = indices[:position] + indices[position + 1:]
+        groups.setdefault(rest, {})[indices[position]] = outcomes
+    classes = []
+    for value in xrange(size):
+        for members in classes:
+            other = members[0]
+            shared = [group for group in groups.values() if value in group and other in group]
+            if shared and all(group[value] == group[other] for group in shared):
+                members.append(value)
+                break
+        else:
+            classes.append([value])
+    return [members for members in classes if len(members) > 1]
+
+def index_of(domain, value):
+    for position, candidate in enumerate(domain):
+        if candidate is value:
+            return position
+    return list(domain).index(value)
+
+class coverage_bet(bet):
+    """bet which records contract coverage (see the module documentation).
+
+    The invariants and preconditions bet evaluates itself are counted along
+    with those checked by the contracted methods."""
+    def __init__(self, clazz, coverage=None):
+        bet.__init__(self, clazz)
+        self.coverage = coverage if coverage is not None else contract_coverage()
+        self.candidate_outcomes = []
+        self.call_outcomes = {}
+
+    def run(self):
+        previous = set_monitor(self.coverage)
+        try:
+            bet.run(self)
+        finally:
+            set_monitor(previous)
+
+    def process_candidate(self, candidate, fs):
+        self.coverage.begin()
+        try:
+            bet.process_candidate(self, candidate, fs)
+        finally:
+            self.candidate_outcomes.append((fs, self.coverage.end()))
+
+    def satisfies_invariant(self, candidate):
+        for pred in candidate._invariant:
+            if not self.coverage.evaluate(pred, "inv", None, (candidate,), {}):
+                return False
+        return True
+
+    def process_precondition(self, val, candidate, args):
+        for predlist in getattr(val, "_precondition"):
+            success = True
+            for pred in predlist:
+                if not self.coverage.evaluate(pred, "pre", val, (candidate,) + tuple(args), {}):
+                    success = False
+            if success:
+                return True
+        return False
+
+    def call_method(self, candidate, fs, val):
+        for args in self.arguments_for(val):
+            if self.skips(val.__name__):
+                return
+            self.method_call_candidates += 1
+            self.coverage.begin()
+            try:
+                if hasattr(val, "_precondition"):
+                    self.call_with_args_and_precondition(candidate, fs, val, args)
+                else:
+                    self.log_precondition_not_found(val)
+                    self.call_with_args(candidate, fs, val, args)
+            finally:
+                calls = self.call_outcomes.setdefault(val.__name__, (val._bet_arguments, []))[1]
+                calls.append((fs, args, self.coverage.end()))
+
+    def print_invoice(self):
+        self.coverage.redundant = self.redundant_values()
+        bet.print_invoice(self)
+        print "Coverage: "
+        print self.coverage.report()
+
+    def redundant_values(self):
+        """(what, value kept, values which could be dropped) for every finitization"""
+        field_set = finitization_field_set(self.clazz)
+        names = sorted(field_set)
+        def fieldset_indices(fs):
+            return tuple(index_of(field_set[name], fs[name]) for name in names)
+        redundant = []
+        observations = [(fieldset_indices(fs), outcomes) for fs, outcomes in self.candidate_outcomes if fs]
+        for position, name in enumerate(names):
+            for members in interchangeable(observations, position, len(field_set[name])):
+                redundant.append(("field %s" % name, field_set[name][members[0]], [field_set[name][m] for m in members[1:]]))
+        for method in sorted(self.call_outcomes):
+            domains, calls = self.call_outcomes[method]
+            # the candidate's fields are part of the context every argument is compared in
+            observations = [((fieldset_indices(fs) if fs else ()) + tuple(index_of(domain, arg) for domain, arg in zip(domains, args)), outcomes)
+                            for fs, args, outcomes in calls]
+            offset = len(names) if calls[0][0] else 0
+            for position, domain in enumerate(domains):
+                for members in interchangeable(observations, offset + position, len(domain)):
+                    redundant.append(("argument %d of %s" % (position + 1, method), domain[members[0]], [domain[m] for m in members[1:]]))
+        return redundant
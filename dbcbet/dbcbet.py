@@ -7,10 +7,24 @@ The public API is:
 @pre(some_predicate) and @post(some_predicate) applied to a method
 @pre_final applied to a method
 @throws(exception1, ...) applied to a method
+@deferred applied to a method, with flush() to collect deferred violations
+with batch(instance): to check an instance's invariant once for many calls
+log_violations() to record violations in a bounded log instead of raising them
+set_monitor(circuit_breaker()) to sample or turn off predicates which are too slow
+@pure applied to a query method, to cache its results and skip its contracts on a hit
+@yields(some_predicate) applied to a generator method, checked on each item as it is consumed
+name = field(type, constraint, ...) in a class, checked when the field is assigned
+set_level(level) or with assertion_level(level): to choose what is checked,
+  where pre, post and inv take cost="expensive" for predicates only checked at the top level
 The functions (predicates) used by the decorators have different 
 signatures based on the type of contract component and on the 
 signature of the method they apply to
 """
+from __future__ import absolute_import
+
+import itertools
+import operator
+import threading
 
 """TODO: reintroduce contract write braces and contract execution braces
 Global level for write and execute
@@ -33,57 +47,95 @@ class inv(object):
         from types import MethodType
         return MethodType(self, instance, owner)
 
-    def __init__(self, invariant, inherit=True):
+    def __init__(self, invariant, inherit=True, cost=None):
+        from dbcbet.expressions import compiled
+        invariant = compiled(invariant, "inv")
+        if cost is not None:
+            invariant = with_cost(invariant, cost)
         self.invariant = invariant
         self.inherit=inherit
 
     def __call__(self, clazz):
         self.clazz = clazz
-        if hasattr(clazz, "_invariant_class") and clazz._invariant_class == clazz.__name__:            
-            clazz._invariant.append(self.invariant)
+        if "_uninherited_invariant" in clazz.__dict__:
+            clazz._uninherited_invariant.append(self.invariant)
         else:
-            clazz._invariant = [self.invariant]
-            clazz._invariant_class = clazz.__name__
-        ensure_invoker(self.clazz)
-        if self.inherit:
-            inherit_contract(clazz)
+            clazz._uninherited_invariant = [self.invariant]
+        if not self.inherit:
+            clazz._inherit_contract = False
+        decorate_class(clazz)
         return clazz
 
-def ensure_invoker(class_):
-    import inspect
-    mets = inspect.getmembers(class_, predicate=inspect.ismethod)
-    for methodname, method in mets:
-        if is_public(methodname):
-            if not hasattr(method, "_invoker_exists"):
-                setattr(class_, methodname, create_invoker(method))
-
-def check_preconditions(wrapped_method, s, *args, **kwargs):
-    violations = []
-    if not hasattr(wrapped_method, "_precondition"):
-        return
-    for pred_list in wrapped_method._precondition:
-        for pred in pred_list:
-            if not pred(s, *args, **kwargs):
-                violations.append(pred)
-                break
-        else:
-            # pred_list was exhausted with no break
+#
+# The check functions for pre, post, yields and inv are built from where
+# their predicates come from (see contract_part) and how a predicate is
+# evaluated: called directly (evaluate=None) or through a predicate
+# monitor's evaluate. install_checks binds the ones in use
+#
+def precondition_check(precondition_of, evaluate=None):
+    def check_preconditions(wrapped_method, s, *args, **kwargs):
+        violations = []
+        if not hasattr(wrapped_method, "_precondition"):
+            return
+        for pred_list in precondition_of(wrapped_method):
+            for pred in pred_list:
+                if evaluate is None:
+                    holds = pred(s, *args, **kwargs)
+                else:
+                    holds = evaluate(pred, "pre", wrapped_method, (s,) + args, kwargs)
+                if not holds:
+                    violations.append(pred)
+                    break
+            else:
+                # pred_list was exhausted with no break
+                return
+        report(PreconditionViolation(violations, s, wrapped_method.__wrapped__, args, kwargs))
+    return check_preconditions
+
+def postcondition_check(postcondition_of, evaluate=None):
+    def check_postconditions(wrapped_method, s, old, ret, *args, **kwargs):
+        if not hasattr(wrapped_method, "_postcondition"):
             return
-    raise PreconditionViolation(violations, s, wrapped_method.__wrapped__, args, kwargs)                    
+        for pred in postcondition_of(wrapped_method):
+            if evaluate is None:
+                holds = pred(s, old, ret, *args, **kwargs)
+            else:
+                holds = evaluate(pred, "post", wrapped_method, (s, old, ret) + args, kwargs)
+            if not holds:
+                report(PostconditionViolation(pred, s, old, ret, wrapped_method.__wrapped__, args, kwargs))
+                return
+    return check_postconditions
 
-def check_postconditions(wrapped_method, s, old, ret, *args, **kwargs):
-    if not hasattr(wrapped_method, "_postcondition"):
-        return
-    for pred in wrapped_method._postcondition:
-        if not pred(s, old, ret, *args, **kwargs):
-            raise PostconditionViolation(pred, s, old, ret, wrapped_method.__wrapped__, args, kwargs)
+def yields_check(yields_of, evaluate=None):
+    def check_yields(wrapped_method, s, item, index, *args, **kwargs):
+        if not hasattr(wrapped_method, "_yields"):
+            return
+        for pred in yields_of(wrapped_method):
+            if evaluate is None:
+                holds = pred(s, item, *args, **kwargs)
+            else:
+                holds = evaluate(pred, "yields", wrapped_method, (s, item) + args, kwargs)
+            if not holds:
+                report(YieldViolation(pred, s, item, index, wrapped_method.__wrapped__, args, kwargs))
+                return
+    return check_yields
 
-def check_invariants(wrapped_method, s, *args, **kwargs):
-    if not hasattr(s.__class__, "_invariant"):
-        return
-    for pred in s.__class__._invariant:
-        if not pred(s):
-            raise InvariantViolation(pred, s, wrapped_method.__wrapped__, args, kwargs)
+def invariant_check(invariant_of, evaluate=None):
+    def check_invariants(wrapped_method, s, *args, **kwargs):
+        if not hasattr(s.__class__, "_invariant"):
+            return
+        if _batches and id(s) in _batches:
+            _batches[id(s)].record(wrapped_method, args, kwargs)
+            return
+        for pred in invariant_of(s.__class__):
+            if evaluate is None:
+                holds = pred(s)
+            else:
+                holds = evaluate(pred, "inv", wrapped_method, (s,), {})
+            if not holds:
+                report(InvariantViolation(pred, s, wrapped_method.__wrapped__, args, kwargs))
+                return
+    return check_invariants
 
 def check_throws(wrapped_method, ex, s, *args, **kwargs):
     """Exceptions are checked against the contractually allowed types."""
@@ -99,114 +151,1211 @@ def check_throws(wrapped_method, ex, s, *args, **kwargs):
         if isinstance(ex, exception_type):
             return True
 
-    # Exception was not allowed
-    raise ThrowsViolation(ex, s, wrapped_method.__wrapped__, args, kwargs)
+    # Exception was not allowed; when violations are only logged, the original exception propagates
+    report(ThrowsViolation(ex, s, wrapped_method.__wrapped__, args, kwargs))
+    return True
+
+#
+# Assertion levels: the check functions for a level skip whole components
+# and, below "expensive", predicates tagged with cost="expensive"
+#
+LEVELS = ("none", "pre", "post", "all", "expensive")
+COSTS = ("cheap", "expensive")
+_level = "expensive"
+_thread_level = threading.local()
+_context_levels = 0
+_context_levels_lock = threading.Lock()
+_contract_version = 0
+
+def cost_of(predicate):
+    return getattr(predicate, "_cost", "cheap")
+
+def with_cost(predicate, cost):
+    """predicate tagged with a cost class; a wrapper if it carries another one"""
+    if cost not in COSTS:
+        raise ValueError("cost must be one of %s, not %r" % (", ".join(COSTS), cost))
+    if cost_of(predicate) == cost:
+        return predicate
+    from dbcbet.helpers import wraps
+    @wraps(predicate)
+    def costed_predicate(*args, **kwargs):
+        return predicate(*args, **kwargs)
+    costed_predicate._cost = cost
+    return costed_predicate
+
+def contract_changed():
+    """Invalidates the cached cheap contracts"""
+    global _contract_version
+    _contract_version += 1
+
+def cheap_contract(wrapped_method):
+    """(version, precondition, postcondition, yields) of wrapped_method without its expensive predicates"""
+    cached = wrapped_method.__dict__.get("_cheap_contract")
+    if cached is None or cached[0] != _contract_version:
+        precondition = getattr(wrapped_method, "_precondition", None)
+        if precondition is not None:
+            precondition = [[pred for pred in pred_list if cost_of(pred) == "cheap"] for pred_list in precondition]
+        postcondition = [pred for pred in getattr(wrapped_method, "_postcondition", ()) if cost_of(pred) == "cheap"]
+        yields = [pred for pred in getattr(wrapped_method, "_yields", ()) if cost_of(pred) == "cheap"]
+        cached = wrapped_method._cheap_contract = (_contract_version, precondition, postcondition, yields)
+    return cached
+
+def cheap_invariant(clazz):
+    """The invariant of clazz without its expensive predicates"""
+    cached = clazz.__dict__.get("_cheap_invariant")
+    if cached is None or cached[0] != _contract_version:
+        cached = (_contract_version, [pred for pred in clazz._invariant if cost_of(pred) == "cheap"])
+        clazz._cheap_invariant = cached
+    return cached[1]
+
+# where each component's predicates are on an invoker, and in cheap_contract
+CONTRACT_PARTS = {"pre": ("_precondition", 1), "post": ("_postcondition", 2), "yields": ("_yields", 3)}
+
+def contract_part(component, level):
+    """A function giving the predicates of component checked at level, from
+    an invoker (or, for "inv", from a class)"""
+    if component == "inv":
+        return operator.attrgetter("_invariant") if level == "expensive" else cheap_invariant
+    attribute, index = CONTRACT_PARTS[component]
+    if level == "expensive":
+        return operator.attrgetter(attribute)
+    return lambda wrapped_method: cheap_contract(wrapped_method)[index]
+
+def cheap_snapshot_old(wrapped_method, method, s, args, kwargs):
+    return old_for(cheap_contract(wrapped_method)[2], wrapped_method, method, s, args, kwargs)
+
+def skip_check(*args, **kwargs):
+    return None
+
+def skip_throws_check(*args, **kwargs):
+    # True lets the exception propagate
+    return True
+
+def current_level():
+    """The assertion level of the calling thread"""
+    return getattr(_thread_level, "level", _level)
+
+def set_level(level):
+    """Sets the process-wide assertion level; returns the previous one.
+
+    none checks nothing, pre checks preconditions, post adds postconditions,
+    all adds invariants and throws, and expensive (the default) also checks
+    predicates tagged with cost="expensive"."""
+    global _level
+    if level not in LEVELS:
+        raise ValueError("level must be one of %s, not %r" % (", ".join(LEVELS), level))
+    previous, _level = _level, level
+    install_checks()
+    return previous
+
+class assertion_level(object):
+    """A context manager which sets the assertion level of the calling thread.
+
+    While any such block is active, the invoker looks the level up on each
+    call; otherwise the process-wide level is compiled into the check functions."""
+    def __init__(self, level):
+        if level not in LEVELS:
+            raise ValueError("level must be one of %s, not %r" % (", ".join(LEVELS), level))
+        self.level = level
+
+    def __enter__(self):
+        global _context_levels
+        self.previous = getattr(_thread_level, "level", None)
+        _thread_level.level = self.level
+        with _context_levels_lock:
+            _context_levels += 1
+            if _context_levels == 1:
+                install_checks()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _context_levels
+        if self.previous is None:
+            del _thread_level.level
+        else:
+            _thread_level.level = self.previous
+        with _context_levels_lock:
+            _context_levels -= 1
+            if _context_levels == 0:
+                install_checks()
+        return False
+
+#
+# The invoker looks the check functions up as module globals, so assertion
+# levels, a predicate monitor and metrics swap in other versions, and cost
+# nothing when they are not used
+#
+check_preconditions = precondition_check(contract_part("pre", "expensive"))
+check_postconditions = postcondition_check(contract_part("post", "expensive"))
+check_yields = yields_check(contract_part("yields", "expensive"))
+check_invariants = invariant_check(contract_part("inv", "expensive"))
+
+_check_functions = {}
+_compiled_checks = {}
+_monitor = None
+_metrics_record = None
+
+def check_function_table():
+    """name: (component, lowest level checking it, build(level, evaluate), skipped, whether it applies to a call)"""
+    if not _check_functions:
+        def checking(check, component):
+            return lambda level, evaluate: check(contract_part(component, level), evaluate)
+        # the table is built before install_checks first rebinds these globals
+        throws, snapshot = check_throws, snapshot_old
+        _check_functions.update({
+            "check_preconditions": ("pre", "pre", checking(precondition_check, "pre"), skip_check,
+                                    lambda wrapped_method, s: hasattr(wrapped_method, "_precondition")),
+            "check_postconditions": ("post", "post", checking(postcondition_check, "post"), skip_check,
+                                     lambda wrapped_method, s: hasattr(wrapped_method, "_postcondition")),
+            "check_yields": ("yields", "post", checking(yields_check, "yields"), skip_check,
+                             lambda wrapped_method, s: hasattr(wrapped_method, "_yields")),
+            "check_invariants": ("inv", "all", checking(invariant_check, "inv"), skip_check,
+                                 lambda wrapped_method, s: hasattr(s.__class__, "_invariant") and not (_batches and id(s) in _batches)),
+            "check_throws": ("throws", "all", lambda level, evaluate: throws, skip_throws_check,
+                             lambda wrapped_method, s: hasattr(wrapped_method, "_throws")),
+            "snapshot_old": (None, "post", lambda level, evaluate: snapshot if level == "expensive" else cheap_snapshot_old,
+                             skip_check, None),
+            })
+    return _check_functions
+
+def checks_for(level):
+    """The check functions (by global name) for level, with the current monitor and metrics"""
+    rank = LEVELS.index(level)
+    evaluate = _monitor.evaluate if _monitor is not None else None
+    checks = {}
+    for name, (component, lowest, build, skipped, applies_to) in check_function_table().items():
+        if rank < LEVELS.index(lowest):
+            checks[name] = skipped
+            continue
+        check = build(level, evaluate)
+        if _metrics_record is not None and component is not None:
+            check = metered(check, component, applies_to, _metrics_record, name == "check_throws")
+        checks[name] = check
+    return checks
+
+def level_dispatcher(name):
+    def dispatch(*args, **kwargs):
+        return _compiled_checks[current_level()][name](*args, **kwargs)
+    dispatch.__name__ = name
+    return dispatch
+
+def install_checks():
+    """Binds the check function globals for the current level, monitor and metrics"""
+    for level in LEVELS:
+        _compiled_checks[level] = checks_for(level)
+    for name, check in _compiled_checks[_level].items():
+        if _context_levels:
+            check = level_dispatcher(name)
+        globals()[name] = check
+
+def instrument_checks(record):
+    """Makes the check functions report to record(class, method, component, seconds, violated).
+
+    record=None restores the plain check functions."""
+    global _metrics_record
+    _metrics_record = record
+    install_checks()
+
+def set_monitor(monitor):
+    """Routes every predicate evaluation through monitor.evaluate; returns the previous monitor.
+
+    monitor=None restores the plain check functions."""
+    global _monitor
+    previous, _monitor = _monitor, monitor
+    install_checks()
+    return previous
+
+class predicate_monitor(object):
+    """Evaluates predicates on behalf of the check functions.
+
+    evaluate receives the predicate, its component (pre, post or inv), the
+    wrapped method (None for the invariant check at the end of a batch) and
+    the predicate's arguments, and returns the predicate's verdict."""
+    def evaluate(self, pred, component, wrapped_method, args, kwargs):
+        return pred(*args, **kwargs)
+
+#
+# Cost-budget circuit breaker
+#
+class predicate_cost(object):
+    """The time one predicate has taken, and how often a circuit_breaker checks it"""
+    __slots__ = ("predicate", "component", "calls", "skipped", "total", "window_start", "window",
+                 "state", "since", "countdown")
+    def __init__(self, predicate, component):
+        self.predicate = predicate
+        self.component = component
+        self.calls = 0
+        self.skipped = 0
+        self.total = 0.0
+        self.window_start = 0.0
+        self.window = 0.0
+        self.state = "on"
+        self.since = 0.0
+        self.countdown = 0
+
+class breaker_event(object):
+    """A predicate moved to another state (on, sampled or off)"""
+    __slots__ = ("predicate", "component", "state", "reason", "time")
+    def __init__(self, predicate, component, state, reason, time):
+        self.predicate = predicate
+        self.component = component
+        self.state = state
+        self.reason = reason
+        self.time = time
+
+    def __str__(self):
+        name = getattr(self.predicate, "__name__", repr(self.predicate))
+        return "%s predicate %s is now %s: %s" % (self.component, name, self.state, self.reason)
+
+class circuit_breaker(predicate_monitor):
+    """A predicate monitor which caps the time spent in slow predicates.
+
+    Each predicate has two budgets: per_call seconds for one evaluation, and
+    per_second seconds of evaluation within any one-second window. A
+    predicate over budget is sampled (checked once every sample_rate calls,
+    assumed to hold otherwise); over budget again, it is turned off. After
+    cooldown seconds it is checked on every call again. Every change is
+    passed to on_event, which logs it by default.
+
+        set_monitor(circuit_breaker(per_call=0.005))"""
+    def __init__(self, per_call=0.01, per_second=0.1, sample_rate=100, cooldown=60.0, on_event=None):
+        self.per_call = per_call
+        self.per_second = per_second
+        self.sample_rate = sample_rate
+        self.cooldown = cooldown
+        self.on_event = on_event if on_event is not None else self.log_event
+        self.costs = {}
+        self.lock = threading.Lock()
+
+    def log_event(self, event):
+        import logging
+        logging.getLogger("dbcbet").warning("%s", event)
+
+    def evaluate(self, pred, component, wrapped_method, args, kwargs):
+        import time
+        cost = self.costs.get(pred)
+        if cost is None:
+            cost = self.costs.setdefault(pred, predicate_cost(pred, component))
+        if cost.state != "on":
+            now = time.time()
+            if now - cost.since >= self.cooldown:
+                self.switch(cost, "on", "cool-down of %gs is over" % self.cooldown, now)
+            elif cost.state == "off":
+                cost.skipped += 1
+                return True
+            else:
+                cost.countdown -= 1
+                if cost.countdown > 0:
+                    cost.skipped += 1
+                    return True
+                cost.countdown = self.sample_rate
+        start = time.time()
+        result = pred(*args, **kwargs)
+        end = time.time()
+        elapsed = end - start
+        cost.calls += 1
+        cost.total += elapsed
+        if end - cost.window_start >= 1.0:
+            cost.window_start = end
+            cost.window = 0.0
+        cost.window += elapsed
+        if elapsed > self.per_call:
+            self.trip(cost, "one call took %gs, over the budget of %gs" % (elapsed, self.per_call), end)
+        elif cost.window > self.per_second:
+            self.trip(cost, "took %gs within a second, over the budget of %gs" % (cost.window, self.per_second), end)
+        return result
+
+    def trip(self, cost, reason, now):
+        self.switch(cost, "sampled" if cost.state == "on" else "off", reason, now)
+
+    def switch(self, cost, state, reason, now):
+        with self.lock:
+            if cost.state == state:
+                return
+            cost.state = state
+            cost.since = now
+            cost.countdown = self.sample_rate
+            cost.window_start = now
+            cost.window = 0.0
+        self.on_event(breaker_event(cost.predicate, cost.component, state, reason, now))
+
+def metered(check, component, applies_to, record, exception_first):
+    import time
+    def metered_check(wrapped_method, *args, **kwargs):
+        s = args[1] if exception_first else args[0]
+        if not applies_to(wrapped_method, s):
+            return check(wrapped_method, *args, **kwargs)
+        violated = False
+        # violations that are logged instead of raised only show in the count
+        logged = getattr(_logged, "count", 0)
+        start = time.time()
+        try:
+            return check(wrapped_method, *args, **kwargs)
+        except ContractViolation:
+            violated = True
+            raise
+        finally:
+            violated = violated or getattr(_logged, "count", 0) != logged
+            record(s.__class__.__name__, wrapped_method.__name__, component, time.time() - start, violated)
+    metered_check.__name__ = check.__name__
+    return metered_check
 
 def create_invoker(method):
     """One wrapper checks all contract components and invokes the method."""
     from functools import wraps
+    import inspect
+    if inspect.isgeneratorfunction(method):
+        return create_generator_invoker(method)
     @wraps(method)
     def wrapped_method(s, *args, **kwargs):
+        key = None
+        if wrapped_method._pure is not None:
+            cache, key = pure_cache(wrapped_method, s, args, kwargs)
+            if key is not None:
+                entry = cache.get(key)
+                if entry is not None:
+                    entry[1] = next(_pure_ticks)
+                    return entry[0]
+
         check_preconditions(wrapped_method, s, *args, **kwargs)
 
-        # A deep copy of the object and arguments are created for the postcondition
-        o = old(method, s, args, kwargs)
+        # A deep copy (or just a fingerprint) of the object and arguments is created for the postcondition
+        o = snapshot_old(wrapped_method, method, s, args, kwargs)
 
         try:
             ret = method(s, *args, **kwargs)
             
-            check_postconditions(wrapped_method, s, o, ret, *args, **kwargs)
+            if not defer_postconditions(wrapped_method, s, o, ret, args, kwargs):
+                check_postconditions(wrapped_method, s, o, ret, *args, **kwargs)
             check_invariants(wrapped_method, s, *args, **kwargs)
         except Exception as ex:
             if check_throws(wrapped_method, ex, s, *args, **kwargs):
                 raise
+        if key is not None:
+            remember(cache, key, ret, wrapped_method._pure)
         return ret
 
     wrapped_method.__wrapped__ = method
     wrapped_method._invoker_exists = True
+    wrapped_method._pure = None
     return wrapped_method
 
-def dbc(clazz):
-    """A callable object (decorator) which applies the inheritance of a contract without applying an invariant"""
-    ensure_invoker(clazz)
-    inherit_contract(clazz)
-    return clazz
+def create_generator_invoker(method):
+    """The invoker of a generator method, which checks its contract as the items stream by.
+
+    Preconditions are checked (and old is taken) when the method is called.
+    Each item is checked against the @yields predicates as it is consumed.
+    The postconditions and invariants are checked on exhaustion, with the
+    number of items as the return value; a generator abandoned early is not
+    checked further. No item is kept."""
+    from functools import wraps
+    @wraps(method)
+    def wrapped_method(s, *args, **kwargs):
+        check_preconditions(wrapped_method, s, *args, **kwargs)
+        o = snapshot_old(wrapped_method, method, s, args, kwargs)
+        return checked_items(wrapped_method, method(s, *args, **kwargs), s, o, args, kwargs)
+
+    wrapped_method.__wrapped__ = method
+    wrapped_method._invoker_exists = True
+    wrapped_method._pure = None
+    return wrapped_method
+
+def checked_items(wrapped_method, items, s, o, args, kwargs):
+    count = 0
+    try:
+        for item in items:
+            check_yields(wrapped_method, s, item, count, *args, **kwargs)
+            count += 1
+            yield item
+        check_postconditions(wrapped_method, s, o, count, *args, **kwargs)
+        check_invariants(wrapped_method, s, *args, **kwargs)
+    except Exception as ex:
+        if check_throws(wrapped_method, ex, s, *args, **kwargs):
+            raise
+    finally:
+        items.close()
 
-def propogate_unwrapped(method):
-    while True:
+#
+# Memoization of pure methods
+#
+_pure_caches = {}
+# each cache entry is [result, tick of its last use], so a hit takes no lock
+_pure_ticks = itertools.count()
+_pure_eviction_lock = threading.Lock()
+
+def pure(method=None, maxsize=128):
+    """A decorator which caches the results of a query method, per instance and arguments.
+
+    Contracts only run when a call misses the cache. Writing or deleting any
+    attribute of the instance empties its caches, and each method keeps at
+    most maxsize results, evicting the least recently used ones. The method must
+    not depend on anything but self's attributes and its arguments (state it
+    with helpers.const); mutating an object self refers to goes unnoticed.
+    Overrides of a pure method are pure too. Use as @pure or @pure(maxsize=16)."""
+    if method is None:
+        return lambda method: pure(method, maxsize)
+    if hasattr(method, "_invoker_exists"):
+        wrapped_method = method
+    else:
+        wrapped_method = create_invoker(method)
+    wrapped_method._uninherited_pure = wrapped_method._pure = maxsize
+    return wrapped_method
+
+def remember(cache, key, ret, maxsize):
+    """Stores a result; a full cache drops its least recently used quarter"""
+    cache[key] = [ret, next(_pure_ticks)]
+    if len(cache) > maxsize:
+        with _pure_eviction_lock:
+            by_age = sorted(cache.items(), key=lambda item: item[1][1])
+            for old_key, entry in by_age[:len(by_age) - maxsize * 3 // 4]:
+                cache.pop(old_key, None)
+
+def pure_cache(wrapped_method, s, args, kwargs):
+    """The cache of wrapped_method on s and the key of this call; (None, None) if it can't be cached"""
+    import weakref
+    try:
+        key = (args, frozenset(kwargs.iteritems())) if kwargs else args
+        hash(key)
+    except TypeError:
+        return None, None
+    entry = _pure_caches.get(id(s))
+    if entry is None:
+        instance_id = id(s)
         try:
-            if hasattr(method, "__wrapped__"):
-                unwrapped = method.__wrapped__
-                preserve_contracts_instance(unwrapped, method)
-                method = unwrapped
-            else:
+            reference = weakref.ref(s, lambda reference: _pure_caches.pop(instance_id, None))
+        except TypeError:
+            return None, None
+        invalidate_pure_caches_on_write(s.__class__)
+        entry = _pure_caches[instance_id] = (reference, {})
+    caches = entry[1]
+    cache = caches.get(wrapped_method)
+    if cache is None:
+        cache = caches.setdefault(wrapped_method, {})
+    return cache, key
+
+def invalidate_pure_caches_on_write(clazz):
+    """Makes attribute writes and deletes on instances of clazz empty their pure caches"""
+    if getattr(getattr(clazz, "__setattr__", None), "_invalidates_pure_caches", False):
+        return
+    original_setattr = getattr(clazz, "__setattr__", None)
+    original_delattr = getattr(clazz, "__delattr__", None)
+    def __setattr__(self, name, value):
+        _pure_caches.pop(id(self), None)
+        if original_setattr is None:
+            # old-style class
+            self.__dict__[name] = value
+        else:
+            original_setattr(self, name, value)
+    def __delattr__(self, name):
+        _pure_caches.pop(id(self), None)
+        if original_delattr is None:
+            del self.__dict__[name]
+        else:
+            original_delattr(self, name)
+    __setattr__._invalidates_pure_caches = True
+    clazz.__setattr__ = __setattr__
+    clazz.__delattr__ = __delattr__
+
+#
+# Deferred postcondition checking
+#
+def deferred(method):
+    """A decorator which moves a method's postcondition checks to the worker pool"""
+    if hasattr(method, "_invoker_exists"):
+        wrapped_method = method
+    else:
+        wrapped_method = create_invoker(method)
+    wrapped_method._deferred = True
+    return wrapped_method
+
+class postcondition_pool(object):
+    """Checks postconditions on background threads.
+
+    The invoker hands over old, the return value, and a snapshot of self.
+    The queue is bounded: when it is full, submit refuses the work and the
+    invoker checks the postconditions inline instead, so the caller never waits.
+    Violations go to the callback, or are kept until the next flush()."""
+    def __init__(self, workers=2, maxsize=1024, callback=None, all_methods=False):
+        import Queue
+        self.queue = Queue.Queue(maxsize)
+        self.callback = callback
+        self.all_methods = all_methods
+        self.violations = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._work, name="dbcbet-postcondition-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def applies_to(self, wrapped_method):
+        return self.all_methods or hasattr(wrapped_method, "_deferred")
+
+    def submit(self, wrapped_method, s, old, ret, args, kwargs):
+        import Queue
+        # don't pay for the snapshot if it would be refused anyway
+        if self.queue.full():
+            return False
+        try:
+            self.queue.put_nowait((wrapped_method, snapshot(s), old, ret, args, kwargs))
+        except Queue.Full:
+            return False
+        return True
+
+    def flush(self):
+        """Waits for all queued checks and returns (and forgets) the collected violations"""
+        import Queue
+        # help the workers drain the queue; this also works with no workers at all
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
                 break
-        except AttributeError:
-            break
+            self._process(item)
+        self.queue.join()
+        with self.lock:
+            violations, self.violations = self.violations, []
+        return violations
+
+    def shutdown(self):
+        """Stops the workers once the queue is drained, returning outstanding violations"""
+        violations = self.flush()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return violations
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            self._process(item)
 
-# def preserve_contracts(wrapped_method, method):
-#     if hasattr(method, "_postcondition"): wrapped_method._postcondition = method._postcondition
-#     if hasattr(method, "_precondition"): wrapped_method._precondition = method._precondition
-#     if hasattr(method, "_invariant"): wrapped_method._invariant = method._invariant
-#     if hasattr(method, "_throws"): wrapped_method._throws = method._throws
- 
-def preserve_contracts_instance(wrapped_method, method):
-    if hasattr(method.__func__, "_postcondition"):
+    def _process(self, item):
+        wrapped_method, s, old, ret, args, kwargs = item
         try:
-            wrapped_method.__func__._postcondition = method.__func__._postcondition
-        except AttributeError:
-            wrapped_method._postcondition = method.__func__._postcondition
-    if hasattr(method.__func__, "_precondition"):
+            check_postconditions(wrapped_method, s, old, ret, *args, **kwargs)
+        except Exception as ex:
+            self._report(ex)
+        finally:
+            self.queue.task_done()
+
+    def _report(self, violation):
+        if self.callback is not None:
+            self.callback(violation)
+        else:
+            with self.lock:
+                self.violations.append(violation)
+
+_postcondition_pool = None
+_postcondition_pool_lock = threading.RLock()
+
+def enable_deferred_postconditions(workers=2, maxsize=1024, callback=None, all_methods=False):
+    """Starts the postcondition worker pool.
+
+    With all_methods=True every postcondition is deferred (global mode);
+    otherwise only methods decorated with @deferred are. Violations a
+    previous pool had not reported yet are carried over: they go to the
+    callback, or to the next flush()."""
+    global _postcondition_pool
+    with _postcondition_pool_lock:
+        pending = disable_deferred_postconditions()
+        pool = postcondition_pool(workers, maxsize, callback, all_methods)
+        for violation in pending:
+            pool._report(violation)
+        _postcondition_pool = pool
+    return pool
+
+def disable_deferred_postconditions():
+    """Stops the worker pool and returns any violations it had not reported yet"""
+    global _postcondition_pool
+    with _postcondition_pool_lock:
+        pool, _postcondition_pool = _postcondition_pool, None
+        if pool is None:
+            return []
+        return pool.shutdown()
+
+def flush():
+    """Waits for deferred postcondition checks and returns the violations found"""
+    if _postcondition_pool is None:
+        return []
+    return _postcondition_pool.flush()
+
+def defer_postconditions(wrapped_method, s, old, ret, args, kwargs):
+    """Returns True if the postconditions were handed to the worker pool.
+
+    @deferred methods start a default pool on first use."""
+    if not hasattr(wrapped_method, "_postcondition"):
+        return False
+    if LEVELS.index(current_level()) < LEVELS.index("post"):
+        # postconditions are not checked at this level, so self is not copied for them
+        return False
+    if old is not None and old.fingerprint is not None:
+        # only fingerprinting postconditions (const): checking them inline costs no copy of self
+        return False
+    pool = _postcondition_pool
+    if pool is None:
+        if not hasattr(wrapped_method, "_deferred"):
+            return False
+        with _postcondition_pool_lock:
+            # another thread may have started it meanwhile
+            pool = _postcondition_pool
+            if pool is None:
+                pool = enable_deferred_postconditions()
+    if not pool.applies_to(wrapped_method):
+        return False
+    return pool.submit(wrapped_method, s, old, ret, args, kwargs)
+
+#
+# Batch-scoped invariant deferral
+#
+_batches = {}
+
+class batch(object):
+    """A context manager which suspends invariant checks on one instance.
+
+    Preconditions and postconditions are still checked on every call. When the
+    block exits normally, the invariant runs once; a violation is raised as a
+    BatchInvariantViolation listing the calls made in the batch. Nested batches
+    on the same instance join the outermost one."""
+    def __init__(self, instance):
+        self.instance = instance
+        self.calls = []
+        self.active = False
+
+    def record(self, wrapped_method, args, kwargs):
+        self.calls.append((wrapped_method.__wrapped__, args, kwargs))
+
+    def __enter__(self):
+        if id(self.instance) not in _batches:
+            _batches[id(self.instance)] = self
+            self.active = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.active:
+            return False
+        del _batches[id(self.instance)]
+        self.active = False
+        # an exception from the block is more useful than a follow-up violation
+        level = current_level()
+        if exc_type is None and hasattr(self.instance.__class__, "_invariant") and LEVELS.index(level) >= LEVELS.index("all"):
+            if level == "expensive":
+                invariant = self.instance.__class__._invariant
+            else:
+                invariant = cheap_invariant(self.instance.__class__)
+            for pred in invariant:
+                if _monitor is None:
+                    satisfied = pred(self.instance)
+                else:
+                    satisfied = _monitor.evaluate(pred, "inv", None, (self.instance,), {})
+                if not satisfied:
+                    report(BatchInvariantViolation(pred, self.instance, self.calls))
+                    break
+        return False
+
+#
+# Log-and-continue violation mode
+#
+_violation_log = None
+_logged = threading.local()  # per thread: how many violations were logged
+
+def report(violation):
+    """Raises violation, or records it when violations are logged instead"""
+    if _violation_log is None:
+        raise violation
+    _logged.count = getattr(_logged, "count", 0) + 1
+    _violation_log.record(violation)
+
+class violation_record(object):
+    """What a violation_log keeps of a violation: short reprs and a weak reference to the instance"""
+    __slots__ = ("kind", "time", "classname", "method", "contract", "instance_repr", "arguments", "_instance")
+    def __init__(self, violation, shorten):
+        import time
+        import weakref
+        self.kind = type(violation).__name__
+        self.time = time.time()
+        self.classname = violation.instance.__class__.__name__
+        self.method = getattr(violation.method, "__name__", None)
+        if hasattr(violation, "predicate_list"):
+            self.contract = ', '.join(map(violation.predicate_string, violation.predicate_list))
+        elif hasattr(violation, "predicate"):
+            self.contract = violation.predicate_string(violation.predicate)
+        else:
+            self.contract = "threw %s" % shorten(violation.exception)
+        self.instance_repr = shorten(violation.instance)
+        self.arguments = ', '.join(map(shorten, violation.args) + ["%s=%s" % (key, shorten(value)) for key, value in violation.kwargs.items()])
         try:
-            wrapped_method.__func__._precondition = method.__func__._precondition
-        except AttributeError:
-            wrapped_method._precondition = method.__func__._precondition
-    if hasattr(method.__func__, "_throws"):
+            self._instance = weakref.ref(violation.instance)
+        except TypeError:
+            self._instance = None
+
+    def instance(self):
+        """The instance, if it is still alive"""
+        return None if self._instance is None else self._instance()
+
+    def __str__(self):
+        return "%s: Instance of %s failed when calling %s(%s). Contract: %s" % (self.kind, self.classname, self.method, self.arguments, self.contract)
+
+class violation_log(object):
+    """Records contract violations instead of raising them, so the call goes on.
+
+    The last size violations are kept as violation_records, so memory stays
+    bounded however many violations happen. At most rate violations per
+    interval seconds go to the logger; the others are counted, and the count
+    is logged with the next message that gets through."""
+    def __init__(self, size=1000, logger=None, rate=10, interval=60.0, repr_limit=200):
+        import collections
+        import logging
+        import repr as reprlib
+        self.entries = collections.deque(maxlen=size)
+        self.logger = logger if logger is not None else logging.getLogger("dbcbet")
+        self.rate = rate
+        self.interval = interval
+        self.repr = reprlib.Repr()
+        self.repr.maxstring = self.repr.maxother = repr_limit
+        self.lock = threading.Lock()
+        self.total = 0
+        self.window_start = 0.0
+        self.logged_in_window = 0
+        self.suppressed = 0
+
+    def shorten(self, value):
+        return self.repr.repr(value)
+
+    def record(self, violation):
+        entry = violation_record(violation, self.shorten)
+        with self.lock:
+            self.entries.append(entry)
+            self.total += 1
+            if entry.time - self.window_start >= self.interval:
+                self.window_start = entry.time
+                self.logged_in_window = 0
+            if self.logged_in_window >= self.rate:
+                self.suppressed += 1
+                return
+            self.logged_in_window += 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            self.logger.warning("%s (%d more violations were not logged)", entry, suppressed)
+        else:
+            self.logger.warning("%s", entry)
+
+    def violations(self):
+        """The recorded violations, oldest first"""
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def log_violations(size=1000, logger=None, rate=10, interval=60.0, repr_limit=200):
+    """Records violations in a new violation_log instead of raising them, and returns the log"""
+    global _violation_log
+    _violation_log = violation_log(size, logger, rate, interval, repr_limit)
+    return _violation_log
+
+def raise_violations():
+    """Raises violations again; returns the violation_log that was in use, if any"""
+    global _violation_log
+    log, _violation_log = _violation_log, None
+    return log
+
+#
+# Declared fields: constraints checked when a field is assigned
+#
+class field_check(object):
+    """A check of a field value which describes itself in violations"""
+    def __init__(self, description, check):
+        self.description = description
+        self.check = check
+
+    def __call__(self, value):
+        return self.check(value)
+
+    def error(self):
+        return self.description
+
+default_field_values = {int: [-1, 0, 1], long: [-1L, 0L, 1L], float: [-1.0, 0.0, 1.0], bool: [False, True],
+                        str: ["", "a"], unicode: [u"", u"a"]}
+
+class field(object):
+    """A descriptor declaring a field of a new-style class, checked when it is assigned.
+
+        class Account(object):
+            balance = field(int, bounds(0, None))
+            owner = field(str, size(1, 40), nullable=True)
+
+    Assigning a value which is not of the type (None only if nullable) or
+    fails a constraint raises a FieldViolation, so a rule about one field
+    costs nothing on calls which don't assign it; keep @inv for rules
+    relating fields. bet enumerates the field's values=..., or else the
+    type's and the constraints' suggested values (see helpers.bounds) which
+    satisfy them all; @finitize overrides either."""
+    def __init__(self, type_=None, *constraints, **options):
+        self.type = type_
+        self.constraints = constraints
+        self.nullable = options.pop("nullable", False)
+        self.values = options.pop("values", None)
+        if options:
+            raise TypeError("unexpected field options: %s" % ", ".join(options))
+        self.checks = list(constraints)
+        if type_ is not None:
+            self.checks.insert(0, field_check("an instance of %s" % type_.__name__, lambda value: isinstance(value, type_)))
+        self.not_none = field_check("not None", lambda value: value is not None)
+        self.name = None
+
+    def field_name(self, owner):
+        if self.name is None:
+            self.name = declared_field_names(owner)[self]
+        return self.name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = self.field_name(owner)
         try:
-            wrapped_method.__func__._throws = method.__func__._throws
-        except AttributeError:
-            wrapped_method._throws = method.__func__._throws
- 
+            return instance.__dict__[name]
+        except KeyError:
+            raise AttributeError("%r object has no attribute %r" % (owner.__name__, name))
+
+    def __set__(self, instance, value):
+        name = self.field_name(instance.__class__)
+        self.check(instance, name, value)
+        instance.__dict__[name] = value
+
+    def __delete__(self, instance):
+        del instance.__dict__[self.field_name(instance.__class__)]
+
+    def check(self, instance, name, value):
+        if value is None:
+            if not self.nullable:
+                report(FieldViolation(self.not_none, instance, name, value))
+            return
+        for check in self.checks:
+            if not check(value):
+                report(FieldViolation(check, instance, name, value))
+                return
+
+    def accepts(self, value):
+        if value is None:
+            return self.nullable
+        return all(check(value) for check in self.checks)
+
+    def finitization(self):
+        """The values bet tries for this field"""
+        if self.values is not None:
+            return list(self.values)
+        candidates = list(default_field_values.get(self.type, ()))
+        for constraint in self.constraints:
+            if hasattr(constraint, "values"):
+                candidates.extend(constraint.values(self.type))
+        values = [None] if self.nullable else []
+        for candidate in candidates:
+            if self.accepts(candidate) and candidate not in values:
+                values.append(candidate)
+        return values
+
+def declared_field_names(clazz):
+    """{field: name} for the fields clazz declares or inherits"""
+    import inspect
+    names = {}
+    for klass in reversed(inspect.getmro(clazz)):
+        for name, member in vars(klass).items():
+            if isinstance(member, field):
+                names[member] = name
+    return names
+
+def declared_fields(clazz):
+    """{name: field} for the fields clazz declares or inherits"""
+    return dict((name, member) for member, name in declared_field_names(clazz).items())
+
+def finitization_field_set(clazz):
+    """The values bet enumerates per field: declared fields' finitizations, overridden by @finitize"""
+    explicit = getattr(clazz, "_finitization_field_set", {})
+    fields = declared_fields(clazz)
+    if not fields:
+        return explicit
+    field_set = dict((name, declared.finitization()) for name, declared in fields.items())
+    field_set.update(explicit)
+    return field_set
+
+def dbc(clazz):
+    """A callable object (decorator) which applies the inheritance of a contract without applying an invariant"""
+    decorate_class(clazz)
+    return clazz
+
 #
 # This is how we handle inheritance
 #
-def inherit_contract(clazz):
-    for baseclass in clazz.__bases__:
-        if check_contract_inherited(clazz, baseclass):
-            inherit_invariant_from(clazz, baseclass)
-            inherit_method_contract_components_from(clazz, baseclass)
-            declare_contract_inherited(clazz, baseclass)
-
-def check_contract_inherited(clazz, baseclass):
-    return not hasattr(clazz, "_inherited_contract_from") or baseclass.__name__ not in clazz._inherited_contract_from
-
-def declare_contract_inherited(clazz, baseclass):
-    if hasattr(clazz, "_inherited_contract_from"):
-        clazz._inherited_contract_from.append(baseclass.__name__)
-    else:
-        clazz._inherited_contract_from = [baseclass.__name__]
+# Each contract component keeps what was declared where it was written
+# (_uninherited_invariant on a class, _uninherited_precondition,
+# _uninherited_postcondition and _uninherited_throws on a method). A
+# decorated class flattens those into a contract table, once, when it is
+# decorated. The flattened lists are also stored where the invoker looks
+# for them (_invariant on the class, _precondition, _postcondition and
+# _throws on each method), so a call never walks the hierarchy.
+#
+# Flattening is incremental: a decorated base already holds the flattened
+# contract of everything above it, so only the __dict__ of the class itself
+# (and of undecorated ancestors) is scanned. Diamonds contribute each
+# predicate only once.
+#
+class method_contract(object):
+    """The flattened contract of one method of one class"""
+    __slots__ = ("precondition", "postcondition", "throws", "final_pre", "pure", "yields")
 
-def inherit_invariant_from(clazz, baseclass):
-    if hasattr(baseclass, "_invariant"):
-        for pred in baseclass._invariant:
-            inv(pred, inherit=False)(clazz)
+    def __init__(self, precondition, postcondition, throws, final_pre, pure=None, yields=None):
+        self.precondition = precondition
+        self.postcondition = postcondition
+        self.throws = throws
+        self.final_pre = final_pre
+        self.pure = pure
+        self.yields = yields
+
+class contract_table(object):
+    """The flattened contract of a class: its invariant and a method_contract per public method"""
+    def __init__(self, invariant, methods):
+        self.invariant = invariant
+        self.methods = methods
+
+def decorate_class(clazz):
+    """Wraps and flattens the contract of clazz, then rebuilds its decorated subclasses.
+
+    Subclasses only need rebuilding when a contract is added to a class after
+    they were decorated; a freshly defined class has none."""
+    build_contract_table(clazz)
+    if "__dbc_old__" in clazz.__dict__:
+        note_snapshot_hook(clazz)
+    for subclass in decorated_subclasses(clazz):
+        decorate_class(subclass)
+    return clazz
+
+def get_contract_table(clazz):
+    """The cached contract table of a decorated class (or of its nearest decorated base)"""
+    return getattr(clazz, "_contract_table", None)
+
+def subclasses_of(clazz):
+    if isinstance(clazz, type):
+        return type.__subclasses__(clazz)
+    # old-style classes don't track their subclasses
+    return []
+
+def decorated_subclasses(clazz):
+    """The nearest decorated subclasses of clazz, looking through undecorated ones.
+
+    Rebuilding those rebuilds the decorated classes below them in turn."""
+    found = []
+    pending = subclasses_of(clazz)
+    seen = set()
+    while pending:
+        subclass = pending.pop()
+        if subclass in seen:
+            continue
+        seen.add(subclass)
+        if "_contract_table" in subclass.__dict__:
+            found.append(subclass)
+        else:
+            pending.extend(subclasses_of(subclass))
+    return found
+
+def build_contract_table(clazz):
+    """Wraps and flattens clazz in a single pass over the dicts it owns.
 
-def inherit_method_contract_components_from(clazz, baseclass):
+    Those are the __dict__ of clazz and of any ancestors which were never
+    flattened themselves. Public functions there without an invoker get
+    one; inherited ones are stored on clazz, so that its invariant is
+    checked when they are called. Decorated ancestors are not scanned:
+    their flattened contracts are looked up by name."""
     import inspect
-    mets = inspect.getmembers(clazz, predicate=inspect.ismethod)
-    for methodname, method in mets:
-        if is_public(methodname):
-            # is there anything to inherit from?
-            if hasattr(baseclass, methodname):
-                baseclass_version = getattr(baseclass, methodname)
-                # is there anything to inherit?
-                if hasattr(baseclass_version, "_precondition"):
-                    pre(baseclass_version._precondition)._compose_baseclass_precondition(method.__func__, baseclass_version)
-                if hasattr(baseclass_version, "_postcondition"):
-                    setattr(method.__func__, "_postcondition", post(baseclass_version._postcondition).compose_list(method.__func__))
-                if hasattr(baseclass_version, "_throws"):
-                    setattr(method.__func__, "_throws", throws(*tuple(baseclass_version._throws)).compose_list(method.__func__))
-                propogate_unwrapped(method)
+    from types import FunctionType
+    contract_changed()
+    inherit = clazz.__dict__.get("_inherit_contract", True)
+    mro = inspect.getmro(clazz)
+    unflattened = [clazz]
+    flattened = []
+    for klass in mro[1:]:
+        if any(issubclass(done, klass) for done in flattened):
+            continue
+        if "_contract_table" in klass.__dict__:
+            flattened.append(klass)
+        else:
+            unflattened.append(klass)
+    if not inherit:
+        flattened = []
+
+    invariant = []
+    lineage = {}
+    for klass in unflattened:
+        if klass is clazz or inherit:
+            invariant.extend(klass.__dict__.get("_uninherited_invariant", ()))
+        for methodname, member in klass.__dict__.iteritems():
+            if isinstance(member, FunctionType) and is_public(methodname):
+                if methodname in lineage:
+                    lineage[methodname].append(member)
+                else:
+                    lineage[methodname] = [member]
+    for klass in flattened:
+        invariant.extend(klass._invariant)
+    if len(flattened) > 1:
+        invariant = in_mro_order(unique(invariant), mro, lambda klass: klass.__dict__.get("_uninherited_invariant", ()))
+
+    methods = {}
+    for methodname, members in lineage.iteritems():
+        # Python calls the first definition along the MRO: when that is in a
+        # decorated base, its invoker already carries the flattened contract
+        owner = next(klass for klass in mro if methodname in klass.__dict__)
+        if owner is not clazz and owner not in unflattened:
+            continue
+        method = members[0]
+        if not hasattr(method, "_invoker_exists"):
+            # the wrapped function itself declares nothing, so it can stay among the ancestors
+            method = create_invoker(method)
+            setattr(clazz, methodname, method)
+            declared = members
+        elif clazz.__dict__.get(methodname) is method:
+            declared = members[1:]
+        else:
+            continue
+        if not inherit:
+            declared = []
+        overridden = [flattened_method(klass, methodname) for klass in flattened]
+        contract = flatten_method_contract(method, declared, [m for m in overridden if m is not None])
+        if len(flattened) > 1:
+            order_method_contract(contract, mro, methodname)
+        methods[methodname] = contract
+        apply_method_contract(method, contract)
+    clazz._invariant = unique(invariant)
+    clazz._contract_table = contract_table(clazz._invariant, methods)
+    return clazz._contract_table
+
+def in_mro_order(items, mro, declared_by):
+    """items ordered by the first class of mro which declares each one.
+
+    declared_by(klass) lists what klass declares itself; items no class
+    declares keep their order, after the others."""
+    position = {}
+    for index in xrange(len(mro)):
+        for item in declared_by(mro[index]):
+            position.setdefault(id(item), index)
+    return sorted(items, key=lambda item: position.get(id(item), len(mro)))
+
+def order_method_contract(contract, mro, methodname):
+    """Puts the predicates of a flattened method contract in MRO order.
+
+    The contracts of several decorated bases are merged one base after the
+    other, so a class they share (the top of a diamond) would otherwise come
+    before the bases which follow the first one in the MRO."""
+    def own(klass, attribute, default):
+        return getattr(klass.__dict__.get(methodname), attribute, default)
+    if contract.precondition is not None and not contract.final_pre:
+        # a method's own precondition is one conjunct list
+        contract.precondition = in_mro_order(contract.precondition, mro, lambda klass: [own(klass, "_uninherited_precondition", None)])
+    if contract.postcondition is not None:
+        contract.postcondition = in_mro_order(contract.postcondition, mro, lambda klass: own(klass, "_uninherited_postcondition", ()))
+    if contract.yields is not None:
+        contract.yields = in_mro_order(contract.yields, mro, lambda klass: own(klass, "_uninherited_yields", ()))
+
+def flattened_method(clazz, methodname):
+    """The function a decorated class resolves methodname to, if it has an invoker"""
+    member = getattr(clazz, methodname, None)
+    function = getattr(member, "__func__", member)
+    if hasattr(function, "_invoker_exists"):
+        return function
+    return None
+
+def flatten_method_contract(method, declared, flattened):
+    """Combines a method's declared contract with those of the methods it overrides.
+
+    declared are overridden methods from unflattened classes, nearest first:
+    only what they declare themselves counts. flattened are overridden
+    methods of decorated classes, which already carry their whole inherited
+    contract. Preconditions are disjoined (a list of conjunct lists),
+    postconditions conjoined, and the throws list is the nearest one
+    declared, which may only narrow its parent's."""
+    ancestors = declared + flattened
+    final = None
+    for ancestor in ancestors:
+        if hasattr(ancestor, "_final_pre"):
+            final = ancestor
+            break
+    if final is not None:
+        precondition = list(final._precondition)
+    else:
+        inherited = [ancestor._uninherited_precondition for ancestor in declared if hasattr(ancestor, "_uninherited_precondition")]
+        inherited.extend(pred_list for ancestor in flattened for pred_list in getattr(ancestor, "_precondition", ()))
+        if inherited and not hasattr(method, "_uninherited_precondition"):
+            # no precondition on the override: true, which weakens whatever it overrides
+            method._uninherited_precondition = []
+        if hasattr(method, "_uninherited_precondition"):
+            precondition = unique([method._uninherited_precondition] + inherited)
+        else:
+            precondition = None
+
+    postcondition = [pred for m in [method] + declared for pred in getattr(m, "_uninherited_postcondition", ())]
+    postcondition.extend(pred for ancestor in flattened for pred in getattr(ancestor, "_postcondition", ()))
+    postcondition = unique(postcondition)
+
+    yields = [pred for m in [method] + declared for pred in getattr(m, "_uninherited_yields", ())]
+    yields.extend(pred for ancestor in flattened for pred in getattr(ancestor, "_yields", ()))
+    yields = unique(yields)
+
+    inherited_throws = None
+    for ancestor in ancestors:
+        if hasattr(ancestor, "_throws"):
+            inherited_throws = ancestor._throws
+            break
+    throws = getattr(method, "_uninherited_throws", None)
+    if throws is None:
+        throws = inherited_throws
+    elif inherited_throws is not None:
+        # each exception must either be in the superclass list or have a superclass in it
+        for ex in throws:
+            if not (ex in inherited_throws or issubclass(ex, tuple(inherited_throws))):
+                raise ContractViolation("throws has an implicit precondition: the exception or a supertype of the exception must be in the supertype throws list")
+    # a pure method stays pure when overridden
+    pure = getattr(method, "_uninherited_pure", None)
+    if pure is None:
+        for ancestor in declared:
+            if getattr(ancestor, "_uninherited_pure", None) is not None:
+                pure = ancestor._uninherited_pure
+                break
+    if pure is None:
+        for ancestor in flattened:
+            if getattr(ancestor, "_pure", None) is not None:
+                pure = ancestor._pure
+                break
+    return method_contract(precondition, postcondition or None, throws, final is not None, pure, yields or None)
+
+def apply_method_contract(method, contract):
+    """Stores a flattened contract where the invoker reads it"""
+    if contract.precondition is not None:
+        method._precondition = contract.precondition
+    if contract.postcondition is not None:
+        method._postcondition = contract.postcondition
+    if contract.throws is not None:
+        method._throws = contract.throws
+    if contract.final_pre:
+        method._final_pre = True
+    if contract.pure is not None:
+        method._pure = contract.pure
+    if contract.yields is not None:
+        method._yields = contract.yields
+
+def unique(items):
+    """items without repeats (by identity), in order"""
+    seen = set()
+    result = []
+    for item in items:
+        if id(item) not in seen:
+            seen.add(id(item))
+            result.append(item)
+    return result
 
 #
 # Some helper functions used by the invariant class
@@ -232,7 +1381,7 @@ class ContractViolation(Exception):
         return self.message
         
     def predicate_string(self, predicate):
-        outstring = str(predicate.__name__)
+        outstring = str(getattr(predicate, "__name__", repr(predicate)))
         if hasattr(predicate, "error"):
             outstring = predicate.error()
         elif hasattr(predicate, "__doc__") and predicate.__doc__ is not None:
@@ -240,7 +1389,7 @@ class ContractViolation(Exception):
         return outstring
 
 class PreconditionViolation(ContractViolation):
-    def __init__(self, predicate_list, instance, method, *args, **kwargs):
+    def __init__(self, predicate_list, instance, method, args, kwargs):
         self.predicate_list = predicate_list
         self.instance = instance
         self.method = method
@@ -277,6 +1426,54 @@ class InvariantViolation(ContractViolation):
         outstring = "Invariant Violation: Instance of %s failed when calling %s with arguments (%s), keywords %s. Contract: %s" % (self.instance.__class__.__name__, self.method.__name__, ', '.join(map(str,self.args)), self.kwargs, self.predicate_string(self.predicate))
         return outstring
 
+class BatchInvariantViolation(InvariantViolation):
+    def __init__(self, predicate, instance, calls):
+        self.predicate = predicate
+        self.instance = instance
+        self.calls = calls
+        if calls:
+            self.method, self.args, self.kwargs = calls[-1]
+        else:
+            self.method, self.args, self.kwargs = None, (), {}
+
+    def call_string(self, call):
+        method, args, kwargs = call
+        arguments = map(str, args) + ["%s=%s" % item for item in kwargs.items()]
+        return "%s(%s)" % (method.__name__, ', '.join(arguments))
+
+    def __str__(self):
+        outstring = "Invariant Violation: Instance of %s failed at the end of a batch of %d calls: %s. Contract: %s" % (self.instance.__class__.__name__, len(self.calls), ', '.join(map(self.call_string, self.calls)), self.predicate_string(self.predicate))
+        return outstring
+
+class YieldViolation(ContractViolation):
+    def __init__(self, predicate, instance, item, index, method, args, kwargs):
+        self.predicate = predicate
+        self.instance = instance
+        self.item = item
+        self.index = index
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        outstring = "Yield Violation: Instance of %s failed when calling %s with arguments (%s), keywords %s, on item %d: %s. Contract: %s" % (self.instance.__class__.__name__, self.method.__name__, ', '.join(map(str,self.args)), self.kwargs, self.index, self.item, self.predicate_string(self.predicate))
+        return outstring
+
+class FieldViolation(ContractViolation):
+    def __init__(self, predicate, instance, name, value):
+        self.predicate = predicate
+        self.instance = instance
+        self.name = name
+        self.value = value
+        # what log_violations records
+        self.method = None
+        self.args = (value,)
+        self.kwargs = {}
+
+    def __str__(self):
+        outstring = "Field Violation: Instance of %s was assigned %r to field %s. Contract: %s" % (self.instance.__class__.__name__, self.value, self.name, self.predicate_string(self.predicate))
+        return outstring
+
 class ThrowsViolation(ContractViolation):
     def __init__(self, exception, instance, method, args, kwargs):
         self.exception = exception
@@ -309,27 +1506,12 @@ class throws(object):
 
     def compose(self, method, wrapped_method):
         # append acceptable throws
-        if hasattr(method, "_throws"):
-            method._throws.extend(self.exceptions)
-            wrapped_method._throws = method._throws
+        if hasattr(method, "_uninherited_throws"):
+            method._uninherited_throws.extend(self.exceptions)
+            wrapped_method._uninherited_throws = method._uninherited_throws
         else:
-            wrapped_method._throws = self.exceptions
-
-    def compose_list(self,method):
-        # each element of the throws list should either be 
-        # 1. in the superclass list or 
-        # 2. have a superclass in the superclass list
-        if hasattr(method, "_throws"):
-            for ex in method._throws:
-                if not (ex in self.exceptions or issubclass(ex, tuple(self.exceptions))):
-                    raise ContractViolation("throws has an implicit precondition: the exception or a supertype of the exception must be in the supertype throws list")
-            return method._throws
-        return self.exceptions
-        
-        if hasattr(method, "_throws"):
-            method._throws.extend(self.exceptions)
-            return method._throws
-        return self.exceptions
+            wrapped_method._uninherited_throws = list(self.exceptions)
+        wrapped_method._throws = wrapped_method._uninherited_throws
 
 class pre(object):
     """A callable object (decorator) which attaches a precondition to a method"""
@@ -337,7 +1519,11 @@ class pre(object):
         from types import MethodType
         return MethodType(self, instance, owner)
 
-    def __init__(self, precondition):
+    def __init__(self, precondition, cost=None):
+        from dbcbet.expressions import compiled
+        precondition = compiled(precondition, "pre")
+        if cost is not None:
+            precondition = with_cost(precondition, cost)
         self.precondition = precondition
 
     def __call__(self, method):
@@ -350,6 +1536,7 @@ class pre(object):
         return wrapped_method
 
     def compose(self, method, wrapped_method):
+        contract_changed()
         # possibly replace the precondition with the conjunct of previous preconditions
         if hasattr(method, "_precondition"):
             method._uninherited_precondition.append(self.precondition)
@@ -358,19 +1545,6 @@ class pre(object):
         else:
             wrapped_method._uninherited_precondition = [self.precondition]
             wrapped_method._precondition = [wrapped_method._uninherited_precondition]
-    
-    def _compose_baseclass_precondition(self,method,baseclass_method):
-        if hasattr(method, "_precondition"):
-            if not hasattr(baseclass_method, "_final_pre"):
-                method._precondition.extend(self.precondition)
-            else:
-                method._precondition[0:len(method._precondition)] = []
-                method._precondtion.extend(self.precondition)
-        else:
-            method._uninherited_precondition = []
-            method._precondition = [method._uninherited_precondition, self.precondition]
-        if hasattr(baseclass_method, "_final_pre"):
-            method._final_pre = True
 
 class post(object):
     """A callable object (decorator) which attaches a postcondition to a method"""
@@ -378,7 +1552,11 @@ class post(object):
         from types import MethodType
         return MethodType(self, instance, owner)
     
-    def __init__(self, postcondition):
+    def __init__(self, postcondition, cost=None):
+        from dbcbet.expressions import compiled
+        postcondition = compiled(postcondition, "post")
+        if cost is not None:
+            postcondition = with_cost(postcondition, cost)
         self.postcondition = postcondition
 
     def __call__(self, method):
@@ -391,35 +1569,358 @@ class post(object):
         return wrapped_method
 
     def compose(self, method, wrapped_method):
+        contract_changed()
         # possibly replace the postcondition with the conjunct of previous postcondition
         if hasattr(method, "_postcondition"):
+            method._uninherited_postcondition.append(self.postcondition)
             method._postcondition.append(self.postcondition)
+            wrapped_method._uninherited_postcondition = method._uninherited_postcondition
             wrapped_method._postcondition = method._postcondition
         else:
+            wrapped_method._uninherited_postcondition = [self.postcondition]
             wrapped_method._postcondition = [self.postcondition]
 
-    def compose_list(self,method):
-        # possibly replace the postcondition with the conjunct of previous postcondition
-        if hasattr(method, "_postcondition"):
-            method._postcondition.extend(self.postcondition)
-            return method._postcondition
-        return self.postcondition
+class yields(object):
+    """A callable object (decorator) which attaches a predicate on each item a generator method yields.
+
+    The predicate is called as predicate(self, item, *args, **kwargs)."""
+    def __get__(self, instance, owner):
+        from types import MethodType
+        return MethodType(self, instance, owner)
+
+    def __init__(self, predicate, cost=None):
+        from dbcbet.expressions import compiled
+        predicate = compiled(predicate, "yields")
+        if cost is not None:
+            predicate = with_cost(predicate, cost)
+        self.predicate = predicate
+
+    def __call__(self, method):
+        if hasattr(method, "_invoker_exists"):
+            wrapped_method = method
+        else:
+            wrapped_method = create_invoker(method)
+        self.compose(method, wrapped_method)
+        return wrapped_method
+
+    def compose(self, method, wrapped_method):
+        contract_changed()
+        # item predicates are conjoined, like postconditions
+        if hasattr(method, "_yields"):
+            method._uninherited_yields.append(self.predicate)
+            method._yields.append(self.predicate)
+            wrapped_method._uninherited_yields = method._uninherited_yields
+            wrapped_method._yields = method._yields
+        else:
+            wrapped_method._uninherited_yields = [self.predicate]
+            wrapped_method._yields = [self.predicate]
 
 class old(object):
     """A nicer interface for old in postconditions"""
-    def __init__(self, method, s, args, kwargs):
-        """Performs a deep copy of self (s, not the current old-self), args, and kwargs"""
-        import copy
-        self.self = copy.deepcopy(s)
-        self.args = copy.deepcopy(args)
-        self.kwargs = copy.deepcopy(kwargs)
+    def __init__(self, method, s, args, kwargs, fingerprint_only=False):
+        """Snapshots self (s, not the current old-self), args, and kwargs (see snapshot).
+
+        With fingerprint_only, nothing is copied: only fingerprint(s) is kept."""
+        if fingerprint_only:
+            self.self = self.args = self.kwargs = None
+            self.fingerprint = fingerprint(s)
+        else:
+            # one memo, so aliasing between self and the arguments survives the copy
+            memo = {}
+            self.self = snapshot(s, memo)
+            self.args = tuple(snapshot(arg, memo) for arg in args)
+            self.kwargs = dict((key, snapshot(value, memo)) for key, value in kwargs.items())
+            self.fingerprint = None
 
     def __repr__(self):
+        if self.fingerprint is not None:
+            return "old(fingerprint=%s)" % self.fingerprint.encode("hex")
         return "old(self=%s,args=%s,kwargs=%s)" % (self.self, self.args, self.kwargs)
+
+#
+# Per-type snapshot strategies for old
+#
+def identity_snapshot(value):
+    """For immutable values and for things which must not be copied (locks, files)"""
+    return value
+
+def shallow_snapshot(value):
+    """For values whose parts are immutable"""
+    import copy
+    return copy.copy(value)
+
+def buffer_snapshot(value):
+    """For flat buffers: bytearray, array.array, and numpy.ndarray"""
+    if hasattr(value, "__array_interface__"):
+        return value.copy()
+    return value[:]
+
+def _default_snapshot_strategies():
+    import array
+    import datetime
+    import decimal
+    import types
+    strategies = {
+        bytearray: buffer_snapshot,
+        array.array: buffer_snapshot,
+        type(threading.Lock()): identity_snapshot,
+        type(threading.RLock()): identity_snapshot,
+        types.FileType: identity_snapshot,
+        types.FunctionType: identity_snapshot,
+        types.BuiltinFunctionType: identity_snapshot,
+        type: identity_snapshot,
+        }
+    for immutable in (type(None), bool, int, long, float, complex, str, unicode,
+                      datetime.date, datetime.time, datetime.timedelta, decimal.Decimal):
+        strategies[immutable] = identity_snapshot
+    return strategies
+
+snapshot_strategies = _default_snapshot_strategies()
+_snapshot_strategy_cache = {}
+_atomic_types = (type(None), bool, int, long, float, complex, str, unicode)
+# registered types and classes with __dbc_old__: while there are any,
+# snapshot looks for them inside each value before deep copying it
+_custom_snapshots = set()
+
+def register_snapshot(type_, strategy):
+    """Makes old snapshot instances of type_ (and its subclasses) with strategy(value).
+
+    Types may instead define __dbc_old__(self), which takes precedence.
+    Anything without a strategy is deep copied."""
+    snapshot_strategies[type_] = strategy
+    _custom_snapshots.add(type_)
+    _snapshot_strategy_cache.clear()
+
+def unregister_snapshot(type_):
+    """Reverts type_ to the inherited strategy, or to deepcopy"""
+    snapshot_strategies.pop(type_, None)
+    _custom_snapshots.discard(type_)
+    _snapshot_strategy_cache.clear()
+
+def note_snapshot_hook(clazz):
+    """Makes snapshot look for instances of clazz, which defines __dbc_old__, inside values"""
+    _custom_snapshots.add(clazz)
+
+def snapshot_strategy(type_):
+    """The snapshot function for a class (new- or old-style), or None to deep copy"""
+    try:
+        return _snapshot_strategy_cache[type_]
+    except KeyError:
+        pass
+    if hasattr(type_, "__dbc_old__"):
+        strategy = type_.__dbc_old__
+        note_snapshot_hook(type_)
+    else:
+        import inspect
+        import sys
+        # numpy is optional: only register ndarray once someone has imported it
+        if "numpy" in sys.modules and sys.modules["numpy"].ndarray not in snapshot_strategies:
+            snapshot_strategies[sys.modules["numpy"].ndarray] = buffer_snapshot
+        strategy = None
+        for base in inspect.getmro(type_):
+            if base in snapshot_strategies:
+                strategy = snapshot_strategies[base]
+                break
+    _snapshot_strategy_cache[type_] = strategy
+    return strategy
+
+def class_of(value):
+    # type() of an old-style instance is InstanceType
+    return getattr(value, "__class__", type(value))
+
+def snapshot(value, memo=None):
+    """Copies value for old.
+
+    A value with a strategy is snapshotted directly. Otherwise it is deep
+    copied. Once a strategy is registered or a class with __dbc_old__ is
+    decorated or snapshotted, the values reachable from it which have
+    strategies are snapshotted first and seeded into the deepcopy memo.
+    Without those, the default strategies only matter for what deepcopy
+    cannot copy (a lock or a file inside self): when it fails, the copy is
+    made again with the seeded memo."""
+    import copy
+    if memo is None:
+        memo = {}
+    if id(value) in memo:
+        return memo[id(value)]
+    strategy = snapshot_strategy(class_of(value))
+    if strategy is not None:
+        return _memoize_snapshot(value, strategy(value), memo)
+    if _custom_snapshots:
+        _seed_snapshots(value, memo, set())
+        return copy.deepcopy(value, memo)
+    saved = dict(memo)
+    try:
+        return copy.deepcopy(value, memo)
+    except (TypeError, copy.Error):
+        # the failed copy may have left partial copies in the memo
+        memo.clear()
+        memo.update(saved)
+        _seed_snapshots(value, memo, set())
+        return copy.deepcopy(value, memo)
+
+def _memoize_snapshot(value, result, memo):
+    memo[id(value)] = result
+    # like copy._keep_alive: the original must outlive the memo's use of its id
+    memo.setdefault(id(memo), []).append(value)
+    return result
+
+def _seed_snapshots(value, memo, visited):
+    if isinstance(value, dict):
+        children = value.itervalues()
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        children = value
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        children = value.__dict__.itervalues()
+    else:
+        return
+    visited.add(id(value))
+    for child in children:
+        if isinstance(child, _atomic_types) or id(child) in visited or id(child) in memo:
+            continue
+        strategy = snapshot_strategy(class_of(child))
+        if strategy is not None:
+            _memoize_snapshot(child, strategy(child), memo)
+        else:
+            _seed_snapshots(child, memo, visited)
+
+def snapshot_old(wrapped_method, method, s, args, kwargs):
+    """Creates the old value the method's postconditions need.
+
+    No postconditions means no snapshot. If every postcondition is marked
+    with _old_fingerprint (it only reads old.fingerprint, like helpers.const),
+    self is fingerprinted instead of deep copied."""
+    return old_for(getattr(wrapped_method, "_postcondition", None), wrapped_method, method, s, args, kwargs)
+
+def old_for(postconditions, wrapped_method, method, s, args, kwargs):
+    """The old value the given postconditions need, if any"""
+    if not postconditions:
+        return None
+    # postcondition lists only grow, so the length tells us when to look again
+    cached = getattr(wrapped_method, "_old_mode", None)
+    if cached is None or cached[0] is not postconditions or cached[1] != len(postconditions):
+        fingerprint_only = all(getattr(pred, "_old_fingerprint", False) for pred in postconditions)
+        cached = wrapped_method._old_mode = (postconditions, len(postconditions), fingerprint_only)
+    return old(method, s, args, kwargs, cached[2])
+
+def fingerprint(obj):
+    """A structural hash of obj, compared in place of a deep copy of old self.
+
+    Objects may define __dbc_fingerprint__ to supply their own. Otherwise
+    scalars, strings, buffers (bytearray, array, ndarray), containers, slots
+    and __dict__ are fed recursively into one digest, so no copy is built."""
+    import hashlib
+    digest = hashlib.md5()
+    _fingerprint_into(digest, obj, set())
+    return digest.digest()
+
+def _fingerprint_unordered(items, seen):
+    # order-independent combination of per-item digests, for dicts and sets
+    import hashlib
+    total = 0
+    for item in items:
+        digest = hashlib.md5()
+        _fingerprint_into(digest, item, seen)
+        total += int(digest.hexdigest(), 16)
+    return "%x" % (total % (1 << 128))
+
+def _fingerprint_into(digest, obj, seen):
+    if obj is None or isinstance(obj, (bool, int, long, float, complex)):
+        digest.update("%s:%r;" % (type(obj).__name__, obj))
+        return
+    if isinstance(obj, str):
+        digest.update("str%d:" % len(obj))
+        digest.update(obj)
+        return
+    if isinstance(obj, unicode):
+        return _fingerprint_into(digest, obj.encode("utf-8"), seen)
+    if hasattr(obj, "__dbc_fingerprint__") and not isinstance(obj, type):
+        digest.update("custom:%r;" % (obj.__dbc_fingerprint__(),))
+        return
+    if id(obj) in seen:
+        # a reference cycle: the enclosing container is already being hashed
+        digest.update("cycle;")
+        return
+    seen.add(id(obj))
+    try:
+        if isinstance(obj, (list, tuple)):
+            digest.update("%s%d:" % (type(obj).__name__, len(obj)))
+            for item in obj:
+                _fingerprint_into(digest, item, seen)
+        elif isinstance(obj, dict):
+            digest.update("%s%d:%s;" % (type(obj).__name__, len(obj), _fingerprint_unordered(obj.iteritems(), seen)))
+        elif isinstance(obj, (set, frozenset)):
+            digest.update("%s%d:%s;" % (type(obj).__name__, len(obj), _fingerprint_unordered(obj, seen)))
+        elif _is_buffer(obj):
+            _fingerprint_buffer(digest, obj)
+        elif hasattr(obj, "__dict__") or hasattr(obj, "__slots__"):
+            digest.update("object %s.%s:" % (type(obj).__module__, type(obj).__name__))
+            if hasattr(obj, "__dict__"):
+                _fingerprint_into(digest, obj.__dict__, seen)
+            for slot in slots_of(type(obj)):
+                _fingerprint_into(digest, getattr(obj, slot, None), seen)
+        else:
+            digest.update("%r;" % (obj,))
+    finally:
+        seen.discard(id(obj))
+
+_slots = {}
+
+def slots_of(clazz):
+    """The slot names declared by clazz and all of its bases"""
+    try:
+        return _slots[clazz]
+    except KeyError:
+        pass
+    import inspect
+    result = []
+    for klass in inspect.getmro(clazz):
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        result.extend(slot for slot in slots if slot not in ("__dict__", "__weakref__"))
+    _slots[clazz] = result = tuple(result)
+    return result
+
+def _is_buffer(obj):
+    import array
+    return isinstance(obj, (bytearray, array.array)) or hasattr(obj, "__array_interface__")
+
+def _fingerprint_buffer(digest, obj):
+    digest.update("buffer %s %s %s:" % (type(obj).__name__, getattr(obj, "dtype", ""), getattr(obj, "shape", "")))
+    try:
+        digest.update(buffer(obj))
+    except (TypeError, ValueError):
+        # non-contiguous arrays have no single buffer
+        digest.update(obj.tobytes())
     
 #
 # Bounded exhaustive testing support
 #
+def failure_signature(method_name, cv):
+    """What makes failures the same: the method, the violation type and the predicates violated"""
+    if hasattr(cv, "predicate_list"):
+        predicates = tuple(cv.predicate_list)
+    elif hasattr(cv, "predicate"):
+        predicates = (cv.predicate,)
+    elif hasattr(cv, "exception"):
+        predicates = (type(cv.exception),)
+    else:
+        predicates = ()
+    return (method_name, type(cv), predicates)
+
+class failure_group(object):
+    """The failures sharing one signature: how many there were, and the messages of the first few"""
+    def __init__(self, signature):
+        self.signature = signature
+        self.count = 0
+        self.examples = []
+
+    def __str__(self):
+        method_name, violation, predicates = self.signature
+        names = ", ".join(getattr(pred, "__name__", repr(pred)) for pred in predicates)
+        return "%d x %s in %s: %s" % (self.count, violation.__name__, method_name, names)
+
 class bet(object):
     """The Bounded Exhaustive Testing class"""
     def __init__(self, clazz):
@@ -433,30 +1934,80 @@ class bet(object):
         self.method_call_candidates = 0
         self.running_log = []
         self.arg_scope = -1
+        self.strength = None
+        self.strengths = set()
+        self.examples_per_failure = 3
+        self.distinct_failures_per_method = None
+        self.stop_at_first_failure = False
+        self.failure_groups = {}
+        self.failure_order = []
+        self.stopped_methods = set()
+        self.stopped = False
+
+    @staticmethod
+    def differential(clazz, other, equivalent=None, counterpart=None, methods=None):
+        """A runner comparing two implementations on one enumeration (see differential_bet)"""
+        return differential_bet(clazz, other, equivalent, counterpart, methods)
 
     def with_arg_scope(self, scope):
         self.arg_scope = scope
 
+    def with_strength(self, strength):
+        """Enumerates t-wise covering arrays of fieldsets and arguments instead of
+        their full products; None (the default) runs exhaustively.
+        A method's finitize_method(..., strength=t) takes precedence for its arguments."""
+        self.strength = strength
+
+    def with_failure_policy(self, examples=3, distinct_per_method=None, stop_at_first=False):
+        """Failures with the same signature (see failure_signature) are counted
+        together and only the first examples of them are formatted and logged
+        (None keeps all). A method is no longer called once it has failed in
+        distinct_per_method distinct ways; stop_at_first ends the run at the
+        first failure."""
+        self.examples_per_failure = examples
+        self.distinct_failures_per_method = distinct_per_method
+        self.stop_at_first_failure = stop_at_first
+
+    def fieldsets(self):
+        self.strengths.add(self.strength)
+        return enumerate(self.clazz, self.strength)
+
+    def arguments_for(self, val):
+        strength = getattr(val, "_bet_strength", self.strength)
+        self.strengths.add(strength)
+        return enumerate_args(val._bet_arguments, self.arg_scope, strength)
+
     def run(self):
         """Intantiates all objects satisfying the invariant.
         Then, for each instance, calls each method with the finitization arguments satisfying the precondition.
-        Deep copying is used."""
-        for fs in enumerate(self.clazz):
+        Deep copying is used. Every contract is checked, whatever the assertion level."""
+        if current_level() != "expensive":
+            with assertion_level("expensive"):
+                return self.run()
+        for fs in self.fieldsets():
+            if self.stopped:
+                break
             candidate = self.instantiate_with(self.clazz, fs)
             self.process_candidate(candidate, fs)
-        if self.candidates == 0:
+        if self.candidates == 0 and not self.stopped:
             candidate = self.instantiate_with(self.clazz, {})
             self.process_candidate(candidate, {})
         self.print_invoice()
 
     def process_candidate(self, candidate, fs):
-        for pred in candidate._invariant:
-            if not pred(candidate):
-                self.invariant_violations += 1
-                return
+        # instantiate_with gives None when a value violates a declared field
+        if candidate is None or not self.satisfies_invariant(candidate):
+            self.invariant_violations += 1
+            return
         self.process_methods(candidate, fs)
         self.candidates += 1
 
+    def satisfies_invariant(self, candidate):
+        for pred in candidate._invariant:
+            if not pred(candidate):
+                return False
+        return True
+
     def print_invoice(self):
         print "\n".join(self.running_log)
         print "Summary: "
@@ -466,22 +2017,36 @@ class bet(object):
         print " Precondition Violations: " + str(self.precondition_violations)
         print " Failures: " + str(self.failures)
         print " Successes: " + str(self.successes)
+        print " Strength: " + ", ".join(sorted("exhaustive" if strength is None else "%d-wise" % strength
+                                               for strength in self.strengths))
+        if self.failure_order:
+            print " Distinct Failures: " + str(len(self.failure_order))
+            for signature in self.failure_order:
+                print "  " + str(self.failure_groups[signature])
+        if self.stopped:
+            print " Stopped at the first failure"
 
     def process_methods(self, candidate, fs):
         import inspect
         mets = inspect.getmembers(candidate, predicate=inspect.ismethod)
         for key, val in mets:
+            if self.stopped:
+                return
             if hasattr(val, "_bet_arguments"):
                 self.call_method(candidate, fs, val)
 
     def call_with_args_and_precondition(self, candidate, fs, val, args):
-        import copy
-        candidate_copy = copy.deepcopy(candidate)
+        candidate_copy = self.copy_candidate(candidate)
         if self.process_precondition(val, candidate_copy, args):
             self.call_with_args(candidate, fs, val, args)
         else:
             self.precondition_violations += 1
 
+    def copy_candidate(self, candidate):
+        """The precondition is evaluated on a copy, so it cannot disturb the candidate"""
+        import copy
+        return copy.deepcopy(candidate)
+
     def process_precondition(self, val, candidate, args):
         for predlist in getattr(val, "_precondition"):
             success = True
@@ -501,13 +2066,49 @@ class bet(object):
             self.failures += 1
 
     def log_call_failure(self, candidate, fs, val, args, cv):
-        self.running_log.append("instance of %s with initialization %s failed when calling %s with arguments %s. Reason: %s" % (candidate.__class__.__name__, fs, val.__name__, ', '.join(map(str,args)), cv))
+        self.record_failure(val.__name__, cv, lambda: "instance of %s with initialization %s failed when calling %s with arguments %s. Reason: %s" % (candidate.__class__.__name__, fs, val.__name__, ', '.join(map(str,args)), cv))
+
+    def record_failure(self, method_name, cv, message):
+        """Counts a failure in its group; message() formats it, only if it is kept as an example"""
+        group = self.group_for(failure_signature(method_name, cv))
+        group.count += 1
+        self.keep_example(group, message)
+        if self.stop_at_first_failure:
+            self.stopped = True
+
+    def group_for(self, signature):
+        group = self.failure_groups.get(signature)
+        if group is None:
+            group = self.failure_groups[signature] = failure_group(signature)
+            self.failure_order.append(signature)
+            self.failure_added(group)
+        return group
+
+    def keep_example(self, group, message):
+        if self.examples_per_failure is None or len(group.examples) < self.examples_per_failure:
+            text = message()
+            group.examples.append(text)
+            self.running_log.append(text)
+
+    def failure_added(self, group):
+        """Applies distinct_failures_per_method for a failure with a new signature"""
+        method_name = group.signature[0]
+        if self.distinct_failures_per_method is not None:
+            distinct = sum(1 for signature in self.failure_order if signature[0] == method_name)
+            if distinct >= self.distinct_failures_per_method:
+                self.stopped_methods.add(method_name)
+
+    def skips(self, method_name):
+        """Whether the failure policy stops calls of the method"""
+        return self.stopped or method_name in self.stopped_methods
 
     def log_precondition_not_found(self, val):
         self.running_log.append("No precondition found when attempting to call %s" % (val.__name__))
 
     def call_method(self, candidate, fs, val):
-        for args in enumerate_args(val._bet_arguments, self.arg_scope):
+        for args in self.arguments_for(val):
+            if self.skips(val.__name__):
+                return
             self.method_call_candidates += 1
             if hasattr(val, "_precondition"):
                 self.call_with_args_and_precondition(candidate, fs, val, args)
@@ -519,7 +2120,10 @@ class bet(object):
         """Instantiates an object and sets its fields to the values in the dictionary"""
         instance = self.find_acceptable_instance(clazz)
         for k, v in fieldset.items():
-            setattr(instance, k, v)
+            try:
+                setattr(instance, k, v)
+            except FieldViolation:
+                return None
         return instance
 
     def find_acceptable_instance(self, clazz):
@@ -543,6 +2147,356 @@ class bet(object):
             except ContractViolation:
                 pass
 
+class concurrent_bet(bet):
+    """bet which processes up to concurrency candidates at once, on threads.
+
+    Worthwhile when the methods under test wait on I/O (or stand-ins for it):
+    each candidate is instantiated and exercised by its own shard of the
+    runner, and the shards are merged in enumeration order, so the invoice is
+    the same as that of a sequential run. Calls on one candidate stay in order."""
+    def __init__(self, clazz, concurrency=8):
+        bet.__init__(self, clazz)
+        self.concurrency = concurrency
+
+    def run(self):
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.concurrency)
+        # holding a level for the whole run keeps the shards from reinstalling the check functions
+        try:
+            with assertion_level("expensive"):
+                self.run_chunks(pool)
+        finally:
+            pool.close()
+            pool.join()
+        if self.candidates == 0 and not self.stopped:
+            self.merge(self.process_fieldset({}))
+        self.print_invoice()
+
+    def run_chunks(self, pool):
+        chunk = []
+        for fs in self.fieldsets():
+            if self.stopped:
+                return
+            chunk.append(fs)
+            # a chunk at a time keeps the pending shards bounded
+            if len(chunk) == self.concurrency * 4:
+                self.run_chunk(pool, chunk)
+                chunk = []
+        self.run_chunk(pool, chunk)
+
+    def run_chunk(self, pool, fieldsets):
+        for shard in pool.map(self.process_fieldset, fieldsets):
+            self.merge(shard)
+
+    def process_fieldset(self, fs):
+        """Instantiates and exercises one candidate, counting in a fresh shard"""
+        import copy
+        shard = copy.copy(self)
+        bet.__init__(shard, self.clazz)
+        shard.arg_scope = self.arg_scope
+        shard.strength = self.strength
+        shard.with_failure_policy(self.examples_per_failure, self.distinct_failures_per_method, self.stop_at_first_failure)
+        # a method stopped by an earlier shard stays stopped
+        shard.stopped_methods = set(self.stopped_methods)
+        # assertion levels are per thread, and bet checks everything
+        with assertion_level("expensive"):
+            candidate = shard.instantiate_with(self.clazz, fs)
+            shard.process_candidate(candidate, fs)
+        return shard
+
+    def merge(self, shard):
+        # a sequential run would not have reached the candidates after the one it stopped at
+        if self.stopped:
+            return
+        for counter in ("invariant_violations", "precondition_violations", "failures", "successes",
+                        "candidates", "method_call_candidates"):
+            setattr(self, counter, getattr(self, counter) + getattr(shard, counter))
+        self.strengths |= shard.strengths
+        # the shard kept its own examples; keep as many as a sequential run would
+        owners = dict((id(text), signature) for signature, group in shard.failure_groups.items() for text in group.examples)
+        for text in shard.running_log:
+            signature = owners.get(id(text))
+            if signature is None:
+                self.running_log.append(text)
+                continue
+            self.keep_example(self.group_for(signature), lambda: text)
+        for signature in shard.failure_order:
+            self.group_for(signature).count += shard.failure_groups[signature].count
+        # shards running at once may each call a method distinct_per_method would have stopped
+        self.stopped_methods |= shard.stopped_methods
+        self.stopped = shard.stopped
+
+class columnar_bet(bet):
+    """bet which filters candidates on their invariants before building them.
+
+    The finitization is laid out as NumPy columns, one per field, and the
+    vectorized invariants (helpers.field_bounds, helpers.compare and their
+    and_/or_/not_) are evaluated for a chunk of candidates at once. Only the
+    candidates they accept are instantiated; the other invariants are then
+    checked per object as usual. The counts and the log are those of bet.
+    Without NumPy it runs like bet."""
+    chunk_size = 65536
+
+    def __init__(self, clazz):
+        bet.__init__(self, clazz)
+        self.per_object_invariant = None
+
+    def run(self):
+        try:
+            import numpy
+        except ImportError:
+            return bet.run(self)
+        if current_level() != "expensive":
+            with assertion_level("expensive"):
+                return self.run()
+        field_set = finitization_field_set(self.clazz)
+        names = field_set.keys()
+        invariant = getattr(self.clazz, "_invariant", [])
+        vectorized = [pred for pred in invariant if hasattr(pred, "vectorized") and set(pred.fields) <= set(names)]
+        self.per_object_invariant = [pred for pred in invariant if not any(pred is v for v in vectorized)]
+        # a covering array is no full product to lay out in columns
+        if not names or not vectorized or self.strength is not None:
+            return bet.run(self)
+
+        columns = [self.column(numpy, field_set[name]) for name in names]
+        lengths = [len(field_set[name]) for name in names]
+        # as in enumerate, the first field varies fastest
+        strides = [reduce(lambda x, y: x * y, lengths[:position], 1) for position in xrange(len(names))]
+        total = reduce(lambda x, y: x * y, lengths, 1)
+        for start in xrange(0, total, self.chunk_size):
+            if self.stopped:
+                break
+            rows = numpy.arange(start, min(start + self.chunk_size, total))
+            indices = [(rows // stride) % length for stride, length in zip(strides, lengths)]
+            chunk = dict((name, column[index]) for name, column, index in zip(names, columns, indices))
+            mask = numpy.ones(len(rows), dtype=bool)
+            for pred in vectorized:
+                mask &= pred.vectorized(numpy, chunk)
+            self.invariant_violations += len(rows) - int(mask.sum())
+            for row in numpy.flatnonzero(mask):
+                if self.stopped:
+                    break
+                fs = dict((name, field_set[name][int(index[row])]) for name, index in zip(names, indices))
+                candidate = self.instantiate_with(self.clazz, fs)
+                self.process_candidate(candidate, fs)
+        if self.candidates == 0 and not self.stopped:
+            # the fields keep their initial values here, so every invariant is checked on the object
+            self.per_object_invariant = None
+            candidate = self.instantiate_with(self.clazz, {})
+            self.process_candidate(candidate, {})
+        self.print_invoice()
+
+    def column(self, numpy, values):
+        """The values of a field as an array, of objects unless they are numbers or strings"""
+        column = numpy.asarray(values)
+        if column.ndim != 1 or column.dtype.kind not in "biufSU":
+            column = numpy.empty(len(values), dtype=object)
+            for position in xrange(len(values)):
+                column[position] = values[position]
+        return column
+
+    def satisfies_invariant(self, candidate):
+        if self.per_object_invariant is None:
+            return bet.satisfies_invariant(self, candidate)
+        for pred in self.per_object_invariant:
+            if not pred(candidate):
+                return False
+        return True
+
+def equivalent_values(x, y):
+    """The default equivalence of differential_bet: equal values, or objects with equal fields"""
+    try:
+        if x == y:
+            return True
+    except Exception:
+        pass
+    return hasattr(x, "__dict__") and hasattr(y, "__dict__") and vars(x) == vars(y)
+
+class differential_bet(bet):
+    """bet which runs two implementations of a class side by side.
+
+    The finitization and the method arguments of clazz are enumerated once.
+    Each candidate gets a counterpart of other: by default an instance with
+    the same field values, or whatever counterpart(candidate) returns. Every
+    call accepted by clazz's precondition is made on both, under their
+    contracts, and the outcomes are compared: the type of a raised exception,
+    then the return value and the resulting state, using equivalent(x, y).
+    methods names the finitized methods to compare, by default all of them;
+    leave out constructors whose arguments mean different things in the two.
+    Differences are logged and counted in the invoice; contract violations
+    are logged as failures, as bet does."""
+    def __init__(self, clazz, other, equivalent=None, counterpart=None, methods=None):
+        bet.__init__(self, clazz)
+        self.other = other
+        self.equivalent = equivalent or equivalent_values
+        self.counterpart = counterpart
+        self.methods = methods
+        self.differences = 0
+
+    def process_candidate(self, candidate, fs):
+        if candidate is None or not self.satisfies_invariant(candidate):
+            self.invariant_violations += 1
+            return
+        twin = self.counterpart(candidate) if self.counterpart else self.instantiate_with(self.other, fs)
+        if twin is None or not all(pred(twin) for pred in getattr(twin, "_invariant", ())):
+            self.log_difference(candidate, fs, "initialization", [], "%s rejects the candidate" % self.other.__name__)
+        else:
+            self.process_method_pairs(candidate, twin, fs)
+        self.candidates += 1
+
+    def process_method_pairs(self, candidate, twin, fs):
+        import inspect
+        for key, val in inspect.getmembers(candidate, predicate=inspect.ismethod):
+            if not hasattr(val, "_bet_arguments") or (self.methods is not None and key not in self.methods):
+                continue
+            for args in self.arguments_for(val):
+                if self.skips(key):
+                    break
+                self.method_call_candidates += 1
+                if hasattr(val, "_precondition") and not self.process_precondition(val, self.copy_candidate(candidate), args):
+                    self.precondition_violations += 1
+                    continue
+                self.compare_calls(candidate, twin, fs, key, args)
+
+    def outcome(self, instance, fs, name, args):
+        """(return value, exception) of one call; contract violations are logged as failures"""
+        method = getattr(instance, name)
+        try:
+            return method(*args), None
+        except ContractViolation as cv:
+            self.log_call_failure(instance, fs, method, args, cv)
+            self.failures += 1
+            return None, cv
+        except Exception as ex:
+            return None, ex
+
+    def compare_calls(self, candidate, twin, fs, name, args):
+        ret, ex = self.outcome(candidate, fs, name, args)
+        other_ret, other_ex = self.outcome(twin, fs, name, args)
+        if type(ex) is not type(other_ex):
+            reason = "raised %s and %s" % (type(ex).__name__, type(other_ex).__name__)
+        elif ex is None and not self.equivalent(ret, other_ret):
+            reason = "returned %r and %r" % (ret, other_ret)
+        elif not self.equivalent(candidate, twin):
+            reason = "left different states"
+        else:
+            if ex is None:
+                self.successes += 1
+            return
+        self.log_difference(candidate, fs, name, args, reason)
+
+    def log_difference(self, candidate, fs, name, args, reason):
+        self.differences += 1
+        self.running_log.append("instance of %s with initialization %s differs from %s when calling %s with arguments %s: %s" % (candidate.__class__.__name__, fs, self.other.__name__, name, ', '.join(map(str, args)), reason))
+
+    def print_invoice(self):
+        bet.print_invoice(self)
+        print " Differences: " + str(self.differences)
+
+_defines_hash = {}
+
+def defines_hash(clazz):
+    """Whether clazz (new- or old-style) or a base other than object defines __hash__"""
+    try:
+        return _defines_hash[clazz]
+    except KeyError:
+        pass
+    import inspect
+    result = False
+    for klass in inspect.getmro(clazz):
+        if klass is object:
+            break
+        if "__hash__" in klass.__dict__:
+            result = klass.__dict__["__hash__"] is not None
+            break
+    _defines_hash[clazz] = result
+    return result
+
+def state_key(instance):
+    """What tells two states apart: the instance itself when its class defines
+    __hash__ (with its ==), otherwise its structural fingerprint"""
+    clazz = class_of(instance)
+    if defines_hash(clazz):
+        key = (clazz, instance)
+        try:
+            hash(key)
+            return key
+        except TypeError:
+            pass
+    return (clazz, fingerprint(instance))
+
+class sequence_bet(bet):
+    """bet which calls sequences of up to depth methods on each candidate.
+
+    From each candidate satisfying the invariant, every finitized call the
+    precondition accepts is made on a copy, breadth first, and every
+    resulting state is extended with every call again, up to depth calls.
+    A state already reached in as few calls (see state_key), from this or an
+    earlier candidate, is not extended again, so the cost grows with the
+    number of distinct states rather than the number of sequences."""
+    def __init__(self, clazz, depth=2):
+        bet.__init__(self, clazz)
+        self.depth = depth
+        self.visited = {}
+        self.pruned = 0
+
+    def process_candidate(self, candidate, fs):
+        if candidate is None or not self.satisfies_invariant(candidate):
+            self.invariant_violations += 1
+            return
+        self.candidates += 1
+        if not self.visit(candidate, 0):
+            return
+        import collections
+        queue = collections.deque([(candidate, [])])
+        while queue and not self.stopped:
+            state, sequence = queue.popleft()
+            for name, val, args in self.calls(state):
+                self.method_call_candidates += 1
+                if hasattr(val, "_precondition") and not self.process_precondition(val, self.copy_candidate(state), args):
+                    self.precondition_violations += 1
+                    continue
+                successor = self.copy_candidate(state)
+                try:
+                    getattr(successor, name)(*args)
+                except ContractViolation as cv:
+                    self.log_sequence_failure(candidate, fs, sequence, name, args, cv)
+                    self.failures += 1
+                    continue
+                self.successes += 1
+                if len(sequence) + 1 < self.depth and self.visit(successor, len(sequence) + 1):
+                    queue.append((successor, sequence + [(name, args)]))
+
+    def visit(self, state, calls):
+        """Whether state, reached in calls calls, is still to be extended"""
+        key = state_key(state)
+        if self.visited.get(key, self.depth) <= calls:
+            self.pruned += 1
+            return False
+        self.visited[key] = calls
+        return True
+
+    def calls(self, state):
+        import inspect
+        for name, val in inspect.getmembers(state, predicate=inspect.ismethod):
+            if hasattr(val, "_bet_arguments"):
+                for args in self.arguments_for(val):
+                    if self.skips(name):
+                        break
+                    yield name, val, args
+
+    def log_sequence_failure(self, candidate, fs, sequence, name, args, cv):
+        def message():
+            calls = ", ".join("%s(%s)" % (called, ", ".join(map(str, called_args))) for called, called_args in sequence) or "no calls"
+            return "instance of %s with initialization %s failed after %s when calling %s with arguments %s. Reason: %s" % (candidate.__class__.__name__, fs, calls, name, ', '.join(map(str, args)), cv)
+        self.record_failure(name, cv, message)
+
+    def print_invoice(self):
+        bet.print_invoice(self)
+        print " Depth: " + str(self.depth)
+        print " Distinct States: " + str(len(self.visited))
+        print " Pruned States: " + str(self.pruned)
+
 # I used to check the precondition separately, but it's more compact without it
 # def call_init(candidate, val):
 #     for args in enumerate_args(val._bet_arguments):
@@ -567,11 +2521,18 @@ class finitize(object):
         return clazz
 
 class finitize_method(object):
-    def __init__(self, *bet_arguments):
+    """Attaches the argument values bet calls a method with.
+    strength=t asks for a t-wise covering array of them instead of their full product."""
+    def __init__(self, *bet_arguments, **options):
         self.bet_arguments = bet_arguments
+        self.strength = options.pop("strength", None)
+        if options:
+            raise TypeError("unexpected options %s" % ", ".join(options))
 
     def __call__(self, method):
         method._bet_arguments = self.bet_arguments
+        if self.strength is not None:
+            method._bet_strength = self.strength
         return method
 
 # def enumerate_gen(ob):
@@ -584,11 +2545,12 @@ class finitize_method(object):
 #         indexvector = increment_vec(indexvector, maxindexvector)
 
 class enumerate_args(object):
-    def __init__(self, arg, arg_scope):
+    def __init__(self, arg, arg_scope, strength=None):
         self.fieldvector = arg
         self.arg_scope = arg_scope
         self.indexvector = [0 for f in self.fieldvector]
         self.maxindexvector = [len(a) for a in arg]
+        self.rows = covering_rows(self.maxindexvector, strength)
 
     def __iter__(self):
         return self
@@ -597,6 +2559,9 @@ class enumerate_args(object):
         self.arg_scope -= 1
         if self.arg_scope == -1:
             raise StopIteration
+        if self.rows is not None:
+            row = self.rows.next()
+            return [self.fieldvector[pos][row[pos]] for pos in xrange(len(row))]
         if self.indexvector:
             ret = [self.fieldvector[pos][self.indexvector[pos]] for pos in xrange(len(self.indexvector))]
             self.indexvector = increment_vec(self.indexvector, self.maxindexvector)
@@ -609,28 +2574,108 @@ class enumerate_args(object):
 
 class enumerate(object):
     """The iterator version of instance enumeration.
-    This version supports len(), so BET can recurse on instances."""
-    def __init__(self, ob):
+    This version supports len(), so BET can recurse on instances.
+    With a strength t, only the fieldsets of a t-wise covering array are given."""
+    def __init__(self, ob, strength=None):
         self.ob = ob
         if not hasattr(ob, "_finitization_field_set"):
             ob._finitization_field_set = {}
-        self.fieldvector = ob._finitization_field_set.keys()
+        self.field_set = finitization_field_set(ob)
+        self.fieldvector = self.field_set.keys()
         self.indexvector = [0 for f in self.fieldvector]
-        self.maxindexvector = [len(ob._finitization_field_set[fi]) for fi in self.fieldvector]
+        self.maxindexvector = [len(self.field_set[fi]) for fi in self.fieldvector]
+        self.rows = covering_rows(self.maxindexvector, strength)
 
     def __iter__(self):
         return self
 
     def next(self):
+        if self.rows is not None:
+            row = self.rows.next()
+            return dict((key, self.field_set[key][index]) for key, index in zip(self.fieldvector, row))
         if self.indexvector:
-            ret = dict( (key,self.ob._finitization_field_set[key][self.indexvector[self.fieldvector.index(key)]]) for key in self.fieldvector)
+            ret = dict( (key,self.field_set[key][self.indexvector[self.fieldvector.index(key)]]) for key in self.fieldvector)
             self.indexvector = increment_vec(self.indexvector, self.maxindexvector)
             return ret
         else:
             raise StopIteration
 
     def __len__(self):
-        return reduce(lambda x, y: x*len(y), self.ob._finitization_field_set.values(), 1)
+        if self.rows is not None:
+            return len(self.rows)
+        return reduce(lambda x, y: x*len(y), self.field_set.values(), 1)
+
+def covering_rows(sizes, strength):
+    """A covering_array of the value indices, or None when the full product is wanted"""
+    if strength is None or strength >= len(sizes):
+        return None
+    if strength < 1:
+        raise ValueError("strength must be at least 1, not %r" % strength)
+    return covering_array(sizes, strength)
+
+class covering_array(object):
+    """Rows of value indices in which every combination of values of any
+    strength positions appears at least once, built in the manner of IPOG:
+    the full product of the first strength positions, then one position at
+    a time, first extending each row with the value covering the most new
+    combinations, then adding rows for the combinations still missing.
+
+    The rows only depend on the sizes and the strength, and every candidate
+    (and sequence state) enumerates the same arguments, so they are built
+    once per shape; each covering_array keeps its own position."""
+    built = {}
+
+    def __init__(self, sizes, strength):
+        key = (tuple(sizes), strength)
+        rows = covering_array.built.get(key)
+        if rows is None:
+            rows = covering_array.built[key] = self.build(list(sizes), strength)
+        self.rows = rows
+        self.position = 0
+
+    def build(self, sizes, strength):
+        if 0 in sizes:
+            return []
+        rows = [list(row) for row in itertools.product(*[xrange(size) for size in sizes[:strength]])]
+        for k in xrange(strength, len(sizes)):
+            columns = list(itertools.combinations(xrange(k), strength - 1))
+            uncovered = set((cols, values, v) for cols in columns
+                            for values in itertools.product(*[xrange(sizes[c]) for c in cols])
+                            for v in xrange(sizes[k]))
+            for row in rows:
+                best, best_covered = 0, ()
+                for v in xrange(sizes[k]):
+                    covered = [combination for combination in ((cols, tuple(row[c] for c in cols), v) for cols in columns)
+                               if combination in uncovered]
+                    if len(covered) > len(best_covered):
+                        best, best_covered = v, covered
+                row.append(best)
+                uncovered.difference_update(best_covered)
+            added = []
+            for cols, values, v in sorted(uncovered):
+                for row in added:
+                    if row[k] == v and all(row[c] in (None, value) for c, value in zip(cols, values)):
+                        break
+                else:
+                    row = [None] * k + [v]
+                    added.append(row)
+                for c, value in zip(cols, values):
+                    row[c] = value
+            rows.extend(added)
+        # positions nobody needed are free, any value does
+        return [[0 if index is None else index for index in row] for row in rows]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.position == len(self.rows):
+            raise StopIteration
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def __len__(self):
+        return len(self.rows)
 
 def increment_vec(vec, max_vec):
     def hidden_increment(vec, max_vec, pos):
@@ -0,0 +1,515 @@
+"""
+Predicate expressions, compiled into plain functions
+
+An expression is built from P and Python operators, and compiled into one
+generated function with no inner calls besides the ones it names:
+
+    from dbcbet.expressions import P
+
+    @pre((P.arg(0) > 0) & P.self.items.is_not(None))
+    @post(P.ret == P.old.self.total + P.arg(0))
+    def add(self, amount): ...
+
+P.self, P.old, P.ret and P.item (the item a generator yields) stand for the
+predicate's arguments, P.arg(i) for the method's i-th argument, and
+P.call(function, ...) for a call. Attributes, items, comparisons and
+arithmetic build larger expressions; & | ~ combine them like and, or, not
+(mind their precedence: parenthesize comparisons). x.is_(y), x.is_not(y),
+x.in_(y), x.not_in(y) and x.isinstance_(types) cover the rest.
+
+pre, post, inv and yields compile an expression for their component. When a
+compiled predicate fails, its error() names the failing sub-expression and
+the values involved, for the current thread. The values are the ones the
+failing call computed (nothing is evaluated again). Only those operand
+values are kept from a failing call, not self, old, ret or the arguments
+themselves, and only the message once error() has formatted it.
+
+and_, or_, not_, args, state and returns in dbcbet.helpers are compiled the
+same way, with the predicates they combine called directly from the
+generated function instead of through a closure each.
+"""
+from __future__ import absolute_import
+
+import threading
+
+#
+# Where each reference is found in the generated function, per layout.
+# "forward" is the layout of a combination of plain predicates, which passes
+# on whatever arguments it gets.
+#
+LAYOUTS = {
+    "forward": {"signature": "*a, **k", "forward": "*a, **k", "self": "a[0]"},
+    "pre": {"signature": "s, *a, **k", "forward": "s, *a, **k", "self": "s", "arg": "a"},
+    "post": {"signature": "s, old, ret, *a, **k", "forward": "s, old, ret, *a, **k", "self": "s",
+             "old": "old", "ret": "ret", "arg": "a"},
+    "yields": {"signature": "s, item, *a, **k", "forward": "s, item, *a, **k", "self": "s",
+               "item": "item", "arg": "a"},
+    }
+COMPONENT_LAYOUTS = {"pre": "pre", "inv": "pre", "post": "post", "yields": "yields"}
+
+class context(object):
+    """What the references of an expression compile to, the constants it names,
+    and the locals holding the values each node's explanation shows"""
+    def __init__(self, layout, names, captured=None):
+        self.layout = layout
+        self.places = LAYOUTS[layout]
+        self.forward = self.places["forward"]
+        self.names = names
+        self.captured = captured if captured is not None else {}
+
+    def forwarding(self, forward):
+        inner = context(self.layout, self.names, self.captured)
+        inner.forward = forward
+        return inner
+
+    def place(self, kind):
+        if kind not in self.places:
+            raise ValueError("P.%s is not available in a %s predicate" % (kind, self.layout))
+        return self.places[kind]
+
+    def name(self, value):
+        """The name of a constant in the generated function's namespace"""
+        for name, known in self.names.items():
+            if known is value:
+                return name
+        name = "c%d" % len(self.names)
+        self.names[name] = value
+        return name
+
+class emitter(object):
+    """The statements of a generated function, before its final test"""
+    def __init__(self):
+        self.lines = []
+        self.depth = 1
+        self.count = 0
+
+    def local(self):
+        self.count += 1
+        return "v%d" % self.count
+
+    def line(self, statement):
+        self.lines.append("    " * self.depth + statement)
+
+    def open(self, condition):
+        self.line("if %s:" % condition)
+        self.depth += 1
+
+    def source(self):
+        return "".join(line + "\n" for line in self.lines)
+
+def captured(node, ctx, out):
+    """The source of node's value: a local of its own unless it is a constant"""
+    source = node._emit(ctx, out)
+    if isinstance(node, constant):
+        return source
+    name = out.local()
+    out.line("%s = %s" % (name, source))
+    return name
+
+def wrap(value):
+    return value if isinstance(value, expression) else constant(value)
+
+class expression(object):
+    """A node of a predicate expression.
+
+    Attribute access builds an attribute node, so everything an expression
+    keeps for itself starts with an underscore."""
+    __hash__ = object.__hash__
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return attribute(self, name)
+
+    def __getitem__(self, key):
+        return item(self, wrap(key))
+
+    def __call__(self, *args, **kwargs):
+        function = self.__dict__.get("_function")
+        if function is None:
+            function = self._function = compile_expression(self, default_layout(self))
+        return function(*args, **kwargs)
+
+    def __nonzero__(self):
+        raise TypeError("an expression has no truth value; combine expressions with & | ~ instead of and, or, not")
+
+    def __lt__(self, other):
+        return comparison("<", self, wrap(other))
+    def __le__(self, other):
+        return comparison("<=", self, wrap(other))
+    def __eq__(self, other):
+        return comparison("==", self, wrap(other))
+    def __ne__(self, other):
+        return comparison("!=", self, wrap(other))
+    def __gt__(self, other):
+        return comparison(">", self, wrap(other))
+    def __ge__(self, other):
+        return comparison(">=", self, wrap(other))
+
+    def __add__(self, other):
+        return arithmetic("+", self, wrap(other))
+    def __radd__(self, other):
+        return arithmetic("+", wrap(other), self)
+    def __sub__(self, other):
+        return arithmetic("-", self, wrap(other))
+    def __rsub__(self, other):
+        return arithmetic("-", wrap(other), self)
+    def __mul__(self, other):
+        return arithmetic("*", self, wrap(other))
+    def __rmul__(self, other):
+        return arithmetic("*", wrap(other), self)
+    def __div__(self, other):
+        return arithmetic("/", self, wrap(other))
+    __truediv__ = __div__
+    def __rdiv__(self, other):
+        return arithmetic("/", wrap(other), self)
+    __rtruediv__ = __rdiv__
+    def __mod__(self, other):
+        return arithmetic("%", self, wrap(other))
+    def __neg__(self):
+        return arithmetic("-", constant(0), self)
+
+    def __and__(self, other):
+        return conjunction([self, wrap(other)])
+    __rand__ = __and__
+    def __or__(self, other):
+        return disjunction([self, wrap(other)])
+    __ror__ = __or__
+    def __invert__(self):
+        return negation(self)
+
+    def is_(self, other):
+        return comparison("is", self, wrap(other))
+    def is_not(self, other):
+        return comparison("is not", self, wrap(other))
+    def in_(self, other):
+        return comparison("in", self, wrap(other))
+    def not_in(self, other):
+        return comparison("not in", self, wrap(other))
+    def isinstance_(self, types):
+        return call(constant(isinstance), [self, wrap(types)])
+
+    def _children(self):
+        return []
+
+    def _references(self):
+        """The kinds of references (self, old, ret, item, arg) the expression makes"""
+        kinds = set()
+        for child in self._children():
+            kinds |= child._references()
+        return kinds
+
+    def _emit(self, ctx, out):
+        """The source of the expression's value, after the statements it adds to out"""
+        return self._source(ctx)
+
+    def _explain(self, ctx, env):
+        """Why the expression failed, given the generated function's locals"""
+        return self._describe()
+
+class reference(expression):
+    def __init__(self, kind, index=None):
+        self._kind = kind
+        self._index = index
+
+    def _references(self):
+        return set([self._kind])
+
+    def _source(self, ctx):
+        if self._index is None:
+            return ctx.place(self._kind)
+        return "%s[%d]" % (ctx.place(self._kind), self._index)
+
+    def _describe(self):
+        if self._index is None:
+            return self._kind
+        return "%s(%d)" % (self._kind, self._index)
+
+class constant(expression):
+    def __init__(self, value):
+        self._value = value
+
+    def _source(self, ctx):
+        if self._value is None or isinstance(self._value, (bool, int, long)):
+            return repr(self._value)
+        return ctx.name(self._value)
+
+    def _describe(self):
+        return getattr(self._value, "__name__", None) or repr(self._value)
+
+class attribute(expression):
+    def __init__(self, target, name):
+        self._target = target
+        self._name = name
+
+    def _children(self):
+        return [self._target]
+
+    def _source(self, ctx):
+        return "%s.%s" % (self._target._source(ctx), self._name)
+
+    def _describe(self):
+        return "%s.%s" % (self._target._describe(), self._name)
+
+class item(expression):
+    def __init__(self, target, key):
+        self._target = target
+        self._key = key
+
+    def _children(self):
+        return [self._target, self._key]
+
+    def _source(self, ctx):
+        return "%s[%s]" % (self._target._source(ctx), self._key._source(ctx))
+
+    def _describe(self):
+        return "%s[%s]" % (self._target._describe(), self._key._describe())
+
+class call(expression):
+    def __init__(self, function, arguments):
+        self._function_node = function
+        self._arguments = arguments
+
+    def _children(self):
+        return [self._function_node] + self._arguments
+
+    def _source(self, ctx):
+        return "%s(%s)" % (self._function_node._source(ctx), ", ".join(argument._source(ctx) for argument in self._arguments))
+
+    def _describe(self):
+        return "%s(%s)" % (self._function_node._describe(), ", ".join(argument._describe() for argument in self._arguments))
+
+    def _emit(self, ctx, out):
+        arguments = ctx.captured[id(self)] = [captured(argument, ctx, out) for argument in self._arguments]
+        return "%s(%s)" % (self._function_node._source(ctx), ", ".join(arguments))
+
+    def _explain(self, ctx, env):
+        return "%s is false%s" % (self._describe(), values(self._arguments, ctx.captured[id(self)], ctx, env))
+
+def values(operands, sources, ctx, env):
+    """The values of the operands which are not constants, for an error message"""
+    shown = ["%s is %r" % (operand._describe(), env[source])
+             for operand, source in zip(operands, sources) if not isinstance(operand, constant)]
+    return " (%s)" % ", ".join(shown) if shown else ""
+
+class arithmetic(expression):
+    def __init__(self, op, left, right):
+        self._op = op
+        self._left = left
+        self._right = right
+
+    def _children(self):
+        return [self._left, self._right]
+
+    def _source(self, ctx):
+        return "(%s %s %s)" % (self._left._source(ctx), self._op, self._right._source(ctx))
+
+    def _describe(self):
+        return "(%s %s %s)" % (self._left._describe(), self._op, self._right._describe())
+
+class comparison(arithmetic):
+    def _describe(self):
+        return "%s %s %s" % (self._left._describe(), self._op, self._right._describe())
+
+    def _emit(self, ctx, out):
+        left, right = ctx.captured[id(self)] = (captured(self._left, ctx, out), captured(self._right, ctx, out))
+        return "(%s %s %s)" % (left, self._op, right)
+
+    def _explain(self, ctx, env):
+        return "%s%s" % (self._describe(), values([self._left, self._right], ctx.captured[id(self)], ctx, env))
+
+class conjunction(expression):
+    joiner = "and"
+    # the test on an operand's value under which the next operand is evaluated
+    proceed = "%s"
+
+    def __init__(self, operands):
+        self._operands = []
+        # a & b & c is one conjunction of three, so it compiles to one flat and
+        for operand in operands:
+            if type(operand) is type(self):
+                self._operands.extend(operand._operands)
+            else:
+                self._operands.append(operand)
+
+    def _children(self):
+        return self._operands
+
+    def _source(self, ctx):
+        return "(%s)" % (" %s " % self.joiner).join(operand._source(ctx) for operand in self._operands)
+
+    def _describe(self):
+        return (" %s " % self.joiner).join(operand._describe() for operand in self._operands)
+
+    def _emit(self, ctx, out):
+        # each operand's value gets a local, so error() knows which ones were false
+        result, depth, names = out.local(), out.depth, []
+        for operand in self._operands:
+            if names:
+                out.open(self.proceed % names[-1])
+            names.append(out.local())
+            out.line("%s = %s = %s" % (result, names[-1], operand._emit(ctx, out)))
+        out.depth = depth
+        ctx.captured[id(self)] = names
+        return result
+
+    def _explain(self, ctx, env):
+        for operand, name in zip(self._operands, ctx.captured[id(self)]):
+            if name in env and not env[name]:
+                return operand._explain(ctx, env)
+        return self._describe()
+
+class disjunction(conjunction):
+    joiner = "or"
+    proceed = "not %s"
+
+    def _explain(self, ctx, env):
+        return "none of: " + "; ".join(operand._explain(ctx, env) for operand in self._operands)
+
+class negation(expression):
+    def __init__(self, operand):
+        self._operand = operand
+
+    def _children(self):
+        return [self._operand]
+
+    def _source(self, ctx):
+        return "(not %s)" % self._operand._source(ctx)
+
+    def _describe(self):
+        return "not (%s)" % self._operand._describe()
+
+class forwarded(expression):
+    """A plain predicate, called with the arguments the expression passes on"""
+    def __init__(self, predicate):
+        self._predicate = predicate
+
+    def _source(self, ctx):
+        return "%s(%s)" % (ctx.name(self._predicate), ctx.forward)
+
+    def _describe(self):
+        # the predicate's own error() is about its latest failure in this thread
+        from dbcbet.helpers import predicate_description
+        return predicate_description(self._predicate)
+
+class bound(expression):
+    """An expression whose plain predicates get one value: self, ret or an argument.
+    For an argument, a call without that argument passes."""
+    def __init__(self, operand, value, label=""):
+        self._operand = operand
+        self._value = value
+        self._label = label
+
+    def _children(self):
+        return [self._operand, self._value]
+
+    def _inner(self, ctx):
+        return ctx.forwarding(self._value._source(ctx))
+
+    def _source(self, ctx):
+        source = self._operand._source(self._inner(ctx))
+        if self._value._kind == "arg":
+            return "(len(%s) <= %d or %s)" % (ctx.place("arg"), self._value._index, source)
+        return source
+
+    def _emit(self, ctx, out):
+        if self._value._kind != "arg":
+            return self._operand._emit(self._inner(ctx), out)
+        result, depth = out.local(), out.depth
+        out.line("%s = len(%s) <= %d" % (result, ctx.place("arg"), self._value._index))
+        out.open("not %s" % result)
+        out.line("%s = %s" % (result, self._operand._emit(self._inner(ctx), out)))
+        out.depth = depth
+        return result
+
+    def _describe(self):
+        return self._label + self._operand._describe()
+
+    def _explain(self, ctx, env):
+        return self._label + self._operand._explain(self._inner(ctx), env)
+
+class builder(object):
+    """P: the starting points of predicate expressions"""
+    self = reference("self")
+    old = reference("old")
+    ret = reference("ret")
+    item = reference("item")
+
+    def arg(self, index):
+        return reference("arg", index)
+
+    def call(self, function, *arguments):
+        return call(constant(function), [wrap(argument) for argument in arguments])
+
+P = builder()
+
+def default_layout(expr):
+    kinds = expr._references()
+    if "old" in kinds or "ret" in kinds:
+        return "post"
+    if "item" in kinds:
+        return "yields"
+    if kinds:
+        return "pre"
+    return "forward"
+
+def compile_expression(expr, layout, name="expression"):
+    """A function evaluating expr, with its arguments laid out as in layout"""
+    names = {}
+    ctx, out = context(layout, names), emitter()
+    source = expr._emit(ctx, out)
+    failure = threading.local()
+    names["failure"] = failure
+    signature = LAYOUTS[layout]["signature"]
+    # error() reads the captured locals; the arguments of the failing call are not kept
+    arguments = [argument.strip(" *") for argument in signature.split(",")]
+    code = ("def %s(%s):\n"
+            "%s"
+            "    if %s:\n"
+            "        return True\n"
+            "    values = locals()\n"
+            "    del %s\n"
+            "    failure.env = values\n"
+            "    return False\n") % (name, signature, out.source(), source,
+                                    ", ".join("values[%r]" % argument for argument in arguments))
+    exec code in names
+    function = names[name]
+    def error():
+        env = getattr(failure, "env", None)
+        if env is not None:
+            # the message is all that is kept of the failing call
+            failure.message = expr._explain(ctx, env)
+            failure.env = None
+        return getattr(failure, "message", None) or expr._describe()
+    function.error = error
+    function.__doc__ = expr._describe()
+    function._expression = expr
+    function._layout = layout
+    return function
+
+def expression_of(predicate, bound_context=False):
+    """predicate as a node: the expression it was compiled from, or a call of it.
+
+    Inside bound, only expressions without references of their own are taken
+    apart, since bound changes what their plain predicates are called with."""
+    if isinstance(predicate, expression):
+        return predicate
+    expr = getattr(predicate, "_expression", None)
+    if expr is not None and (not bound_context or not expr._references()):
+        return expr
+    return forwarded(predicate)
+
+def compiled(predicate, component):
+    """predicate, compiled for a pre, post, inv or yields contract if it is an expression"""
+    layout = COMPONENT_LAYOUTS[component]
+    if isinstance(predicate, expression):
+        return compile_expression(predicate, layout)
+    expr = getattr(predicate, "_expression", None)
+    if expr is None or predicate._layout in ("forward", layout) or not expr._references() - set(["self"]):
+        return predicate
+    # compiled for another component: where the arguments are differs
+    function = compile_expression(expr, layout, predicate.__name__)
+    for key, value in predicate.__dict__.items():
+        if key not in ("error", "_expression", "_layout"):
+            setattr(function, key, value)
+    return function
@@ -11,75 +11,480 @@ Since some of those take additional predicates, some abstractions might be nice:
 2. numeric tests: (number, positive, negative)
 3. logical tests: (not, and, or) with negative==not(positive), nonzero==or(positive, negative)
 4. is_type: some kind of isinstance wrapper
+
+For declared fields (dbcbet.field), bounds and size are constraints which
+also suggest boundary values to bet.
+
+For array arguments and return values, the array_* helpers check a whole
+NumPy array in one vectorized pass (NumPy is only imported when they run).
+
+returns, state, args, not_, or_ and and_ compile what they combine into one
+function (see dbcbet.expressions, whose P is also available from here).
 """
-from functools import wraps
+from __future__ import absolute_import
+from functools import update_wrapper, WRAPPER_ASSIGNMENTS, WRAPPER_UPDATES
+from types import FunctionType
+import operator
+import threading
+
+from dbcbet.expressions import P, expression, conjunction, disjunction, negation, bound, constant, expression_of
+
+def wraps(predicate):
+    """functools.wraps which also accepts callable objects and keeps their error()"""
+    assigned = [attr for attr in WRAPPER_ASSIGNMENTS if hasattr(predicate, attr)]
+    updated = WRAPPER_UPDATES if isinstance(predicate, FunctionType) else ()
+    def decorate(wrapper):
+        update_wrapper(wrapper, predicate, assigned, updated)
+        if hasattr(predicate, "error"):
+            wrapper.error = predicate.error
+        return wrapper
+    return decorate
+
+def predicate_description(predicate):
+    """The error message, docstring, or name of a predicate"""
+    if hasattr(predicate, "error"):
+        return predicate.error()
+    if getattr(predicate, "__doc__", None) is not None:
+        return predicate.__doc__
+    return getattr(predicate, "__name__", repr(predicate))
+
+def expensive(predicate):
+    """Tags a predicate as expensive: it is only checked at the "expensive" assertion level.
+
+    An expression is compiled first, so the tag is on the function pre, post
+    and inv get (and keep when they compile it for their component)."""
+    if isinstance(predicate, expression):
+        predicate = compiled_combination(predicate, "expensive_expression")
+    predicate._cost = "expensive"
+    return predicate
+
+def compiled_combination(expr, name, predicate=None):
+    """expr compiled into one function, which takes predicate's name and attributes if it stands in for it"""
+    from dbcbet.expressions import compile_expression, default_layout
+    combination = compile_expression(expr, default_layout(expr), name)
+    if predicate is not None:
+        error, layout = combination.error, combination._layout
+        wraps(predicate)(combination)
+        combination.error, combination._expression, combination._layout = error, expr, layout
+    return combination
 
 def returns(predicate):
     """DBC helper for reusable, simple predicates for return-value tests used in postconditions"""
-    @wraps(predicate)
-    def return_wrapped(s, old, ret, *args, **kwargs):
-        return predicate(ret)
-    return return_wrapped    
+    return compiled_combination(bound(expression_of(predicate, True), P.ret), "return_wrapped", predicate)
 
 def state(predicate):
     """DBC helper for reusable, simple predicates for object-state tests used in both preconditions and postconditions"""
-    @wraps(predicate)
-    def wrapped_predicate(s, *args, **kwargs):
-        return predicate(s)
-    return wrapped_predicate
+    return compiled_combination(bound(expression_of(predicate, True), P.self), "wrapped_predicate", predicate)
 
 def args(*arglist):
     """DBC helper for reusable, simple predicates for argument-value tests used in preconditions"""
-    def positional_predicate(s, *ar, **kw):
-        for pred, arg in zip(arglist, ar):
-            if not pred(arg):
-                return False
-        return True
-    return positional_predicate
+    if not arglist:
+        return compiled_combination(constant(True), "positional_predicate")
+    return compiled_combination(conjunction([bound(expression_of(pred, True), P.arg(position), "argument %d: " % position)
+                                             for position, pred in enumerate(arglist)]), "positional_predicate")
 
 def not_(predicate):    
     """DBC helper for negating reusable, simple predicates used in preconditions, postconditions, and invariants"""
-    @wraps(predicate)
-    def negated_predicate(*args, **kwargs):
-        return not predicate(*args, **kwargs)
-    return negated_predicate
+    negated_predicate = compiled_combination(negation(expression_of(predicate)), "negated_predicate", predicate)
+    return columnar(negated_predicate, [predicate], lambda mask: ~mask)
 
 def or_(predicate1, predicate2):
     """DBC helper for disjunction of predicates"""
-    def or_predicates(*args, **kwargs):
-        return predicate1(*args, **kwargs) or predicate2(*args, **kwargs)
-    return or_predicates
+    or_predicates = compiled_combination(disjunction([expression_of(predicate1), expression_of(predicate2)]), "or_predicates")
+    return columnar(or_predicates, [predicate1, predicate2], lambda mask1, mask2: mask1 | mask2)
 
 def and_(predicate1, predicate2):
     """DBC helper for conjunction of predicates"""
-    def and_predicates(*args, **kwargs):
-        return predicate1(*args, **kwargs) and predicate2(*args, **kwargs)
-    return and_predicates
+    and_predicates = compiled_combination(conjunction([expression_of(predicate1), expression_of(predicate2)]), "and_predicates")
+    return columnar(and_predicates, [predicate1, predicate2], lambda mask1, mask2: mask1 & mask2)
 
-class argument_types:
-    """DBC helper for reusable, simple predicates for argument-type tests used in preconditions"""
-    def __init__(self, *typelist):
-        self.typelist = typelist
-        self.msg = "implementation error in argument_types"
+def columnar(combination, predicates, combine):
+    """Makes a combination of invariants vectorized (see field_bounds) if all of them are"""
+    # an expression has every attribute, as a node
+    if all(not isinstance(pred, expression) and hasattr(pred, "vectorized") for pred in predicates):
+        combination.fields = tuple(set(name for pred in predicates for name in pred.fields))
+        combination.vectorized = lambda numpy, columns: combine(*[pred.vectorized(numpy, columns) for pred in predicates])
+    else:
+        # wraps copies the attributes of a wrapped function
+        combination.__dict__.pop("fields", None)
+        combination.__dict__.pop("vectorized", None)
+    return combination
+
+def resolve_type(spec, module):
+    """The tuple of classes a type spec stands for.
+
+    A spec is a class, None (any type), a name or dotted path, or a tuple of
+    specs. Names are looked up in module (the module which wrote the spec),
+    then among the builtins; a dotted path may also start with a module to import."""
+    import sys
+    import __builtin__
+    if spec is None:
+        return (object,)
+    if isinstance(spec, (tuple, list)):
+        return tuple(clazz for each in spec for clazz in resolve_type(each, module))
+    if not isinstance(spec, basestring):
+        return (spec,)
+    parts = spec.split(".")
+    namespace = getattr(sys.modules.get(module), "__dict__", {})
+    if parts[0] in namespace:
+        found, rest = namespace[parts[0]], parts[1:]
+    elif hasattr(__builtin__, parts[0]):
+        found, rest = getattr(__builtin__, parts[0]), parts[1:]
+    else:
+        # the longest prefix which can be imported is the module
+        import importlib
+        for length in xrange(len(parts) - 1, 0, -1):
+            try:
+                found, rest = importlib.import_module(".".join(parts[:length])), parts[length:]
+                break
+            except ImportError:
+                pass
+        else:
+            raise NameError("cannot resolve the type %r from %s" % (spec, module))
+    for part in rest:
+        if not hasattr(found, part):
+            raise NameError("cannot resolve the type %r from %s" % (spec, module))
+        found = getattr(found, part)
+    return (found,)
+
+def type_name(types):
+    return " or ".join(getattr(clazz, "__name__", repr(clazz)) for clazz in types)
 
-    def _str_to_class(self, string):
+class argument_types(object):
+    """DBC helper for reusable, simple predicates for argument-type tests used in preconditions.
+
+    Each argument (or None) must be an instance of the type at its position.
+    Types may be given by name, for classes defined later (see resolve_type);
+    they are resolved on the first check. With names, the arguments passed by
+    keyword are checked as well."""
+    def __init__(self, *typelist, **options):
         import sys
-        return reduce(getattr, string.split("."), sys.modules[__name__])
+        self.typelist = typelist
+        self.names = options.pop("names", ())
+        self.module = options.pop("module", None) or sys._getframe(1).f_globals.get("__name__")
+        if options:
+            raise TypeError("unexpected options %s" % ", ".join(options))
+        self.types = None
+        self.failure = threading.local()
+
+    def resolve(self):
+        # resolving twice on two threads gives the same tuples, so no lock is
+        # needed; positions is set first, since other threads go by types alone
+        types = [resolve_type(spec, self.module) for spec in self.typelist]
+        self.positions = dict((name, position) for position, name in enumerate(self.names))
+        self.types = types
+        return types
 
     def __call__(self, s, *args, **kwargs):
-        for typ, arg in zip(self.typelist, args):
-            if isinstance(typ, str):
-                if isinstance(arg, self._str_to_class(typ)) and arg is not None:
-                    self.msg = "argument %s was not of type %s" % (arg, typ)
-                    return False
-            if not isinstance(arg, typ) and arg is not None:
-                self.msg = "argument %s was not of type %s" % (arg, typ.__name__)
+        types = self.types
+        if types is None:
+            types = self.resolve()
+        for position, arg in enumerate(args[:len(types)]):
+            if arg is not None and not isinstance(arg, types[position]):
+                self.failure.last = (arg, types[position])
                 return False
+        if kwargs and self.positions:
+            for name, arg in kwargs.iteritems():
+                position = self.positions.get(name)
+                if position is not None and arg is not None and not isinstance(arg, types[position]):
+                    self.failure.last = (arg, types[position])
+                    return False
+        return True
+
+    def error(self):
+        last = getattr(self.failure, "last", None)
+        if last is None:
+            return "arguments of types %s" % ", ".join(spec if isinstance(spec, basestring) else type_name(resolve_type(spec, self.module))
+                                                       for spec in self.typelist)
+        return "argument %s was not of type %s" % (last[0], type_name(last[1]))
+
+class return_type(object):
+    """DBC helper for a postcondition on the type of the return value (None passes)"""
+    def __init__(self, spec, module=None):
+        import sys
+        self.spec = spec
+        self.module = module or sys._getframe(1).f_globals.get("__name__")
+        self.types = None
+        self.failure = threading.local()
+
+    def __call__(self, s, old, ret, *args, **kwargs):
+        if self.types is None:
+            self.types = resolve_type(self.spec, self.module)
+        if ret is not None and not isinstance(ret, self.types):
+            self.failure.ret = ret
+            return False
         return True
 
     def error(self):
-        return self.msg 
+        if not hasattr(self.failure, "ret"):
+            return "a return value of type %s" % (self.spec,)
+        return "return value %s was not of type %s" % (self.failure.ret, type_name(self.types))
+
+class typed(object):
+    """A decorator checking a method's arguments and return value against types.
+
+    The types are given as keywords, one per parameter name and returns= for
+    the return value; without any, the method's __annotations__ are used
+    ("return" for the return value). Names are resolved as by argument_types."""
+    def __init__(self, returns=None, **annotations):
+        import sys
+        self.returns = returns
+        self.annotations = annotations
+        self.module = sys._getframe(1).f_globals.get("__name__")
+
+    def __call__(self, method):
+        import inspect
+        from dbcbet.dbcbet import pre, post
+        annotations = dict(self.annotations)
+        returns = self.returns
+        if not annotations and returns is None:
+            annotations = dict(getattr(method, "__annotations__", {}))
+            returns = annotations.pop("return", None)
+        # the first parameter is self
+        names = inspect.getargspec(getattr(method, "__wrapped__", method)).args[1:]
+        unknown = set(annotations) - set(names)
+        if unknown:
+            raise TypeError("%s has no parameters %s" % (method.__name__, ", ".join(sorted(unknown))))
+        if annotations:
+            method = pre(argument_types(*[annotations.get(name) for name in names], names=names, module=self.module))(method)
+        if returns is not None:
+            method = post(return_type(returns, self.module))(method)
+        return method
+
+#
+# Vectorized helpers for NumPy array arguments and return values
+#
+class array_predicate(object):
+    """Base class for predicates which check a whole array in one NumPy pass.
+
+    The value is viewed with numpy.asarray, so ndarrays are never copied.
+    Use these with args() and returns(), e.g. returns(array_all(array_finite())).
+    After a failure, error() names the first bad element for the current thread."""
+    description = "array predicate"
+
+    def __init__(self):
+        self._failure = threading.local()
+
+    def __call__(self, value):
+        import numpy
+        message = self.check(numpy, numpy.asarray(value))
+        if message is None:
+            return True
+        self._failure.message = message
+        return False
+
+    def check(self, numpy, array):
+        """Returns None if the array passes, otherwise a failure message"""
+        mask = self.mask(numpy, array)
+        if mask.all():
+            return None
+        index = numpy.unravel_index(numpy.argmin(mask), mask.shape)
+        return self.element_failure(array, index)
+
+    def element_failure(self, array, index):
+        if len(index) == 1:
+            index = index[0]
+        return "%s: element %r at index %s" % (self.description, array[index], index)
+
+    def error(self):
+        return getattr(self._failure, "message", self.description)
+
+class array_within(array_predicate):
+    """All elements lie in [low, high]; either bound may be None. NaN is out of bounds."""
+    def __init__(self, low=None, high=None):
+        array_predicate.__init__(self)
+        self.low = low
+        self.high = high
+        self.description = "elements must be within [%s, %s]" % (low, high)
+
+    def mask(self, numpy, array):
+        mask = numpy.ones(array.shape, dtype=bool)
+        # NaN compares False against both bounds, which is what we want
+        with numpy.errstate(invalid="ignore"):
+            if self.low is not None:
+                numpy.logical_and(mask, array >= self.low, out=mask)
+            if self.high is not None:
+                numpy.logical_and(mask, array <= self.high, out=mask)
+        return mask
+
+class array_finite(array_predicate):
+    """All elements are finite (no NaN or infinity)"""
+    description = "elements must be finite"
+
+    def mask(self, numpy, array):
+        return numpy.isfinite(array)
+
+class array_monotonic(array_predicate):
+    """The flattened array is sorted"""
+    def __init__(self, strict=False, decreasing=False):
+        array_predicate.__init__(self)
+        self.strict = strict
+        self.decreasing = decreasing
+        self.description = "elements must be %s%s" % ("strictly " if strict else "", "decreasing" if decreasing else "increasing")
+
+    def check(self, numpy, array):
+        flat = array.ravel()
+        # compare neighbours through views: flat[1:] against flat[:-1]
+        if self.decreasing:
+            compare = numpy.less if self.strict else numpy.less_equal
+        else:
+            compare = numpy.greater if self.strict else numpy.greater_equal
+        mask = compare(flat[1:], flat[:-1])
+        if mask.all():
+            return None
+        index = int(numpy.argmin(mask)) + 1
+        return "%s: element %r at flat index %d follows %r" % (self.description, flat[index], index, flat[index - 1])
+
+class array_shape(array_predicate):
+    """The array has the given shape; None matches any extent"""
+    def __init__(self, *shape):
+        array_predicate.__init__(self)
+        self.shape = shape
+        self.description = "shape must be %s" % (shape,)
+
+    def check(self, numpy, array):
+        if len(array.shape) == len(self.shape) and all(want is None or want == got for want, got in zip(self.shape, array.shape)):
+            return None
+        return "%s, got %s" % (self.description, array.shape)
+
+class array_dtype(array_predicate):
+    """The array's dtype is (a subtype of) the given dtype, e.g. numpy.floating"""
+    def __init__(self, dtype):
+        array_predicate.__init__(self)
+        self.dtype = dtype
+        self.description = "dtype must be %s" % getattr(dtype, "__name__", dtype)
+
+    def check(self, numpy, array):
+        if numpy.issubdtype(array.dtype, self.dtype):
+            return None
+        return "%s, got %s" % (self.description, array.dtype)
+
+class array_all(array_predicate):
+    """Conjunction of array predicates, sharing one asarray view"""
+    def __init__(self, *predicates):
+        array_predicate.__init__(self)
+        self.predicates = predicates
+        self.description = " and ".join(pred.description for pred in predicates)
+
+    def check(self, numpy, array):
+        for pred in self.predicates:
+            message = pred.check(numpy, array)
+            if message is not None:
+                return message
+        return None
+
+class bounds(object):
+    """A field constraint: low <= value <= high, where a bound of None is open.
+
+    values() suggests the boundary values to bet."""
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def __call__(self, value):
+        return (self.low is None or value >= self.low) and (self.high is None or value <= self.high)
+
+    def error(self):
+        if self.high is None:
+            return "at least %s" % (self.low,)
+        if self.low is None:
+            return "at most %s" % (self.high,)
+        return "between %s and %s" % (self.low, self.high)
+
+    def values(self, type_=None):
+        values = []
+        if self.low is not None:
+            values += [self.low, self.low + 1]
+        if self.high is not None:
+            values += [self.high - 1, self.high]
+        if type_ in (int, long, float):
+            values = map(type_, values)
+        return values
+
+class size(object):
+    """A field constraint: low <= len(value) <= high, where a bound of None is open"""
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+        self.length = bounds(low, high)
+
+    def __call__(self, value):
+        return self.length(len(value))
+
+    def error(self):
+        return "of length " + self.length.error()
+
+    def values(self, type_=None):
+        if type_ is not None and not issubclass(type_, basestring):
+            return []
+        return [(type_ or str)("a" * n) for n in self.length.values(int) if n >= 0]
+
+#
+# Invariants over fields which columnar_bet evaluates for a whole
+# finitization at once: vectorized(numpy, columns) returns the mask of
+# candidates satisfying them, where columns maps each name in fields to an
+# array of that field's values. and_, or_ and not_ of these are vectorized too.
+#
+class field_bounds(object):
+    """An invariant: low <= self.<name> <= high, where a bound of None is open"""
+    def __init__(self, name, low=None, high=None):
+        self.name = name
+        self.bounds = bounds(low, high)
+        self.fields = (name,)
+
+    def __call__(self, s):
+        return self.bounds(getattr(s, self.name))
+
+    def error(self):
+        return "%s must be %s" % (self.name, self.bounds.error())
+
+    def vectorized(self, numpy, columns):
+        column = columns[self.name]
+        mask = numpy.ones(len(column), dtype=bool)
+        if self.bounds.low is not None:
+            mask &= numpy.asarray(column >= self.bounds.low, dtype=bool)
+        if self.bounds.high is not None:
+            mask &= numpy.asarray(column <= self.bounds.high, dtype=bool)
+        return mask
+
+class compare(object):
+    """An invariant comparing two fields, or a field and a constant: compare("low", "<=", "high").
+
+    String operands name fields; anything else is a constant."""
+    operators = {"<": operator.lt, "<=": operator.le, "==": operator.eq,
+                 "!=": operator.ne, ">": operator.gt, ">=": operator.ge}
+
+    def __init__(self, left, op, right):
+        self.left = left
+        self.op = op
+        self.compare = self.operators[op]
+        self.right = right
+        self.fields = tuple(operand for operand in (left, right) if isinstance(operand, basestring))
+
+    def operand(self, s, operand):
+        return getattr(s, operand) if isinstance(operand, basestring) else operand
+
+    def __call__(self, s):
+        return self.compare(self.operand(s, self.left), self.operand(s, self.right))
+
+    def error(self):
+        return "%s %s %s" % (self.left, self.op, self.right)
+
+    def vectorized(self, numpy, columns):
+        left = columns[self.left] if isinstance(self.left, basestring) else self.left
+        right = columns[self.right] if isinstance(self.right, basestring) else self.right
+        return numpy.asarray(self.compare(left, right), dtype=bool)
 
 def const(self, old, ret, *args, **kwargs):
-    """Object constness was violated by the method call (did you forget to override __eq__?)"""
+    """Object constness was violated by the method call.
+
+    self is compared by fingerprint; define __dbc_fingerprint__ to choose
+    what it covers. When other postconditions need a deep copy of old self
+    anyway, the copy is compared with ==."""
+    if old.fingerprint is not None:
+        from dbcbet.dbcbet import fingerprint
+        return old.fingerprint == fingerprint(self)
     return old.self == self 
+
+# const only needs a fingerprint of old self, so it never forces a deep copy
+const._old_fingerprint = True
@@ -0,0 +1,163 @@
+"""
+Counters for contract activity
+
+While enabled, every contract check is counted per class, method and
+component (pre, post, inv, throws): how many checks ran, how many raised
+a violation, and how long they took.
+
+    from dbcbet import metrics
+    metrics.enable()
+    ...
+    metrics.snapshot()      # {(class, method, component): counter}
+    metrics.export_text()   # Prometheus text format
+    metrics.serve(9464)     # or metrics.write_text(path)
+
+Each thread counts into its own table, so recording takes no lock; the
+tables are summed when a snapshot is taken. The tables of threads that
+have finished are folded into one retired table, so the number of tables
+stays bounded by the live threads. Disabled metrics cost nothing,
+the invoker then calls the plain check functions.
+"""
+from __future__ import absolute_import
+
+import threading
+
+enabled = False
+_local = threading.local()
+_tables = []    # (thread, table) for every thread that has counted
+_retired = {}   # the counters of threads that have finished
+_tables_lock = threading.Lock()
+
+class counter(object):
+    """Checks run, violations raised and seconds spent for one (class, method, component)"""
+    __slots__ = ("checks", "violations", "seconds")
+    def __init__(self, checks=0, violations=0, seconds=0.0):
+        self.checks = checks
+        self.violations = violations
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "counter(checks=%d, violations=%d, seconds=%f)" % (self.checks, self.violations, self.seconds)
+
+def enable():
+    """Starts counting contract checks"""
+    global enabled
+    from dbcbet.dbcbet import instrument_checks
+    instrument_checks(record)
+    enabled = True
+
+def disable():
+    """Stops counting; the counters collected so far are kept"""
+    global enabled
+    from dbcbet.dbcbet import instrument_checks
+    instrument_checks(None)
+    enabled = False
+
+def _table():
+    try:
+        return _local.table
+    except AttributeError:
+        table = _local.table = {}
+        # only registering a new thread's table takes the lock
+        with _tables_lock:
+            _retire_finished()
+            _tables.append((threading.current_thread(), table))
+        return table
+
+def _add(totals, table):
+    for key, entry in table.items():
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = counter()
+        total.checks += entry.checks
+        total.violations += entry.violations
+        total.seconds += entry.seconds
+
+def _retire_finished():
+    """Folds the tables of finished threads into _retired; needs _tables_lock"""
+    live = []
+    for thread, table in _tables:
+        if thread.is_alive():
+            live.append((thread, table))
+        else:
+            _add(_retired, table)
+    _tables[:] = live
+
+def record(classname, methodname, component, seconds, violated):
+    """Counts one check; called by the metered check functions"""
+    table = _table()
+    key = (classname, methodname, component)
+    entry = table.get(key)
+    if entry is None:
+        entry = table[key] = counter()
+    entry.checks += 1
+    if violated:
+        entry.violations += 1
+    entry.seconds += seconds
+
+def snapshot():
+    """The counters of all threads summed, keyed by (class, method, component)"""
+    totals = {}
+    with _tables_lock:
+        _retire_finished()
+        _add(totals, _retired)
+        tables = [table for thread, table in _tables]
+    for table in tables:
+        _add(totals, table)
+    return totals
+
+def reset():
+    """Forgets all counters"""
+    with _tables_lock:
+        _retired.clear()
+        for thread, table in _tables:
+            table.clear()
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def export_text(counters=None):
+    """The counters in the Prometheus text exposition format"""
+    if counters is None:
+        counters = snapshot()
+    lines = []
+    for name, help_text, field, format_ in [
+            ("dbcbet_contract_checks_total", "Contract checks run.", "checks", "%d"),
+            ("dbcbet_contract_violations_total", "Contract violations raised.", "violations", "%d"),
+            ("dbcbet_contract_check_seconds_total", "Time spent checking contracts.", "seconds", "%.9f")]:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s counter" % name)
+        for (classname, methodname, component), entry in sorted(counters.items()):
+            labels = 'class="%s",method="%s",component="%s"' % (_escape(classname), _escape(methodname), component)
+            lines.append("%s{%s} %s" % (name, labels, format_ % getattr(entry, field)))
+    return "\n".join(lines) + "\n"
+
+def write_text(path):
+    """Writes export_text() to path, atomically, for a file-based collector"""
+    import os
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary, "w") as out:
+        out.write(export_text())
+    os.rename(temporary, path)
+
+def serve(port, address="127.0.0.1"):
+    """Serves export_text() over HTTP from a daemon thread; returns the server"""
+    import BaseHTTPServer
+
+    class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = export_text()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((address, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="dbcbet-metrics")
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,111 @@
+"""Test the dbcbet helpers and runners which use NumPy"""
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from dbcbet.dbcbet import pre, post, inv, finitize, finitize_method, bet, columnar_bet, ContractViolation, PostconditionViolation, fingerprint
+from dbcbet.helpers import returns, args, const, and_, or_, not_, field_bounds, compare, array_all, array_within, array_finite, array_monotonic, array_shape, array_dtype
+
+class ArrayTestClass(object):
+    @pre(args(array_all(array_dtype(numpy.floating), array_within(0.0, 1.0))))
+    @post(returns(array_all(array_shape(None), array_monotonic())))
+    def sort(self, values):
+        return numpy.sort(values)
+
+    @post(returns(array_finite()))
+    def invert(self, values):
+        with numpy.errstate(divide="ignore"):
+            return 1.0 / values
+
+def violation_message(method, *arguments):
+    try:
+        method(*arguments)
+    except ContractViolation as cv:
+        return str(cv)
+    assert False, "no contract violation"
+
+def test_array_helpers():
+    t = ArrayTestClass()
+    assert list(t.sort(numpy.array([0.5, 0.25, 1.0]))) == [0.25, 0.5, 1.0]
+    message = violation_message(t.sort, numpy.array([0.5, 0.25, 2.0, 3.0]))
+    assert "element 2.0 at index 2" in message, message
+    message = violation_message(t.sort, numpy.array([1, 0]))
+    assert "dtype must be floating" in message, message
+    message = violation_message(t.invert, numpy.array([[1.0, 2.0], [0.0, 4.0]]))
+    assert "at index (1, 0)" in message, message
+
+def test_array_predicates():
+    assert array_monotonic(strict=True)(numpy.arange(5))
+    decreasing = array_monotonic(decreasing=True)
+    assert not decreasing([3, 2, 2, 5])
+    assert "flat index 3" in decreasing.error()
+    assert array_shape(2, None)(numpy.zeros((2, 7)))
+    assert not array_shape(2, None)(numpy.zeros(2))
+    assert not array_within(low=0)(numpy.array([0.0, numpy.nan]))
+    assert array_within()(numpy.zeros(0))
+
+class Uncopyable(object):
+    def __init__(self):
+        self.items = [1, 2, {"a": numpy.arange(3)}]
+
+    def __deepcopy__(self, memo):
+        raise AssertionError("const should not deep copy")
+
+    @post(const)
+    def total(self):
+        return sum(self.items[:2])
+
+    @post(const)
+    def grow(self):
+        self.items[2]["a"][0] = 7
+
+def test_const_uses_fingerprint():
+    u = Uncopyable()
+    assert u.total() == 3
+    try:
+        u.grow()
+        assert False, "grow should have violated const"
+    except PostconditionViolation as violation:
+        assert "fingerprint" in str(violation)
+
+def test_array_fingerprint():
+    assert fingerprint(numpy.arange(4)[::2]) != fingerprint(numpy.arange(4)[:2])
+
+def b_plus_c_even(self):
+    return (self.b + self.c) % 2 == 0
+
+@inv(b_plus_c_even)
+@inv(or_(and_(field_bounds("a", 2, 7), compare("a", "<", "b")), not_(compare("c", "!=", 0))))
+@finitize(lambda: {"a": range(10), "b": range(10), "c": range(-2, 3)})
+class Columns(object):
+    @finitize_method([0, 1])
+    def shift(self, d):
+        self.a += d
+
+class quiet(object):
+    def print_invoice(self):
+        pass
+
+class quiet_bet(quiet, bet):
+    pass
+
+class quiet_columnar_bet(quiet, columnar_bet):
+    pass
+
+def test_columnar_bet():
+    plain = quiet_bet(Columns)
+    plain.run()
+    columnar = quiet_columnar_bet(Columns)
+    columnar.run()
+    counts = lambda runner: (runner.candidates, runner.invariant_violations, runner.failures, runner.successes, runner.running_log)
+    assert counts(columnar) == counts(plain)
+    assert plain.invariant_violations > plain.candidates > 0
+    assert len(columnar.per_object_invariant) == 1
+
+if __name__ == "__main__":
+    test_array_helpers()
+    test_array_predicates()
+    test_const_uses_fingerprint()
+    test_array_fingerprint()
+    test_columnar_bet()
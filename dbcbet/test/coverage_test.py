@@ -0,0 +1,58 @@
+"""Test the contract coverage report"""
+
+from dbcbet.dbcbet import pre, post, inv, finitize, finitize_method, set_monitor
+from dbcbet.coverage import coverage_bet, contract_coverage
+
+def below_three(self):
+    return self.a < 3
+
+def positive(self, x):
+    return x > 0
+
+def returns_the_sum(self, old, ret, x):
+    return ret == self.a + x
+
+@inv(below_three)
+@finitize(lambda: {"a": [0, 1, 2, 3]})
+class Covered(object):
+    @pre(positive)
+    @post(returns_the_sum)
+    @finitize_method([-1, 1, 2])
+    def add(self, x):
+        return self.a + x
+
+def outcomes(coverage, component, name, pred):
+    entry = coverage.counters[(component, name, pred)]
+    return (entry.evaluations, entry.true, entry.false)
+
+def test_coverage_bet():
+    runner = coverage_bet(Covered)
+    runner.run()
+    coverage = runner.coverage
+    # bet checks the invariant of 4 candidates, the 6 calls check it again
+    assert outcomes(coverage, "inv", "", below_three) == (10, 9, 1)
+    assert outcomes(coverage, "pre", "add", positive) == (15, 12, 3)
+    assert outcomes(coverage, "post", "add", returns_the_sum) == (6, 6, 0)
+    # 0, 1 and 2 pass the same predicates; so do the arguments 1 and 2
+    assert ("field a", 0, [1, 2]) in coverage.redundant
+    assert ("argument 1 of add", 1, [2]) in coverage.redundant
+    assert len(coverage.redundant) == 2
+    report = coverage.report()
+    assert "post returns_the_sum of add: 6 evaluations, 6 true, 0 false (never failed)" in report
+    assert "field a: 1, 2 behave like 0 and could be dropped" in report
+
+def test_coverage_monitor():
+    coverage = contract_coverage()
+    previous = set_monitor(coverage)
+    try:
+        c = Covered()
+        c.a = 1
+        c.add(2)
+    finally:
+        set_monitor(previous)
+    assert outcomes(coverage, "pre", "add", positive) == (1, 1, 0)
+    assert outcomes(coverage, "inv", "", below_three) == (1, 1, 0)
+
+if __name__ == "__main__":
+    test_coverage_bet()
+    test_coverage_monitor()
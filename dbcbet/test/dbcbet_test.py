@@ -1,7 +1,19 @@
 """Test dbcbet"""
 
 from dbcbet.dbcbet import pre, post, inv, throws, dbc, bet, finitize, finitize_method, ContractViolation, ThrowsViolation
-from dbcbet.helpers import state, argument_types
+from dbcbet.dbcbet import deferred, flush, enable_deferred_postconditions, disable_deferred_postconditions, PostconditionViolation
+from dbcbet.dbcbet import batch, BatchInvariantViolation
+from dbcbet.dbcbet import register_snapshot, unregister_snapshot, snapshot, shallow_snapshot, identity_snapshot
+from dbcbet.dbcbet import get_contract_table
+from dbcbet.dbcbet import log_violations, raise_violations
+from dbcbet.dbcbet import set_monitor, circuit_breaker
+from dbcbet.dbcbet import set_level, assertion_level
+from dbcbet.dbcbet import pure, yields, YieldViolation
+from dbcbet.dbcbet import concurrent_bet
+from dbcbet.dbcbet import field, FieldViolation
+from dbcbet.dbcbet import covering_array
+from dbcbet.dbcbet import sequence_bet
+from dbcbet.helpers import state, argument_types, expensive, bounds, size, const
 
 #
 # These methods are the various preconditions, postconditions, and invariants used by tests
@@ -287,9 +299,751 @@ def test_throws():
         ThrowsTestSubSubClass().do_something(4) 
     except ThrowsViolation:
         print "Translating BadException to ThrowsViolation worked"
-    
+
+class DeferredTestClass(object):
+    @deferred
+    @post(sub_class_method_post)
+    def a_method(self, a):
+        self.x = a+1
+
+def test_deferred_postconditions():
+    try:
+        DeferredTestClass().a_method(5)
+        DeferredTestClass().a_method(6)
+        violations = flush()
+        assert len(violations) == 1, violations
+        assert isinstance(violations[0], PostconditionViolation)
+        assert flush() == []
+    finally:
+        disable_deferred_postconditions()
+
+def test_deferred_postconditions_backpressure():
+    # no workers and room for one check: the second call is checked inline
+    enable_deferred_postconditions(workers=0, maxsize=1)
+    try:
+        DeferredTestClass().a_method(6)
+        explicit_fail(DeferredTestClass, 6)
+        assert len(flush()) == 1
+    finally:
+        disable_deferred_postconditions()
+
+def test_reenabling_keeps_pending_violations():
+    enable_deferred_postconditions(workers=0)
+    try:
+        DeferredTestClass().a_method(6)
+        reported = []
+        enable_deferred_postconditions(workers=0, callback=reported.append)
+        assert len(reported) == 1
+        enable_deferred_postconditions(workers=0)
+        DeferredTestClass().a_method(6)
+        enable_deferred_postconditions(workers=0)
+        assert len(flush()) == 1
+    finally:
+        disable_deferred_postconditions()
+
+def test_deferred_postconditions_global_mode():
+    reported = []
+    enable_deferred_postconditions(callback=reported.append, all_methods=True)
+    try:
+        TestOnlyPost().a_method(8)
+        assert flush() == []
+        assert len(reported) == 1
+    finally:
+        disable_deferred_postconditions()
+
+class DeferredConstClass(object):
+    @deferred
+    @post(const)
+    def a_method(self, a):
+        return a
+
+def test_deferred_postconditions_follow_level():
+    pool = enable_deferred_postconditions(workers=0)
+    try:
+        previous = set_level("pre")
+        try:
+            # postconditions are off: nothing is queued, so self is not copied
+            DeferredTestClass().a_method(6)
+        finally:
+            set_level(previous)
+        # const only compares fingerprints, which are checked inline
+        DeferredConstClass().a_method(1)
+        assert pool.queue.qsize() == 0
+        DeferredTestClass().a_method(6)
+        assert pool.queue.qsize() == 1
+        assert len(flush()) == 1
+    finally:
+        disable_deferred_postconditions()
+
+def test_batch():
+    t = TestOnlyInv()
+    with batch(t):
+        # x == 1 violates the invariant, but only the final state is checked
+        t.a_method(0)
+        t.a_method(5)
+    try:
+        with batch(t):
+            t.a_method(4)
+            t.a_method(1)
+        assert False, "x == 2 should have failed the invariant"
+    except BatchInvariantViolation as violation:
+        assert len(violation.calls) == 2
+        assert "a_method(1)" in str(violation)
+    # checking resumes outside the batch
+    explicit_fail(TestOnlyInv, 0)
+
+def test_batch_keeps_preconditions():
+    t = TestOnlyPre()
+    try:
+        with batch(t):
+            t.a_method(4)
+        assert False, "4 should have failed the precondition"
+    except BatchInvariantViolation:
+        assert False, "TestOnlyPre has no invariant"
+    except ContractViolation:
+        pass
+
+class Counter(object):
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.count = 0
+        self.history = [bytearray("ab")]
+
+def lock_was_not_copied(self, old, ret):
+    return old.self.lock is self.lock and old.self.history[0] == bytearray("ab")
+
+def count_incremented(self, old, ret):
+    return self.count == old.self.count + 1
+
+class LockingCounter(Counter):
+    @post(lock_was_not_copied)
+    @post(count_incremented)
+    def increment(self):
+        with self.lock:
+            self.count += 1
+            self.history[0][0] = "z"
+
+def test_snapshot_strategies():
+    # deepcopy cannot copy a lock; the lock is kept by identity instead
+    LockingCounter().increment()
+
+class Summary(object):
+    copies = 0
+    def __init__(self, value):
+        self.value = value
+
+    def __dbc_old__(self):
+        Summary.copies += 1
+        return Summary(self.value)
+
+def test_snapshot_registry():
+    summary = Summary([1])
+    # snapshotting a Summary makes snapshot look for Summaries inside other values too
+    assert snapshot(summary) is not summary
+    assert Summary.copies == 1
+    copied = snapshot({"a": summary, "b": [summary]})
+    assert copied["a"] is copied["b"][0] and copied["a"] is not summary
+    assert Summary.copies == 2
+    register_snapshot(Counter, shallow_snapshot)
+    try:
+        counter = Counter()
+        assert snapshot(counter).history is counter.history
+    finally:
+        unregister_snapshot(Counter)
+
+class OldStyleSummary:
+    copies = 0
+    def __dbc_old__(self):
+        OldStyleSummary.copies += 1
+        return OldStyleSummary()
+
+class OldStyleHandle:
+    pass
+
+def test_old_style_snapshots():
+    assert isinstance(snapshot(OldStyleSummary()), OldStyleSummary)
+    assert OldStyleSummary.copies == 1
+    register_snapshot(OldStyleHandle, identity_snapshot)
+    try:
+        handle = OldStyleHandle()
+        assert snapshot(handle) is handle
+        assert snapshot([handle])[0] is handle
+    finally:
+        unregister_snapshot(OldStyleHandle)
+
+@inv(base_class_inv)
+class DiamondTop(object):
+    @pre(base_class_method_pre)
+    @post(base_class_method_post)
+    def a_method(self, a):
+        self.x = a
+
+@dbc
+class DiamondLeft(DiamondTop):
+    pass
+
+@inv(sub_class_inv)
+class DiamondRight(DiamondTop):
+    @post(sub_class_method_post)
+    def a_method(self, a):
+        self.x = a
+
+@dbc
+class DiamondBottom(DiamondLeft, DiamondRight):
+    @pre(sub_class_method_pre)
+    def a_method(self, a):
+        self.x = a+1
+
+def test_diamond_inheritance():
+    # MRO order: DiamondRight's invariant, then DiamondTop's, each once
+    assert DiamondBottom._invariant == [sub_class_inv, base_class_inv]
+    contract = get_contract_table(DiamondBottom).methods["a_method"]
+    assert contract.postcondition == [sub_class_method_post, base_class_method_post]
+    # DiamondRight overrides without a precondition, contributing an empty (true) conjunct
+    assert contract.precondition == [[sub_class_method_pre], [], [base_class_method_pre]]
+    # inheriting did not touch the base's method
+    assert DiamondTop.a_method._postcondition == [base_class_method_post]
+    explicit_fail(DiamondBottom, 0)
+    explicit_fail(DiamondBottom, 5)
+    explicit_fail(DiamondBottom, 6)
+    explicit_success(DiamondBottom, 4)
+
+def test_decorated_base_wins_dispatch():
+    @dbc
+    class Contracted(object):
+        @pre(base_class_method_pre)
+        def a_method(self, a):
+            self.x = a
+
+    class Plain(object):
+        def a_method(self, a):
+            self.x = -a
+
+    @dbc
+    class Mixed(Contracted, Plain):
+        pass
+
+    # Python calls Contracted.a_method, with its contract, not Plain's
+    m = Mixed()
+    m.a_method(2)
+    assert m.x == 2
+    explicit_fail(Mixed, 3)
+
+def test_late_invariant_rebuilds_subclasses():
+    @dbc
+    class Base(object):
+        def a_method(self, a):
+            self.x = a
+
+    @dbc
+    class Derived(Base):
+        pass
+
+    explicit_success(Derived, 1)
+    inv(base_class_inv)(Base)
+    assert Derived._invariant == [base_class_inv]
+    explicit_fail(Derived, 1)
+
+def test_late_invariant_rebuilds_through_undecorated_classes():
+    @dbc
+    class Base(object):
+        def a_method(self, a):
+            self.x = a
+
+    class Middle(Base):
+        pass
+
+    @dbc
+    class Derived(Middle):
+        pass
+
+    explicit_success(Derived, 1)
+    inv(base_class_inv)(Base)
+    assert Derived._invariant == [base_class_inv]
+    explicit_fail(Derived, 1)
+
+class ListHandler(object):
+    """A logger stand-in which keeps the messages"""
+    def __init__(self):
+        self.messages = []
+
+    def warning(self, message, *args):
+        self.messages.append(message % args)
+
+def test_log_violations():
+    logger = ListHandler()
+    log = log_violations(size=3, logger=logger, rate=2, interval=3600, repr_limit=20)
+    try:
+        t = TestOnlyPre()
+        # the method runs despite the precondition violation
+        t.a_method(4)
+        assert t.x == 5
+        TestOnlyInv().a_method(0)
+        TestOnlyInv().a_method(1)
+        TestOnlyInv().a_method(0)
+        records = log.violations()
+        assert len(records) == 3 and log.total == 4
+        assert [r.kind for r in records] == ["InvariantViolation"] * 3
+        assert [r.arguments for r in records] == ["0", "1", "0"]
+        # the log doesn't keep instances alive
+        assert records[0].instance() is None
+        assert len(log.shorten("x" * 1000)) <= 20
+        assert len(logger.messages) == 2
+    finally:
+        raise_violations()
+    explicit_fail(TestOnlyPre, 4)
+
+def slow_positive(self, a):
+    import time
+    slow_positive.evaluations += 1
+    time.sleep(0.01)
+    return a > 0
+
+def cheap_positive(self, a):
+    return a > 0
+
+class TestBreaker(object):
+    @pre(slow_positive)
+    @pre(cheap_positive)
+    def a_method(self, a):
+        self.x = a
+
+def test_circuit_breaker():
+    events = []
+    breaker = circuit_breaker(per_call=0.005, sample_rate=3, cooldown=3600, on_event=events.append)
+    slow_positive.evaluations = 0
+    set_monitor(breaker)
+    try:
+        t = TestBreaker()
+        for i in xrange(10):
+            t.a_method(1)
+        # checked on the first call, sampled on the fourth, then off
+        assert slow_positive.evaluations == 2
+        assert [(e.predicate, e.state) for e in events] == [(slow_positive, "sampled"), (slow_positive, "off")]
+        assert breaker.costs[cheap_positive].state == "on"
+        assert breaker.costs[slow_positive].skipped == 8
+        # cheap predicates are still checked
+        explicit_fail(TestBreaker, 0)
+        # after the cool-down it is checked again, and is still too slow
+        breaker.cooldown = 0
+        t.a_method(1)
+        assert [e.state for e in events[2:]] == ["on", "sampled"]
+    finally:
+        set_monitor(None)
+    explicit_fail(TestBreaker, 0)
+
+def not_seven(self, a):
+    return a != 7
+
+@expensive
+def x_is_not_three(self):
+    return getattr(self, "x", 0) != 3
+
+def returns_nothing(self, old, ret, a):
+    return a != 9
+
+@inv(x_is_not_three)
+class TestLevels(object):
+    @pre(sub_class_method_pre)
+    @pre(not_seven, cost="expensive")
+    @post(returns_nothing)
+    def a_method(self, a):
+        self.x = a
+
+def test_assertion_levels():
+    for bad in (3, 4, 7, 9):
+        explicit_fail(TestLevels, bad)
+    try:
+        set_level("all")
+        # expensive predicates are skipped, cheap ones still checked
+        explicit_success(TestLevels, 7)
+        explicit_success(TestLevels, 3)
+        explicit_fail(TestLevels, 4)
+        explicit_fail(TestLevels, 9)
+        with assertion_level("expensive"):
+            explicit_fail(TestLevels, 7)
+        explicit_success(TestLevels, 7)
+        set_level("pre")
+        explicit_success(TestLevels, 9)
+        explicit_fail(TestLevels, 4)
+        set_level("none")
+        explicit_success(TestLevels, 4)
+    finally:
+        set_level("expensive")
+    explicit_fail(TestLevels, 7)
+
+def scaled_post(self, old, ret, factor):
+    scaled_post.checks += 1
+    return ret == self.x * factor
+
+@dbc
+class Scaler(object):
+    def __init__(self):
+        self.x = 2
+        self.calls = 0
+
+    @pure(maxsize=4)
+    @post(scaled_post)
+    def scaled(self, factor):
+        self.__dict__["calls"] += 1
+        return self.x * factor
+
+@dbc
+class ScalerOverride(Scaler):
+    def scaled(self, factor):
+        self.__dict__["calls"] += 1
+        return factor * self.x
+
+def test_pure():
+    scaled_post.checks = 0
+    t = Scaler()
+    assert t.scaled(3) == 6 and t.scaled(3) == 6
+    assert t.calls == 1 and scaled_post.checks == 1
+    # writing an attribute empties the cache
+    t.x = 5
+    assert t.scaled(3) == 15 and t.calls == 2
+    # the least recently used results are evicted
+    for factor in xrange(10):
+        t.scaled(factor)
+    calls = t.calls
+    t.scaled(9)
+    assert t.calls == calls
+    t.scaled(0)
+    assert t.calls == calls + 1
+    # unhashable arguments are not cached
+    assert t.scaled([1]) == [1] * 5 and t.scaled([1]) == [1] * 5
+    assert t.calls == calls + 3
+    o = ScalerOverride()
+    o.scaled(2)
+    o.scaled(2)
+    assert o.calls == 1
+
+def below_limit(self, item, limit):
+    return item < limit
+
+def yielded_limit_items(self, old, ret, limit):
+    return ret == limit
+
+def no_three_items_counted(self):
+    return self.counted != 3
+
+@inv(no_three_items_counted)
+class Counting(object):
+    def __init__(self):
+        self.counted = 0
+
+    @pre(lambda self, limit: limit >= 0)
+    @yields(below_limit)
+    @post(yielded_limit_items)
+    def count_to(self, limit):
+        self.counted = 0
+        for i in xrange(limit):
+            self.counted += 1
+            # 7 is out of bounds when it is yielded at all
+            yield 7 if i == 5 else i
+
+def test_generator_contracts():
+    c = Counting()
+    assert list(c.count_to(2)) == [0, 1]
+    # preconditions are checked on the call, before any item
+    try:
+        c.count_to(-1)
+        assert False, "-1 should have failed the precondition"
+    except ContractViolation:
+        pass
+    # items are checked as they are consumed
+    items = c.count_to(6)
+    assert [next(items) for i in xrange(5)] == [0, 1, 2, 3, 4]
+    try:
+        next(items)
+        assert False, "7 should have failed the yields predicate"
+    except YieldViolation as violation:
+        assert violation.index == 5 and violation.item == 7
+    # an abandoned generator is not checked on exhaustion
+    items = c.count_to(4)
+    next(items)
+    items.close()
+    # the invariant is checked on exhaustion
+    try:
+        list(c.count_to(3))
+        assert False, "counted == 3 should have failed the invariant"
+    except ContractViolation:
+        pass
+
+def invoice(runner):
+    import re
+    # the log shows the addresses of the old copies, which differ between runs
+    log = [re.sub(" at 0x[0-9a-f]+", "", line) for line in runner.running_log]
+    return (runner.candidates, runner.invariant_violations, runner.method_call_candidates,
+            runner.precondition_violations, runner.failures, runner.successes, log)
+
+def test_concurrent_bet():
+    for clazz in (ExampleClass, TestSubClass):
+        sequential = bet(clazz)
+        sequential.run()
+        concurrent = concurrent_bet(clazz, concurrency=3)
+        concurrent.run()
+        assert invoice(concurrent) == invoice(sequential)
+
+def owner_is_not_broke(self):
+    return self.owner is None or self.balance > 0
+
+@inv(owner_is_not_broke)
+class Account(object):
+    balance = field(int, bounds(0, 100))
+    owner = field(str, size(1, 3), nullable=True)
+
+    def __init__(self):
+        self.balance = 1
+        self.owner = None
+
+    @finitize_method([-2, 1, 200])
+    def deposit(self, amount):
+        self.balance += amount
+
+def test_fields():
+    a = Account()
+    a.owner = "bob"
+    for name, value in [("balance", -1), ("balance", 101), ("balance", "1"), ("owner", ""), ("owner", "long")]:
+        try:
+            setattr(a, name, value)
+            assert False, "%s = %r should have failed" % (name, value)
+        except FieldViolation as violation:
+            assert violation.name == name
+    assert a.balance == 1 and a.owner == "bob"
+    try:
+        a.deposit(-2)
+        assert False, "a negative balance should have failed"
+    except FieldViolation:
+        pass
+    assert Account.balance.finitization() == [0, 1, 99, 100]
+    assert Account.owner.finitization() == [None, "a", "aa", "aaa"]
+    runner = bet(Account)
+    runner.run()
+    # owners with a zero balance break the invariant
+    assert runner.invariant_violations == 3
+    assert runner.candidates == 13
+
+@dbc
+@finitize(lambda: {"count": [0, 1, 2]})
+class Tally(object):
+    @finitize_method([1, 2, 3])
+    def check(self, n):
+        if n > self.count:
+            raise ValueError()
+        return n
+
+    @finitize_method([1, 2, 3])
+    def plus(self, n):
+        return self.count + n
+
+    @finitize_method([0])
+    def reset(self, n):
+        self.count = n
+
+class CappedTally(object):
+    def check(self, n):
+        if n > self.count:
+            raise OverflowError()
+        return n
+
+    def plus(self, n):
+        return min(self.count + n, 4)
+
+    def reset(self, n):
+        self.count = None
+
+def test_differential_bet():
+    runner = bet.differential(Tally, CappedTally)
+    runner.run()
+    assert runner.candidates == 3
+    assert runner.method_call_candidates == 21
+    # six checks raise different exceptions, 2 + 3 is capped, and every reset differs
+    assert runner.differences == 10
+    assert runner.successes == 11
+    assert "calling plus with arguments 3: returned 5 and 4" in runner.running_log[-2]
+    same = bet.differential(Tally, Tally)
+    same.run()
+    assert same.differences == 0 and same.successes == 15
+
+def covers(rows, sizes, strength):
+    import itertools
+    for columns in itertools.combinations(range(len(sizes)), strength):
+        combinations = set(tuple(row[c] for c in columns) for row in rows)
+        if len(combinations) != reduce(lambda x, y: x * y, [sizes[c] for c in columns]):
+            return False
+    return True
+
+@dbc
+@finitize(lambda: dict((name, [0, 1, 2]) for name in "abcd"))
+class Grid(object):
+    @finitize_method([0, 1, 2], [0, 1, 2], [0, 1, 2], [0, 1, 2], [0, 1, 2], strength=2)
+    def pairwise(self, v, w, x, y, z):
+        return v + w + x + y + z
+
+    @finitize_method([0, 1], [0, 1])
+    def exhaustive(self, x, y):
+        return x + y
+
+def test_covering_arrays():
+    for sizes, strength in [([10] * 6, 2), ([3, 4, 2, 5], 3), ([2] * 8, 3), ([3] * 3, 1)]:
+        rows = list(covering_array(sizes, strength))
+        assert covers(rows, sizes, strength)
+        assert len(rows) < reduce(lambda x, y: x * y, sizes)
+    # six arguments of ten values each: pairs are covered by well under 1% of the product
+    assert len(covering_array([10] * 6, 2)) < 200
+    # the rows are built once per shape, and each array iterates them on its own
+    first, second = covering_array([10] * 6, 2), covering_array([10] * 6, 2)
+    assert first.rows is second.rows
+    assert first.next() == second.next()
+
+    runner = bet(Grid)
+    runner.with_strength(2)
+    runner.run()
+    assert runner.strengths == set([2])
+    assert 9 <= runner.candidates < 81
+    assert runner.method_call_candidates < runner.candidates * (3 ** 5 + 4)
+    full = bet(Grid)
+    full.run()
+    assert full.candidates == 81
+    # the method's own strength applies in a full run as well
+    assert full.strengths == set([None, 2])
+    assert full.method_call_candidates == 81 * (len(covering_array([3] * 5, 2)) + 4)
+
+def below_three(self):
+    return self.value < 3
+
+@inv(below_three)
+@finitize(lambda: {"value": [0, 1]})
+class Ratchet(object):
+    def __init__(self):
+        self.value = 0
+
+    @finitize_method([1])
+    def inc(self, n):
+        self.value += n
+
+    @finitize_method([0])
+    def reset(self, n):
+        self.value = n
+
+def test_sequence_bet():
+    single = sequence_bet(Ratchet, depth=1)
+    single.run()
+    assert single.failures == 0 and single.method_call_candidates == 4
+    # only inc, inc from 1 reaches 3
+    double = sequence_bet(Ratchet, depth=2)
+    double.run()
+    assert double.failures == 1
+    assert "failed after inc(1) when calling inc" in double.running_log[0]
+    triple = sequence_bet(Ratchet, depth=3)
+    triple.run()
+    assert triple.failures == 2
+    # 0, 1 and 2 are the only states; without pruning 2 * (2 + 4 + 8) calls are made
+    assert len(triple.visited) == 3
+    assert triple.method_call_candidates == 10
+
+@inv(below_three)
+@finitize(lambda: {"value": [0, 1]})
+class OldStyleRatchet:
+    def __init__(self):
+        self.value = 0
+
+    @finitize_method([1])
+    def inc(self, n):
+        self.value += n
+
+    @finitize_method([0])
+    def reset(self, n):
+        self.value = n
+
+def test_sequence_bet_old_style():
+    # old-style instances are told apart by fingerprint as well, so states are pruned
+    triple = sequence_bet(OldStyleRatchet, depth=3)
+    triple.run()
+    assert triple.failures == 2
+    assert len(triple.visited) == 3
+    assert triple.method_call_candidates == 10
+
+def never_negative(self, old, ret, n):
+    return ret >= 0
+
+def anything(self):
+    return True
+
+@inv(anything)
+@finitize(lambda: {"value": range(10)})
+class Faulty(object):
+    @throws(KeyError)
+    @finitize_method([1])
+    def lookup(self, n):
+        raise ValueError()
+
+    @post(never_negative)
+    @finitize_method([1, 2])
+    def minus(self, n):
+        return self.value - n
+
+def quiet_run(runner):
+    import sys
+    import StringIO
+    stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        runner.run()
+    finally:
+        sys.stdout = stdout
+    return runner
+
+def failure_lines(runner):
+    return [line for line in runner.running_log if " failed " in line]
+
+def test_failure_policies():
+    runner = quiet_run(bet(Faulty))
+    assert runner.failures == 13
+    assert [(group.count, len(group.examples)) for group in map(runner.failure_groups.get, runner.failure_order)] == [(10, 3), (3, 3)]
+    assert str(runner.failure_groups[runner.failure_order[0]]) == "10 x ThrowsViolation in lookup: ValueError"
+    assert len(failure_lines(runner)) == 6
+
+    runner = bet(Faulty)
+    runner.with_failure_policy(examples=None, distinct_per_method=1)
+    quiet_run(runner)
+    assert runner.failures == 2 and len(failure_lines(runner)) == 2
+    assert runner.stopped_methods == set(["lookup", "minus"])
+
+    runner = bet(Faulty)
+    runner.with_failure_policy(stop_at_first=True)
+    quiet_run(runner)
+    assert runner.failures == 1 and runner.candidates == 1 and runner.stopped
+
+    sequential = quiet_run(bet(Faulty))
+    concurrent = quiet_run(concurrent_bet(Faulty, concurrency=3))
+    assert invoice(concurrent) == invoice(sequential)
+    assert [concurrent.failure_groups[signature].count for signature in concurrent.failure_order] == [10, 3]
+
 if __name__ == "__main__":
     test_inheritance()
     test_throws()
     test_bet()
     test_solo_composition()
+    test_deferred_postconditions()
+    test_deferred_postconditions_follow_level()
+    test_reenabling_keeps_pending_violations()
+    test_batch()
+    test_snapshot_strategies()
+    test_snapshot_registry()
+    test_old_style_snapshots()
+    test_diamond_inheritance()
+    test_decorated_base_wins_dispatch()
+    test_log_violations()
+    test_circuit_breaker()
+    test_assertion_levels()
+    test_pure()
+    test_generator_contracts()
+    test_concurrent_bet()
+    test_fields()
+    test_differential_bet()
+    test_covering_arrays()
+    test_sequence_bet()
+    test_sequence_bet_old_style()
+    test_failure_policies()
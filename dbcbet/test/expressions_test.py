@@ -0,0 +1,148 @@
+"""Test the compiled predicate expressions"""
+
+import weakref
+
+from dbcbet.dbcbet import pre, post, inv, yields, ContractViolation, set_level
+from dbcbet.expressions import P, conjunction, disjunction, forwarded, compile_expression
+from dbcbet.helpers import and_, or_, not_, args, state, returns, expensive
+
+def violation_message(method, *arguments):
+    try:
+        method(*arguments)
+    except ContractViolation as cv:
+        return str(cv)
+    assert False, "no contract violation"
+
+@inv(P.self.total >= 0)
+class Wallet(object):
+    def __init__(self):
+        self.total = 0
+        self.history = []
+
+    @pre((P.arg(0) > 0) & P.self.history.is_not(None))
+    @post(P.ret == P.old.self.total + P.arg(0))
+    def deposit(self, amount):
+        self.total += amount
+        self.history.append(amount)
+        return self.total
+
+    @post(P.ret == P.arg(0))
+    def withdraw(self, amount):
+        self.total -= amount
+        return amount
+
+    @yields(P.item.in_(P.self.history))
+    def items(self, extra):
+        for amount in self.history:
+            yield amount
+        yield extra
+
+def test_expression_contracts():
+    w = Wallet()
+    assert w.deposit(5) == 5
+    assert "arg(0) > 0 (arg(0) is -1)" in violation_message(w.deposit, -1)
+    w.history = None
+    assert "self.history is not None (self.history is None)" in violation_message(w.deposit, 1)
+    w.history = [5]
+    assert "self.total >= 0 (self.total is -2)" in violation_message(w.withdraw, 7)
+    w.total = 5
+    assert list(w.items(5)) == [5, 5]
+    # a generator's items are checked as they are consumed
+    assert "item in self.history" in violation_message(lambda extra: list(w.items(extra)), 3)
+
+def test_expressions_called_directly():
+    positive_first = P.arg(0) > 0
+    assert positive_first(None, 1)
+    assert not positive_first(None, -1)
+    # post predicates are laid out as (self, old, ret, *args)
+    assert (P.ret == P.arg(0) * 2)(None, None, 4, 2)
+    try:
+        bool(P.arg(0) > 0)
+        assert False, "an expression should have no truth value"
+    except TypeError:
+        pass
+    try:
+        0 < P.arg(0) < 10
+        assert False, "a chained comparison should fail"
+    except TypeError:
+        pass
+
+def positive(value):
+    return value > 0
+
+def even(value):
+    """the value must be even"""
+    return value % 2 == 0
+
+def test_helpers_compile():
+    combined = or_(not_(state(positive)), and_(args(even), args(positive)))
+    expr = combined._expression
+    assert isinstance(expr, disjunction)
+    # the nested and_ is flattened, and no helper is left as a call
+    assert isinstance(expr._operands[1], conjunction)
+    assert not any(isinstance(node, forwarded) and node._predicate not in (positive, even)
+                   for node in walk(expr))
+    assert combined(-1, 3) and combined(1, 2)
+    assert not combined(1, 3)
+    assert combined.error() == "none of: not (positive); argument 0: the value must be even"
+    assert returns(even)(None, None, 2) and not returns(even)(None, None, 3)
+    assert returns(even).__name__ == "even"
+    checked = args(positive, even)
+    assert checked(None, 1)
+    assert not checked(None, 1, 3)
+    assert checked.error() == "argument 1: the value must be even"
+
+class Box(object):
+    def __init__(self, size):
+        self.size = size
+
+def test_errors_use_captured_values():
+    calls = []
+    def counted(value):
+        calls.append(value)
+        return value > 0
+    checked = and_(args(counted), args(even))
+    assert not checked(None, -1, 2)
+    assert checked.error() == "argument 0: counted"
+    # error() explains the failure from what the call computed, without calling counted again
+    assert calls == [-1]
+    fits = compile_expression((P.arg(0).size < 10) & (P.arg(0).size > 0), "pre")
+    box = Box(12)
+    assert not fits(None, box)
+    reference = weakref.ref(box)
+    del box
+    # only the compared values are kept, not the arguments of the failing call,
+    # even while error() is never asked for
+    assert reference() is None
+    assert fits.error() == "arg(0).size < 10 (arg(0).size is 12)"
+    assert fits.error() == "arg(0).size < 10 (arg(0).size is 12)"
+
+class Meter(object):
+    @pre(expensive(P.arg(0) > 0))
+    @post(expensive(P.ret == P.arg(0)))
+    def read(self, value):
+        return value + 1
+
+def test_expensive_expressions():
+    m = Meter()
+    set_level("all")
+    try:
+        # both expressions fail, but they are tagged expensive
+        assert m.read(-1) == 0
+    finally:
+        set_level("expensive")
+    assert "arg(0) > 0 (arg(0) is -1)" in violation_message(m.read, -1)
+    assert "ret == arg(0)" in violation_message(m.read, 1)
+
+def walk(node):
+    yield node
+    for child in node._children():
+        for descendant in walk(child):
+            yield descendant
+
+if __name__ == "__main__":
+    test_expression_contracts()
+    test_expressions_called_directly()
+    test_helpers_compile()
+    test_errors_use_captured_values()
+    test_expensive_expressions()
@@ -0,0 +1,82 @@
+"""Test the dbcbet helpers"""
+
+from dbcbet.dbcbet import pre, ContractViolation, fingerprint
+from dbcbet.helpers import argument_types, typed
+
+def violation_message(method, *arguments):
+    try:
+        method(*arguments)
+    except ContractViolation as cv:
+        return str(cv)
+    assert False, "no contract violation"
+
+def test_fingerprint():
+    a = {"x": [1, 2.5, "s"], "y": set([1, 2])}
+    b = {"y": set([2, 1]), "x": [1, 2.5, "s"]}
+    assert fingerprint(a) == fingerprint(b)
+    b["x"].append(None)
+    assert fingerprint(a) != fingerprint(b)
+    cycle = []
+    cycle.append(cycle)
+    assert fingerprint(cycle) == fingerprint(cycle)
+
+class Slotted(object):
+    __slots__ = ("x",)
+
+class MoreSlotted(Slotted):
+    __slots__ = "y"
+
+def test_fingerprint_inherited_slots():
+    a, b = MoreSlotted(), MoreSlotted()
+    a.x = b.x = 1
+    a.y = b.y = 2
+    assert fingerprint(a) == fingerprint(b)
+    b.x = 3
+    assert fingerprint(a) != fingerprint(b)
+
+class Node(object):
+    @pre(argument_types("Node", (int, long)))
+    def link(self, other, weight):
+        return weight
+
+    @typed(other="Node", returns="collections.OrderedDict")
+    def describe(self, other=None, broken=False):
+        import collections
+        return {} if broken else collections.OrderedDict()
+
+    def sized(self, items):
+        return len(items)
+    sized.__annotations__ = {"items": list, "return": int}
+    sized = typed()(sized)
+
+def test_type_contracts():
+    n = Node()
+    assert n.link(Node(), 3) == 3
+    assert n.link(None, 3L) == 3
+    assert "argument 1 was not of type int or long" in violation_message(n.link, n, "1")
+    assert "was not of type Node" in violation_message(n.link, 1, 1)
+    assert n.describe(n) is not None
+    assert "was not of type Node" in violation_message(lambda: n.describe(other=1))
+    assert "return value {} was not of type OrderedDict" in violation_message(n.describe, n, True)
+    assert n.sized([1]) == 1
+    assert "was not of type list" in violation_message(n.sized, (1,))
+
+def test_type_contract_messages_per_thread():
+    import threading
+    check = argument_types(int)
+    messages = {}
+    def fail(value):
+        check(None, value)
+        messages[value] = check.error()
+    threads = [threading.Thread(target=fail, args=(value,)) for value in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert messages == {"a": "argument a was not of type int", "b": "argument b was not of type int"}
+
+if __name__ == "__main__":
+    test_fingerprint()
+    test_fingerprint_inherited_slots()
+    test_type_contracts()
+    test_type_contract_messages_per_thread()
@@ -0,0 +1,112 @@
+"""Test the contract metrics"""
+
+import threading
+
+from dbcbet import metrics
+from dbcbet.dbcbet import pre, post, inv, throws, PreconditionViolation, log_violations, raise_violations
+
+def positive(self, a):
+    return a > 0
+
+def returns_a(self, old, ret, a):
+    return ret == a
+
+def always(self):
+    return True
+
+@inv(always)
+class Counted(object):
+    @pre(positive)
+    @post(returns_a)
+    @throws(ValueError)
+    def method(self, a):
+        if a == 13:
+            raise ValueError()
+        return a
+
+    def unchecked(self, a):
+        return a
+
+def counts(counters, component):
+    entry = counters.get(("Counted", "method", component))
+    return entry and (entry.checks, entry.violations)
+
+def test_metrics():
+    metrics.reset()
+    metrics.enable()
+    try:
+        c = Counted()
+        c.method(1)
+        c.method(2)
+        try:
+            c.method(-1)
+        except PreconditionViolation:
+            pass
+        try:
+            c.method(13)
+        except ValueError:
+            pass
+        c.unchecked(1)
+        counters = metrics.snapshot()
+    finally:
+        metrics.disable()
+    assert counts(counters, "pre") == (4, 1)
+    assert counts(counters, "post") == (2, 0)
+    assert counts(counters, "inv") == (2, 0)
+    assert counts(counters, "throws") == (1, 0)
+    assert ("Counted", "unchecked", "pre") not in counters
+    assert counters[("Counted", "unchecked", "inv")].checks == 1
+
+    text = metrics.export_text(counters)
+    assert "# TYPE dbcbet_contract_checks_total counter" in text
+    assert 'dbcbet_contract_violations_total{class="Counted",method="method",component="pre"} 1' in text
+
+    # disabled metrics stop counting
+    Counted().method(1)
+    assert metrics.snapshot()[("Counted", "method", "pre")].checks == 4
+
+def test_metrics_threads():
+    metrics.reset()
+    metrics.enable()
+    try:
+        c = Counted()
+        def work():
+            for i in xrange(100):
+                c.method(1)
+        threads = [threading.Thread(target=work) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counts(metrics.snapshot(), "pre") == (400, 0)
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+def test_finished_threads_are_retired():
+    metrics.reset()
+    metrics.enable()
+    try:
+        c = Counted()
+        for i in xrange(3):
+            thread = threading.Thread(target=c.method, args=(1,))
+            thread.start()
+            thread.join()
+        assert counts(metrics.snapshot(), "pre") == (3, 0)
+        assert all(thread.is_alive() for thread, table in metrics._tables)
+        assert counts(metrics._retired, "pre") == (3, 0)
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+def test_logged_violations_are_counted():
+    metrics.reset()
+    metrics.enable()
+    log_violations()
+    try:
+        Counted().method(-1)
+        assert counts(metrics.snapshot(), "pre") == (1, 1)
+    finally:
+        raise_violations()
+        metrics.disable()
+        metrics.reset()
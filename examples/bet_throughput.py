@@ -0,0 +1,132 @@
+"""Measures how fast bet processes candidates.
+
+A synthetic finitized class is generated for each configuration: a number
+of fields with a domain of values each, a number of methods of a given
+arity, and an invariant and a precondition which reject a chosen fraction
+of the candidates and argument tuples. bet runs over it and the harness
+reports candidates per second, method calls per second, the peak resident
+memory of the run, and how the time splits between instantiating
+candidates, checking invariants, copying candidates for preconditions, and
+calling methods (contract checks included).
+
+Each configuration runs in its own process, so peak memory is per run.
+--sweep varies one parameter to produce a scaling curve, e.g.
+
+    python -m examples.bet_throughput --sweep domain=2,4,8,16
+"""
+
+import time
+
+from dbcbet.dbcbet import bet, inv, pre, post, finitize, finitize_method
+
+DEFAULTS = {"fields": 3, "domain": 6, "methods": 2, "arity": 2, "arg_domain": 4,
+            "inv_reject": 0.5, "pre_reject": 0.25}
+
+def rejects(values, rate):
+    """Deterministically rejects about rate of all value tuples"""
+    return (hash(tuple(values)) * 2654435761) % 1000 < rate * 1000
+
+def synthetic_class(fields, domain, methods, arity, arg_domain, inv_reject, pre_reject):
+    names = ["f%d" % i for i in xrange(fields)]
+
+    def invariant(self):
+        # a freshly constructed instance has no fields until bet assigns them
+        if not hasattr(self, names[0]):
+            return True
+        return not rejects([getattr(self, name) for name in names], inv_reject)
+
+    def precondition(self, *args):
+        return not rejects(args, pre_reject)
+
+    def postcondition(self, old, ret, *args):
+        return ret == sum(args)
+
+    body = {}
+    for m in xrange(methods):
+        def method(self, *args):
+            return sum(args)
+        method.__name__ = "method_%d" % m
+        body[method.__name__] = finitize_method(*[range(arg_domain)] * arity)(pre(precondition)(post(postcondition)(method)))
+    clazz = type("Synthetic", (object,), body)
+    clazz = finitize(lambda: dict((name, range(domain)) for name in names))(clazz)
+    return inv(invariant)(clazz)
+
+class timed_bet(bet):
+    """bet which keeps the time spent in each phase instead of printing an invoice"""
+    def __init__(self, clazz):
+        bet.__init__(self, clazz)
+        self.timings = {"instantiation": 0.0, "invariant": 0.0, "precondition copies": 0.0, "method calls": 0.0}
+
+    def timed(self, phase, function, *args):
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.timings[phase] += time.time() - start
+
+    def instantiate_with(self, clazz, fieldset):
+        return self.timed("instantiation", bet.instantiate_with, self, clazz, fieldset)
+
+    def satisfies_invariant(self, candidate):
+        return self.timed("invariant", bet.satisfies_invariant, self, candidate)
+
+    def copy_candidate(self, candidate):
+        return self.timed("precondition copies", bet.copy_candidate, self, candidate)
+
+    def call_with_args(self, candidate, fs, val, args):
+        return self.timed("method calls", bet.call_with_args, self, candidate, fs, val, args)
+
+    def print_invoice(self):
+        pass
+
+def measure(config):
+    import resource
+    runner = timed_bet(synthetic_class(**config))
+    start = time.time()
+    runner.run()
+    elapsed = time.time() - start
+    calls = runner.successes + runner.failures
+    return {"elapsed": elapsed,
+            "enumerated": runner.candidates + runner.invariant_violations,
+            "candidates/s": (runner.candidates + runner.invariant_violations) / elapsed,
+            "calls/s": calls / elapsed,
+            "peak KB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "timings": runner.timings}
+
+def measure_in_child(config):
+    """Runs measure in a fresh process, so that ru_maxrss is the peak of this run alone"""
+    import multiprocessing
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(measure, (config,))
+    finally:
+        pool.close()
+        pool.join()
+
+def print_header():
+    print "%-40s %10s %12s %12s %10s   %s" % ("configuration", "seconds", "candidates/s", "calls/s", "peak KB", "time split (%)")
+
+def print_row(config, result):
+    label = " ".join("%s=%s" % (key, config[key]) for key in sorted(config) if config[key] != DEFAULTS[key]) or "defaults"
+    split = ", ".join("%s %.0f" % (phase, 100.0 * seconds / result["elapsed"]) for phase, seconds in sorted(result["timings"].items()))
+    print "%-40s %10.3f %12.0f %12.0f %10d   %s" % (label, result["elapsed"], result["candidates/s"], result["calls/s"], result["peak KB"], split)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="bet throughput benchmark")
+    for key, value in sorted(DEFAULTS.items()):
+        parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    parser.add_argument("--sweep", help="parameter=v1,v2,... to vary, e.g. fields=1,2,3,4")
+    options = vars(parser.parse_args(argv))
+    sweep = options.pop("sweep")
+    configs = [options]
+    if sweep:
+        key, values = sweep.split("=")
+        key = key.replace("-", "_")
+        configs = [dict(options, **{key: type(DEFAULTS[key])(value)}) for value in values.split(",")]
+    print_header()
+    for config in configs:
+        print_row(config, measure_in_child(config))
+
+if __name__ == "__main__":
+    main()
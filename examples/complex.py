@@ -8,7 +8,7 @@ that postcondition away, as there's no justification for redundant code.
 """
 
 
-from dbcbet.dbcbet import dbc, pre, post, inv, bet, finitize, finitize_method, throws
+from dbcbet.dbcbet import dbc, pre, post, inv, bet, finitize, finitize_method, throws, pure
 from dbcbet.helpers import argument_types
 import math
 from numbers import Number
@@ -22,6 +22,9 @@ from numbers import Number
 tolerance = 0.005
     
 def approx_equal(a, b, tol):
+    # relative error is meaningless near zero (cos(pi/2) is 6e-17, not 0)
+    if abs(a - b) < tol:
+        return True
     if a + b == 0:
         return a == b
     return (abs(a-b) / (abs(a)+abs(b))/2) < tol
@@ -105,10 +108,12 @@ class Complex(object):
     def imaginary_part(self):
         pass
 
+    @pure
     @post(magnitude_post)
     def magnitude(self):
         pass
 
+    @pure
     @post(angle_post)
     def angle(self):
         pass
@@ -259,6 +264,21 @@ def test_complex():
     bet(Polar).run()
     bet(Rectangular).run()
 
+def same_number(a, b):
+    """Complex numbers are equivalent when their parts agree, whatever their representation"""
+    if isinstance(a, Complex) and isinstance(b, Complex):
+        return (approx_equal(a.real_part(), b.real_part(), tolerance)
+                and approx_equal(a.imaginary_part(), b.imaginary_part(), tolerance))
+    return a == b
+
+def test_differential():
+    """Polar and Rectangular, enumerated once and compared call by call"""
+    rectangular_list.append(Rectangular(0,1))
+    rectangular_list.append(Rectangular(1,1))
+    bet.differential(Polar, Rectangular, equivalent=same_number,
+                     counterpart=lambda p: Rectangular(p.real_part(), p.imaginary_part()),
+                     methods=["add"]).run()
+
 # this is how python does main, just so you can see the stuff in action
 if __name__ == "__main__":
     test_complex()
@@ -0,0 +1,148 @@
+"""Measures what contracts cost before the first call: class decoration and import.
+
+Synthetic hierarchies of 10, 100 and 1000 classes are generated. Each
+class overrides a few contracted methods and declares an invariant; class
+i derives from class (i-1)/fanout, and every third class also mixes in one
+of a few contracted mixins, so the hierarchy contains diamonds.
+
+Two numbers are reported per size:
+ decoration: defining the classes in a loop, decorators included
+ import: importing a generated module with the same classes
+Both are compared with the same hierarchy written without contracts.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from dbcbet.dbcbet import inv, pre, post
+
+SIZES = [10, 100, 1000]
+METHODS = 4
+FANOUT = 4
+MIXINS = 3
+
+def positive(self, a):
+    return a > 0
+
+def non_negative_result(self, old, ret, a):
+    return ret >= 0
+
+def has_no_x_or_positive_x(self):
+    return getattr(self, "x", 1) > 0
+
+def make_method(i, m, contracted):
+    def method(self, a):
+        self.x = a + i + m
+        return self.x
+    method.__name__ = "method_%d" % m
+    if contracted:
+        method = pre(positive)(method)
+        method = post(non_negative_result)(method)
+    return method
+
+def make_mixins(contracted):
+    mixins = []
+    for k in xrange(MIXINS):
+        body = {"mixin_%d" % k: make_method(k, k, contracted)}
+        mixin = type("Mixin%d" % k, (object,), body)
+        if contracted:
+            mixin = inv(has_no_x_or_positive_x)(mixin)
+        mixins.append(mixin)
+    return mixins
+
+def bases_for(i, classes, mixins):
+    if i == 0:
+        return (object,)
+    parent = classes[(i - 1) // FANOUT]
+    mixin = mixins[i % MIXINS]
+    if i % 3 == 0 and mixin not in parent.__mro__:
+        return (parent, mixin)
+    return (parent,)
+
+def define_hierarchy(size, contracted):
+    mixins = make_mixins(contracted)
+    classes = []
+    for i in xrange(size):
+        body = dict(("method_%d" % m, make_method(i, m, contracted)) for m in xrange(METHODS))
+        clazz = type("Synthetic%d" % i, bases_for(i, classes, mixins), body)
+        if contracted:
+            clazz = inv(has_no_x_or_positive_x)(clazz)
+        classes.append(clazz)
+    return classes
+
+def time_decoration(size, contracted, repeat=3):
+    best = None
+    for r in xrange(repeat):
+        start = time.time()
+        define_hierarchy(size, contracted)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def module_source(size, contracted):
+    """The same hierarchy as define_hierarchy, written out as a module"""
+    lines = ["from dbcbet.dbcbet import inv, pre, post",
+             "from examples.decoration_cost import positive, non_negative_result, has_no_x_or_positive_x",
+             ""]
+    decorate = lambda line: line if contracted else None
+    for k in xrange(MIXINS):
+        lines += filter(None, [decorate("@inv(has_no_x_or_positive_x)"),
+                               "class Mixin%d(object):" % k,
+                               decorate("    @pre(positive)"),
+                               decorate("    @post(non_negative_result)"),
+                               "    def mixin_%d(self, a):" % k,
+                               "        self.x = a",
+                               "        return self.x",
+                               ""])
+    mros = []
+    for i in xrange(size):
+        if i == 0:
+            bases, mro = "object", set()
+        else:
+            parent = (i - 1) // FANOUT
+            bases, mro = "Synthetic%d" % parent, set(mros[parent]) | set(["Synthetic%d" % parent])
+            mixin = "Mixin%d" % (i % MIXINS)
+            if i % 3 == 0 and mixin not in mro:
+                bases += ", " + mixin
+                mro.add(mixin)
+        mros.append(mro)
+        lines += filter(None, [decorate("@inv(has_no_x_or_positive_x)"), "class Synthetic%d(%s):" % (i, bases)])
+        for m in xrange(METHODS):
+            lines += filter(None, [decorate("    @pre(positive)"),
+                                   decorate("    @post(non_negative_result)"),
+                                   "    def method_%d(self, a):" % m,
+                                   "        self.x = a + %d" % (i + m),
+                                   "        return self.x"])
+        lines.append("")
+    return "\n".join(lines)
+
+def time_import(size, contracted):
+    directory = tempfile.mkdtemp()
+    name = "synthetic_%d_%s" % (size, "contracted" if contracted else "plain")
+    try:
+        with open(os.path.join(directory, name + ".py"), "w") as module:
+            module.write(module_source(size, contracted))
+        sys.path.insert(0, directory)
+        # compile first, so only the import (class creation) is timed
+        import py_compile
+        py_compile.compile(os.path.join(directory, name + ".py"))
+        start = time.time()
+        __import__(name)
+        return time.time() - start
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop(name, None)
+        shutil.rmtree(directory)
+
+def main():
+    print "%8s %16s %16s %16s %16s" % ("classes", "decoration (s)", "plain (s)", "import (s)", "plain (s)")
+    for size in SIZES:
+        print "%8d %16.4f %16.4f %16.4f %16.4f" % (size,
+                                                   time_decoration(size, True), time_decoration(size, False),
+                                                   time_import(size, True), time_import(size, False))
+
+if __name__ == "__main__":
+    main()
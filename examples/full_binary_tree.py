@@ -1,8 +1,12 @@
 """A full binary tree example"""
 
-from dbcbet.dbcbet import pre, post, inv, bet, finitize, finitize_method
+from dbcbet.dbcbet import pre, post, inv, bet, sequence_bet, finitize, finitize_method
 from dbcbet.helpers import state, argument_types
 
+# the subtrees bet passes in, filled in once the class exists
+leaves = []
+replacements = []
+
 def full_tree_invariant(self):
     return self._leaf() or self._full()
 
@@ -35,28 +39,30 @@ class FullBinaryTree(object):
     def nodes(self):
         return 1 if self.leaf() else self.left_subtree.nodes() + self.right_subtree.nodes()
 
-    @pre(argument_types("examples.FullBinaryTree"))
+    @pre(argument_types("FullBinaryTree"))
     def add_left_subtree(self, left_subtree):
         self.left_subtree = left_subtree
 
-    @pre(argument_types("examples.FullBinaryTree"))
+    @pre(argument_types("FullBinaryTree"))
     def add_right_subtree(self, right_subtree):
         self.right_subtree = right_subtree
 
-    @pre(argument_types("examples.FullBinaryTree", "examples.FullBinaryTree"))
+    @pre(argument_types("FullBinaryTree", "FullBinaryTree"))
     @pre(state(is_leaf))
     @post(state(is_full))
+    @finitize_method(leaves, leaves)
     def add_subtrees(self, left, right):
         self.left_subtree = left
         self.right_subtree = right
         
     @pre(state(is_full))
-    @pre(argument_types("examples.FullBinaryTree"))
+    @pre(argument_types("FullBinaryTree"))
+    @finitize_method(replacements)
     def replace_left_subtree(self, left_subtree):
         self.left_subtree = left_subtree
 
     @pre(state(is_full))    
-    @pre(argument_types("examples.FullBinaryTree"))
+    @pre(argument_types("FullBinaryTree"))
     def replace_right_subtree(self, right_subtree):
         self.right_subtree = right_subtree
 
@@ -82,8 +88,8 @@ class FullBinaryTree(object):
     def _s(self, pad):
         ret = ""
         ret += "\n"+pad
-        ret += "  value: " + self.value
-        ret += "  # nodes: " + self.nodes()
+        ret += "  value: " + str(self.value)
+        ret += "  # nodes: " + str(self.nodes())
         if self.left_subtree:
             ret += '\n' + pad
             ret += "  left subtree: " + self.left_subtree._s(pad + "  ")
@@ -94,5 +100,10 @@ class FullBinaryTree(object):
         return ret
 
 if __name__ == "__main__":
+    leaves.append(FullBinaryTree(1))
+    replacements.extend([None, FullBinaryTree(2)])
     bet(FullBinaryTree).run()
+    # replace_left_subtree needs a full tree: sequences reach one through add_subtrees,
+    # rather than through the order in which bet happens to call the methods
+    sequence_bet(FullBinaryTree, depth=2).run()
     
@@ -13,19 +13,28 @@ penalty is unbound isn't terribly useful. This example looks at the
 minimum overhead, in absolute (rather than relative) terms.
 
 On my machine the overhead is 60 micro-seconds per method call.
+
+Run with --suite for the full benchmark suite: each contract component
+alone and combined, the cost of old as self grows, inheritance depth 1 to
+10, the helper combinators, and the exception paths through check_throws.
+Each case reports nanoseconds per call (min, median, mean, stdev over the
+repeats). --json writes the results; --baseline compares against an
+earlier --json file and exits with status 1 if any case got slower by
+more than --threshold percent.
 """
 
-from dbcbet.dbcbet import pre
+from dbcbet.dbcbet import pre, post, inv, throws
+from dbcbet.helpers import and_, or_, not_, args, argument_types
 import timeit
 
 class NoContracts(object):
     def does_nothing(self):
         pass
-    
+
 def empty_precondition(self):
     """Using this precondition wraps the method with the dbc infrastructure"""
     return True
-    
+
 class Contracted(object):
     @pre(empty_precondition)
     def does_nothing(self):
@@ -39,5 +48,211 @@ def main():
     with_contracts = timeit.Timer(c.does_nothing).timeit(number=number)
     print "call overhead (in seconds): " + str((with_contracts - without_contracts)/number)
 
+#
+# The benchmark suite
+#
+def true_pre(self, a):
+    return True
+
+def true_post(self, old, ret, a):
+    return True
+
+def true_inv(self):
+    return True
+
+def positive(value):
+    return value > 0
+
+def is_int(value):
+    return isinstance(value, int)
+
+class Allowed(Exception):
+    pass
+
+class NotAllowed(Exception):
+    pass
+
+class Plain(object):
+    def method(self, a):
+        return a
+
+class Pre(object):
+    @pre(true_pre)
+    def method(self, a):
+        return a
+
+class Post(object):
+    @post(true_post)
+    def method(self, a):
+        return a
+
+@inv(true_inv)
+class Inv(object):
+    def method(self, a):
+        return a
+
+class Throws(object):
+    @throws(Allowed)
+    def method(self, a):
+        return a
+
+@inv(true_inv)
+class Combined(object):
+    @pre(true_pre)
+    @post(true_post)
+    @throws(Allowed)
+    def method(self, a):
+        return a
+
+class Helpers(object):
+    @pre(and_(true_pre, true_pre))
+    def and_method(self, a):
+        return a
+
+    @pre(or_(not_(true_pre), true_pre))
+    def or_not_method(self, a):
+        return a
+
+    @pre(args(and_(positive, is_int)))
+    def args_method(self, a):
+        return a
+
+    @pre(argument_types(int))
+    def argument_types_method(self, a):
+        return a
+
+class Raises(object):
+    def underspecified(self, a):
+        raise Allowed()
+
+    @throws(Allowed)
+    def allowed(self, a):
+        raise Allowed()
+
+    @throws(Allowed)
+    def violation(self, a):
+        raise NotAllowed()
+
+def holder_with_size(size):
+    """A class whose instances carry size items, all copied for old"""
+    class Holder(object):
+        def __init__(self):
+            self.items = [[i] for i in xrange(size)]
+
+        @post(true_post)
+        def method(self, a):
+            return a
+    return Holder()
+
+def hierarchy_of_depth(depth):
+    """A chain of depth decorated classes, each adding pre, post and inv"""
+    clazz = object
+    for level in xrange(depth):
+        def method(self, a):
+            return a
+        body = {"method": pre(true_pre)(post(true_post)(method))}
+        clazz = inv(true_inv)(type("Level%d" % level, (clazz,), body))
+    return clazz()
+
+def swallow(method, exception):
+    def call(a):
+        try:
+            method(a)
+        except exception:
+            pass
+    return call
+
+def suite_cases():
+    """(name, callable taking one argument) for every case in the suite"""
+    from dbcbet.dbcbet import ThrowsViolation
+    helpers = Helpers()
+    raises = Raises()
+    cases = [
+        ("plain", Plain().method),
+        ("pre", Pre().method),
+        ("post", Post().method),
+        ("inv", Inv().method),
+        ("throws", Throws().method),
+        ("pre+post+inv+throws", Combined().method),
+        ("helpers/and_", helpers.and_method),
+        ("helpers/or_+not_", helpers.or_not_method),
+        ("helpers/args", helpers.args_method),
+        ("helpers/argument_types", helpers.argument_types_method),
+        ("exceptions/plain", swallow(Plain().method, Allowed)),
+        ("exceptions/underspecified", swallow(raises.underspecified, Allowed)),
+        ("exceptions/allowed", swallow(raises.allowed, Allowed)),
+        ("exceptions/throws-violation", swallow(raises.violation, ThrowsViolation)),
+        ]
+    for size in (0, 10, 100, 1000):
+        cases.append(("old/size-%d" % size, holder_with_size(size).method))
+    for depth in xrange(1, 11):
+        cases.append(("inheritance/depth-%d" % depth, hierarchy_of_depth(depth).method))
+    return cases
+
+def measure(function, number, repeat):
+    """Nanoseconds per call: min, median, mean and stdev over the repeats"""
+    timings = [t / number * 1e9 for t in timeit.Timer(lambda: function(1)).repeat(repeat=repeat, number=number)]
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    variance = sum((t - mean) ** 2 for t in timings) / len(timings)
+    middle = len(timings) // 2
+    median = timings[middle] if len(timings) % 2 else (timings[middle - 1] + timings[middle]) / 2
+    return {"min": timings[0], "median": median, "mean": mean, "stdev": variance ** 0.5}
+
+def run_suite(number=2000, repeat=7, only=None):
+    results = {}
+    for name, function in suite_cases():
+        if only is None or only in name:
+            results[name] = measure(function, number, repeat)
+    return results
+
+def print_results(results):
+    print "%-32s %12s %12s %12s %12s" % ("case (ns/call)", "min", "median", "mean", "stdev")
+    for name in sorted(results):
+        r = results[name]
+        print "%-32s %12.0f %12.0f %12.0f %12.0f" % (name, r["min"], r["median"], r["mean"], r["stdev"])
+
+def regressions(results, baseline, threshold):
+    """Cases whose minimum got more than threshold percent slower than in baseline"""
+    slower = []
+    for name in sorted(results):
+        if name in baseline:
+            before, after = baseline[name]["min"], results[name]["min"]
+            change = (after - before) / before * 100.0
+            if change > threshold:
+                slower.append((name, before, after, change))
+    return slower
+
+def suite_main(argv=None):
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(description="dbcbet contract overhead benchmark suite")
+    parser.add_argument("--suite", action="store_true", help="run the full suite (this is implied by the other options)")
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=7, help="timings per case")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results written earlier with --json")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent slowdown that counts as a regression")
+    options = parser.parse_args(argv)
+
+    results = run_suite(options.number, options.repeat, options.only)
+    print_results(results)
+    if options.json:
+        with open(options.json, "w") as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as previous:
+            slower = regressions(results, json.load(previous), options.threshold)
+        for name, before, after, change in slower:
+            print "REGRESSION %s: %.0f ns -> %.0f ns (%+.1f%%)" % (name, before, after, change)
+        if slower:
+            sys.exit(1)
+
 if __name__ == "__main__":
-    main()
+    import sys
+    if len(sys.argv) > 1:
+        suite_main()
+    else:
+        main()